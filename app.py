@@ -4,6 +4,10 @@
 # Load environment variables from .env file  
 from dotenv import load_dotenv 
 load_dotenv()  
+  
+# Configure logging before the other modules start logging at import time  
+from utils.logging_utils import configure_logging, log_payload, get_recent_payloads, LOG_PAYLOAD_BUFFER_SIZE  
+configure_logging()  
 
 
 import os  
@@ -12,17 +16,19 @@ from aiohttp import web
 from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, TurnContext  
 from botbuilder.schema import Activity, ActivityTypes  
  
-from utils.openai_utils import get_openai_response  
+from utils.openai_client_utils import close_openai_clients  
+from utils.http_utils import close_http_resources, run_blocking  
+from utils.batch_writer_utils import shutdown_batch_writers  
+from utils.pdf_utils import shutdown_pdf_process_pool  
+from utils.slack_reaction_utils import drain_reaction_tasks  
+from utils.metrics_utils import track_turn, set_turn_labels, span, render_metrics  
+from utils.turn_queue_utils import turn_queue, FAST_ACK_ENABLED  
 from message_handlers.slack_handler import handle_slack_message  
 from message_handlers.default_handler import handle_default_message  
 from constants import *  
 from utils.uploaded_file_utils import handle_image_attachment, handle_text_attachment, handle_pdf_attachment  
-from utils.datetime_utils import get_current_time, calculate_elapsed_time  
-from utils.footer_utils import generate_footer  
 import json  
   
-# Configure logging  
-logging.basicConfig(level=logging.DEBUG)  
   
  
 # Configuration  
@@ -51,75 +57,136 @@ async def on_error(context: TurnContext, error: Exception):
   
 adapter.on_turn_error = on_error  
   
-# Function to handle incoming requests on /api/messages  
-
-
-
-
-async def handle_message(request):  
-    # Start timing before processing the request  
-    start_time = get_current_time()  
+# Bot logic for one turn  
+async def on_turn(turn_context: TurnContext):  
+    # Log the received message  
+    logging.debug(f"Received message: {turn_context.activity.text}")  
+  
+    # Check if the activity is a message activity  
+    if turn_context.activity.type == ActivityTypes.message:  
+        if turn_context.activity.channel_id == "slack":  
+            set_turn_labels(handler="slack")  
+            logging.debug("Sending message %s to slack_handler.py", turn_context.activity.id)  
+            # Pass the TurnContext to slack_handler  
+            await handle_slack_message(turn_context)  
+        else:  
+            user_message = turn_context.activity.text  
+  
+            # Check for attachments  
+            if turn_context.activity.attachments:  
+                set_turn_labels(handler="attachment")  
+                for attachment in turn_context.activity.attachments:  
+                    logging.debug(f"Processing attachment: {attachment.content_type}")  
+                    if attachment.content_type.startswith("image/"):  
+                        await handle_image_attachment(turn_context, attachment)  
+                    elif attachment.content_type == "text/plain":  
+                        await handle_text_attachment(turn_context, attachment)  
+                    elif attachment.content_type == "application/pdf":  
+                        await handle_pdf_attachment(turn_context, attachment)  
+            else:  
+                # Route to default handler for OpenAI response  
+                set_turn_labels(handler="default")  
+                await handle_default_message(turn_context)  
+    else:  
+        set_turn_labels(handler="event")  
+        await turn_context.send_activity(MSG_EVENT_DETECTED.format(turn_context.activity.type))  
   
+async def parse_activity(request):  
     # Get the activity from the request  
-    body = await request.json()  
-    activity = Activity().deserialize(body)  
+    with span("deserialize"):  
+        body = await request.json()  
+        activity = Activity().deserialize(body)  
+        set_turn_labels(channel=activity.channel_id)  
   
-    # Log the incoming activity  
-    logging.debug(f"Received activity: {activity.as_dict()}")  
+    # Keep the incoming activity (logged in full only when sampled)  
+    log_payload("activity", body, "Received activity")  
+    return activity  
   
-    # Set the response headers  
-    headers = {"Content-Type": "application/json"}  
+# Function to handle incoming requests on /api/messages  
+async def handle_message(request):  
+    if FAST_ACK_ENABLED:  
+        return await enqueue_message(request)  
   
-    # Bypass authentication for local testing  
-    auth_header = request.headers.get("Authorization", "")  
+    # Time the whole turn; phases recorded further down are attributed to it  
+    with track_turn():  
+        activity = await parse_activity(request)  
   
-    # Process the activity and send a response  
-    async def response(turn_context: TurnContext):  
-        # Log the received message  
-        logging.debug(f"Received message: {turn_context.activity.text}")  
-  
-        # Check if the activity is a message activity  
-        if turn_context.activity.type == ActivityTypes.message:  
-            if turn_context.activity.channel_id == "slack":  
-                logging.debug(f"Sending message to slack_handler.py with activity: {activity.as_dict()}")  
-                # Pass the TurnContext to slack_handler  
-                await handle_slack_message(turn_context)  
-            else:  
-                user_message = turn_context.activity.text  
-  
-                # Check for attachments  
-                if turn_context.activity.attachments:  
-                    for attachment in turn_context.activity.attachments:  
-                        logging.debug(f"Processing attachment: {attachment.content_type}")  
-                        if attachment.content_type.startswith("image/"):  
-                            await handle_image_attachment(turn_context, attachment)  
-                        elif attachment.content_type == "text/plain":  
-                            await handle_text_attachment(turn_context, attachment)  
-                        elif attachment.content_type == "application/pdf":  
-                            await handle_pdf_attachment(turn_context, attachment)  
-                else:  
-                    # Route to default handler for OpenAI response  
-                    await handle_default_message(turn_context)  
-        else:  
-            await turn_context.send_activity(MSG_EVENT_DETECTED.format(turn_context.activity.type))  
+        # Bypass authentication for local testing  
+        auth_header = request.headers.get("Authorization", "")  
   
-        # Calculate the response time  
-        response_time = calculate_elapsed_time(start_time)  
+        # Process the activity and send a response  
+        await adapter.process_activity(activity, auth_header, on_turn)  
   
-        # Generate the footer with the response time  
-        footer = generate_footer(turn_context.activity.channel_id, response_time)  
-        logging.debug(f"Generated footer: {footer}")  
+    # Return a web response  
+    return web.Response(text="OK", headers={"Content-Type": "application/json"})  
+  
+# Fast-ack mode: validate, queue the turn per conversation, and answer right away  
+async def enqueue_message(request):  
+    try:  
+        activity = await parse_activity(request)  
+    except Exception as e:  
+        logging.error(f"Rejecting malformed activity: {e}")  
+        return web.Response(status=400, text="Bad Request")  
+    if not activity.type or activity.conversation is None or not activity.conversation.id:  
+        return web.Response(status=400, text="Bad Request")  
+  
+    # Check the Bot Framework JWT before the turn takes queue capacity or the sender gets a 200  
+    auth_header = request.headers.get("Authorization", "")  
+    try:  
+        identity = await adapter._authenticate_request(activity, auth_header)  
+    except Exception as e:  
+        logging.warning(f"Rejecting unauthenticated activity: {e}")  
+        return web.Response(status=401, text="Unauthorized")  
   
-    # Process the activity  
-    await adapter.process_activity(activity, auth_header, response)  
+    async def run_queued_turn():  
+        with track_turn(channel=activity.channel_id):  
+            await adapter.process_activity_with_identity(activity, identity, on_turn)  
   
-    # Return a web response  
-    return web.Response(text="OK", headers=headers)  
+    if not turn_queue.submit(activity.conversation.id, run_queued_turn):  
+        # Not queued and not claimed for dedup, so the sender's retry will be processed  
+        return web.Response(status=503, text="Busy")  
+    return web.Response(text="OK", headers={"Content-Type": "application/json"})  
   
 # Create the aiohttp application and add the routes  
 app = web.Application()  
 app.router.add_post("/api/messages", handle_message)  
   
+# Expose turn and phase latency histograms for Prometheus  
+async def handle_metrics(request):  
+    return web.Response(  
+        body=render_metrics().encode("utf-8"),  
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}  
+    )  
+  
+app.router.add_get("/metrics", handle_metrics)  
+  
+# Recent full payloads from the in-memory ring buffer, only when a debug token is configured  
+DEBUG_PAYLOADS_TOKEN = os.environ.get("APPSETTING_DEBUG_PAYLOADS_TOKEN")  
+  
+async def handle_debug_payloads(request):  
+    if not DEBUG_PAYLOADS_TOKEN or request.headers.get("X-Debug-Token") != DEBUG_PAYLOADS_TOKEN:  
+        raise web.HTTPNotFound()  
+    kind = request.query.get("kind")  
+    try:  
+        limit = int(request.query.get("limit", "50"))  
+    except ValueError:  
+        return web.Response(status=400, text="limit must be an integer")  
+    limit = max(1, min(limit, LOG_PAYLOAD_BUFFER_SIZE))  
+    return web.json_response(get_recent_payloads(kind, limit), dumps=lambda obj: json.dumps(obj, default=str))  
+  
+app.router.add_get("/debug/payloads", handle_debug_payloads)  
+  
+# Close the shared OpenAI / HTTP connection pools when the app shuts down  
+async def on_cleanup(app):  
+    await turn_queue.drain()  # finish queued turns while the clients they need are still open  
+    await drain_reaction_tasks()  
+    await run_blocking(shutdown_batch_writers)  # flush queued DB writes before the pools go away  
+    await run_blocking(shutdown_pdf_process_pool)  
+    await close_openai_clients()  
+    await close_http_resources()  
+  
+app.on_cleanup.append(on_cleanup)  
+  
 # Run the application  
 if __name__ == "__main__":  
     web.run_app(app, port=PORT)  
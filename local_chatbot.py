@@ -1,5 +1,7 @@
 import os  
 from flask import Flask, request, jsonify, render_template  
+from utils.logging_utils import configure_logging  
+configure_logging()  
 import utils.openai_utils as openai_utils  
 import json  
 import time  
@@ -51,10 +53,8 @@ def chat():
             prompt_tokens = total_tokens // 2  # Rough split between prompt and completion tokens  
             completion_tokens = total_tokens - prompt_tokens  
         elif content_type == "application/pdf":  
-            # Handle PDF files  
-            with open("temp.pdf", "wb") as pdf_file:  
-                pdf_file.write(file_content)  
-            pdf_text = openai_utils.extract_text_from_pdf("temp.pdf")  
+            # Handle PDF files straight from the uploaded bytes  
+            pdf_text = openai_utils.extract_text_from_pdf(file_content)  
             if pdf_text:  
                 attempt_sizes = [5000, 6000, 7000]  
                 summary_with_processing_summary = openai_utils.process_and_summarize_text(pdf_text, "PDF file", attempt_sizes)  
@@ -1,15 +1,13 @@
 import logging  
 from botbuilder.core import TurnContext  
 from botbuilder.schema import Attachment, Activity, ActivityTypes  
-from utils.openai_utils import get_openai_response  
+from utils.openai_utils import get_openai_response_async  
 from utils.footer_utils import generate_footer  
 from utils.datetime_utils import get_current_time, calculate_elapsed_time  
 from utils.uploaded_file_utils import handle_image_attachment, handle_text_attachment, handle_pdf_attachment  
 from utils.special_commands_utils import handle_special_commands  
 from constants import *  
-import json  
-  
-logging.basicConfig(level=logging.DEBUG)  
+from utils.logging_utils import log_payload, LazyJson  
   
 def create_adaptive_card(main_message: str, footer: str) -> Attachment:  
     card_json = {  
@@ -68,9 +66,8 @@ async def handle_default_message(turn_context: TurnContext):
         start_time = get_current_time()  
   
         # Get response from OpenAI with source parameter  
-        openai_response_data, model_name = get_openai_response(user_message, source="from_default_handler")  
-        logging.debug("Full JSON response from OpenAI:")  
-        logging.debug(json.dumps(openai_response_data, indent=2))  
+        openai_response_data, model_name = await get_openai_response_async(user_message, source="from_default_handler")  
+        log_payload("openai_response", openai_response_data, "Full JSON response from OpenAI")  
   
         # Extract token usage from the response  
         input_tokens = openai_response_data.get('usage', {}).get('prompt_tokens', 0)  
@@ -97,11 +94,11 @@ async def handle_default_message(turn_context: TurnContext):
         response_time = calculate_elapsed_time(start_time)  
   
         # Generate the footer with the response time and token counts  
-        footer = generate_footer("webchat", response_time, model_name, input_tokens, output_tokens)  
+        footer = generate_footer("webchat", response_time, model_name, input_tokens, output_tokens, cached=openai_response_data.get("cached", False))  
   
         # Create an Adaptive Card with the response and footer  
         adaptive_card = create_adaptive_card(bot_response, footer)  
-        logging.debug(f"Adaptive Card: {json.dumps(adaptive_card.content, indent=2)}")  
+        logging.debug("Adaptive Card: %s", LazyJson(adaptive_card.content, indent=2))  
   
         # Send the Adaptive Card as a response  
         await turn_context.send_activity(Activity(type=ActivityTypes.message, attachments=[adaptive_card]))  
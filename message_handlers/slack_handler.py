@@ -1,13 +1,10 @@
 import logging  
 from botbuilder.core import TurnContext  
-from utils.openai_utils import get_openai_response  
+from utils.openai_utils import get_openai_response_async, stream_openai_response_async  
 from constants import *  
 from utils.uploaded_file_utils import handle_image_attachment, handle_text_attachment, handle_pdf_attachment  
 from utils.slack_utils import (  
-    post_message_to_slack,  
-    get_conversation_replies,  
-    add_reaction_to_message,  
-    remove_reaction_from_message,  
+    post_message_to_slack_async,  
     create_slack_message,  
     parse_chat_history,  
     convert_openai_response_to_slack_mrkdwn,  
@@ -16,10 +13,17 @@ from utils.slack_utils import (
 from utils.footer_utils import generate_footer  
 from utils.datetime_utils import get_current_time, calculate_elapsed_time  
 from utils.special_commands_utils import handle_special_commands  
-from utils.azure_postgres_utils import log_invocation_to_db  
-import json  
+from utils.azure_postgres_utils import enqueue_invocation_log  
 import os  
 from utils.approved_users import is_user_approved  
+from utils.token_utils import update_thread_token_total  
+from utils.context_window_utils import fit_chat_history  
+from utils.slack_history_utils import get_thread_messages, record_thread_message, record_thread_responses  
+from utils.slack_streaming_utils import SlackStreamingMessage, SLACK_STREAMING_ENABLED  
+from utils.slack_reaction_utils import SlackReactions  
+from utils.metrics_utils import span  
+from utils.slack_dedup_utils import get_slack_event_key, is_duplicate_slack_event, finish_slack_event  
+from utils.logging_utils import log_payload  
   
 SLACK_TOKEN = os.environ.get("APPSETTING_SLACK_TOKEN")  
   
@@ -56,27 +60,43 @@ def get_event_ts(activity):
         logging.error("Event timestamp (ts) is None, cannot proceed.")  
         return None  
   
-def add_reaction(token, channel, timestamp, reaction):  
-    response = add_reaction_to_message(token, channel, timestamp, reaction)  
-    if not response.get("ok"):  
-        logging.error(f"Failed to add reaction: {response.get('error')}")  
-    return response  
-  
-def remove_reaction(token, channel, timestamp, reaction):  
-    response = remove_reaction_from_message(token, channel, timestamp, reaction)  
-    if not response.get("ok"):  
-        logging.error(f"Failed to remove reaction: {response.get('error')}")  
-    return response  
-  
-def fetch_conversation_history(token, channel, thread_ts, bot_user_id):  
-    conversation_history = get_conversation_replies(token, channel, thread_ts)  
+async def fetch_conversation_history(token, channel, thread_ts, bot_user_id):  
+    conversation_history = await get_thread_messages(token, channel, thread_ts)  
     if conversation_history.get("ok"):  
-        logging.debug(f"Conversation history: {conversation_history['messages']}")  
+        log_payload("slack_history", conversation_history["messages"], "Conversation history")  
         return parse_chat_history(conversation_history["messages"], bot_user_id)  
     else:  
         logging.error(f"Error fetching conversation history: {conversation_history.get('error')}")  
         return [{"role": "system", "content": "This is the first and only message in this chat."}]  
   
+async def stream_reply_to_slack(user_message, chat_history, channel_id, thread_ts, user_mention):  
+    """Stream the OpenAI reply into Slack, editing a placeholder message as tokens arrive."""  
+    start_time = get_current_time()  
+    streaming_message = SlackStreamingMessage(SLACK_TOKEN, channel_id, thread_ts, prefix=user_mention)  
+    streaming_message.start()  
+  
+    model_name, usage, cached = None, {}, False  
+    logging.debug("Calling stream_openai_response_async")  
+    async for event in stream_openai_response_async(user_message, chat_history=chat_history, source="from_slack_handler"):  
+        if "delta" in event:  
+            await streaming_message.append(event["delta"])  
+        elif event.get("done"):  
+            model_name, usage, cached = event.get("model"), event.get("usage", {}), event.get("cached", False)  
+            if event.get("error"):  
+                await streaming_message.append(event["error"])  
+    logging.debug("Returned from stream_openai_response_async")  
+  
+    input_tokens = usage.get('prompt_tokens', 0)  
+    output_tokens = usage.get('completion_tokens', 0)  
+    logging.debug(f"Token usage - Prompt tokens: {input_tokens}, Completion tokens: {output_tokens}")  
+  
+    response_time = calculate_elapsed_time(start_time)  
+    footer = generate_footer("slack", response_time, model_name, input_tokens, output_tokens, cached=cached)  
+    logging.debug(f"Generated footer: {footer}")  
+    response_data_list = await streaming_message.finish(footer)  
+    record_thread_responses(channel_id, thread_ts, response_data_list)  
+    return response_data_list  
+  
 async def handle_attachments(turn_context, attachments, thread_ts):  
     for attachment in attachments:  
         logging.debug(f"Processing attachment: {attachment.content_type}")  
@@ -89,8 +109,19 @@ async def handle_attachments(turn_context, attachments, thread_ts):
   
 async def handle_slack_message(turn_context: TurnContext):  
     activity = turn_context.activity  
+    reactions = None  
+    succeeded = False  
+    claimed_event = None  
+    failed = False  # only the except blocks set this; the early returns still count as handled  
     try:  
         logging.debug("Payload passed from app.py via slack_handler.py")  
+        # Slack redelivers events it didn't see acked in time; handle each one only once  
+        with span("dedup_check"):  
+            event_key = get_slack_event_key(activity)  
+            if await is_duplicate_slack_event(event_key):  
+                return  
+            claimed_event = event_key  
+  
         user_message = activity.text  
         logging.debug("Received message")  
   
@@ -131,7 +162,8 @@ async def handle_slack_message(turn_context: TurnContext):
             "channeldata_slack_thread_ts": get_parent_thread_ts(activity),  
             "created_via": created_via  
         }  
-        log_invocation_to_db(invocation_data)  
+        with span("db_log"):  
+            enqueue_invocation_log(invocation_data)  
   
         if await handle_special_commands(turn_context):  
             return  
@@ -150,12 +182,15 @@ async def handle_slack_message(turn_context: TurnContext):
         if not event_ts:  
             return  
         logging.debug(f"Using event_ts for reactions: {event_ts}")  
+        record_thread_message(channel_id, thread_ts, slack_event)  
   
-        add_reaction(SLACK_TOKEN, channel_id, event_ts, "hourglass")  
+        reactions = SlackReactions(SLACK_TOKEN, channel_id, event_ts)  
+        reactions.start()  
         user_id = get_user_id(activity)  
         if user_id:  
             user_mention = f"<@{user_id}>"  
-            is_approved = is_user_approved(user_id)  
+            with span("acl_check"):  
+                is_approved = is_user_approved(user_id)  
             if is_approved:  
                 logging.info(f"User {user_id} is approved.")  
             else:  
@@ -163,20 +198,33 @@ async def handle_slack_message(turn_context: TurnContext):
         else:  
             user_mention = "User"  
   
-        chat_history = fetch_conversation_history(SLACK_TOKEN, channel_id, thread_ts, activity.recipient.id)  
+        with span("history_fetch"):  
+            chat_history = await fetch_conversation_history(SLACK_TOKEN, channel_id, thread_ts, activity.recipient.id)  
+        thread_token_total = update_thread_token_total((channel_id, thread_ts), chat_history)  
+        logging.debug(f"Thread {thread_ts} history is {thread_token_total} tokens")  
+        if not activity.attachments:  
+            with span("context_window"):  
+                chat_history = await fit_chat_history((channel_id, thread_ts), chat_history, total_tokens=thread_token_total)  
         if activity.attachments:  
             await handle_attachments(turn_context, activity.attachments, thread_ts)  
+        elif SLACK_STREAMING_ENABLED:  
+            with span("openai_stream"):  
+                response_data_list = await stream_reply_to_slack(user_message, chat_history, channel_id, thread_ts, user_mention)  
+            for response_data in response_data_list:  
+                if not response_data.get("ok"):  
+                    await turn_context.send_activity(response_data.get("error", "An error occurred while posting the message to Slack."))  
+                    break  
         else:  
             start_time = get_current_time()  
-            logging.debug("Calling get_openai_response")  
-            openai_response_data, model_name = get_openai_response(user_message, chat_history=chat_history, source="from_slack_handler")  
-            logging.debug("Returned from get_openai_response")  
+            logging.debug("Calling get_openai_response_async")  
+            with span("openai_call"):  
+                openai_response_data, model_name = await get_openai_response_async(user_message, chat_history=chat_history, source="from_slack_handler")  
+            logging.debug("Returned from get_openai_response_async")  
   
-            logging.debug("Full JSON response from OpenAI:")  
-            logging.debug(json.dumps(openai_response_data, indent=2))  
+            log_payload("openai_response", openai_response_data, "Full JSON response from OpenAI")  
   
             bot_response = openai_response_data['choices'][0]['message']['content']  
-            logging.debug(f"OpenAI response: {bot_response}")  
+            logging.debug("OpenAI response: %s", bot_response)  
   
             # Ensure token usage is correctly extracted  
             usage = openai_response_data.get('usage', {})  
@@ -184,32 +232,35 @@ async def handle_slack_message(turn_context: TurnContext):
             output_tokens = usage.get('completion_tokens', 0)  
             logging.debug(f"Token usage - Prompt tokens: {input_tokens}, Completion tokens: {output_tokens}")  
   
-            formatted_bot_response = convert_openai_response_to_slack_mrkdwn(bot_response)  
+            with span("mrkdwn_render"):  
+                formatted_bot_response = convert_openai_response_to_slack_mrkdwn(bot_response)  
             response_time = calculate_elapsed_time(start_time)  
   
-            footer = generate_footer("slack", response_time, model_name, input_tokens, output_tokens)  
+            footer = generate_footer("slack", response_time, model_name, input_tokens, output_tokens, cached=openai_response_data.get("cached", False))  
             logging.debug(f"Generated footer: {footer}")  
   
             full_response = f"{user_mention} {formatted_bot_response}"  
-            slack_message = create_slack_message(full_response, footer)  
-            logging.debug(f"Slack message: {slack_message}")  
-  
-            response_data_list = post_message_to_slack(  
-                token=SLACK_TOKEN,  
-                channel=channel_id,  
-                text=full_response,  
-                blocks=slack_message['blocks'],  
-                thread_ts=thread_ts  
-            )  
+            slack_message = create_slack_message(full_response, footer, is_rendered=True)  
+            log_payload("slack_message", slack_message, "Slack message")  
+  
+            with span("slack_post"):  
+                response_data_list = await post_message_to_slack_async(  
+                    token=SLACK_TOKEN,  
+                    channel=channel_id,  
+                    text=full_response,  
+                    blocks=slack_message['blocks'],  
+                    thread_ts=thread_ts  
+                )  
+            record_thread_responses(channel_id, thread_ts, response_data_list)  
             for response_data in response_data_list:  
                 if not response_data.get("ok"):  
                     await turn_context.send_activity(response_data.get("error", "An error occurred while posting the message to Slack."))  
                     break  
   
-        remove_reaction(SLACK_TOKEN, channel_id, event_ts, "hourglass")  
-        add_reaction(SLACK_TOKEN, channel_id, event_ts, "white_check_mark")  
+        succeeded = True  
   
     except (KeyError, TypeError) as e:  
+        failed = True  
         logging.error(f"Error processing OpenAI response: {e}")  
         await turn_context.send_activity(SLACK_MSG_ERROR)  
         await turn_context.send_activity(SLACK_MSG_FIX_BOT)  
@@ -217,8 +268,17 @@ async def handle_slack_message(turn_context: TurnContext):
         await turn_context.send_activity(f"Footer: {footer}")  
   
     except Exception as e:  
+        failed = True  
         logging.error(f"Error in handle_slack_message: {e}")  
         await turn_context.send_activity(SLACK_MSG_ERROR)  
         await turn_context.send_activity(SLACK_MSG_FIX_BOT)  
         footer = generate_footer("slack", 0)  
         await turn_context.send_activity(f"Footer: {footer}")  
+  
+    finally:  
+        # Whatever happened above, don't leave the hourglass on the user's message  
+        if reactions is not None:  
+            reactions.finish(success=succeeded)  
+        # Release the claim on failure so Slack's redelivery isn't dropped as a duplicate  
+        if claimed_event:  
+            await finish_slack_event(claimed_event, completed=not failed)  
@@ -0,0 +1,119 @@
+# tests/test_completion_cache_utils.py
+import asyncio
+import pytest
+from utils import completion_cache_utils as cache
+
+
+@pytest.fixture(autouse=True)
+def memory_only_cache(monkeypatch):
+    monkeypatch.setattr(cache, "COMPLETION_CACHE_ENABLED", True)
+    monkeypatch.setattr(cache, "COMPLETION_CACHE_DB_ENABLED", False)
+    monkeypatch.setattr(cache, "_memory_cache", cache.OrderedDict())
+
+
+def _request(question="What is our PTO policy?", **overrides):
+    request = {
+        "model": "gpt-4o",
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": question}
+        ],
+        "temperature": 0.2,
+        "max_tokens": 800
+    }
+    request.update(overrides)
+    return request
+
+
+def _count(result):
+    return cache.get_completion_cache_stats().get(result, 0)
+
+
+def _response(content="Twenty days a year."):
+    return {"choices": [{"message": {"content": content}}], "usage": {"prompt_tokens": 20, "completion_tokens": 5}}
+
+
+def test_disabled_cache_never_builds_a_key(monkeypatch):
+    monkeypatch.setattr(cache, "COMPLETION_CACHE_ENABLED", False)
+    assert cache.completion_cache_key(_request()) is None
+
+
+def test_key_ignores_whitespace_differences():
+    assert cache.completion_cache_key(_request("What is our  PTO\npolicy? ")) == cache.completion_cache_key(_request())
+
+
+@pytest.mark.parametrize("change", [
+    {"model": "gpt-35-turbo"},
+    {"temperature": 0.0},
+    {"max_tokens": 400},
+    {"stop": ["\n"]},
+    {"messages": [{"role": "system", "content": "Be terse."}, {"role": "user", "content": "What is our PTO policy?"}]},
+])
+def test_key_changes_with_anything_that_changes_the_answer(change):
+    assert cache.completion_cache_key(_request(**change)) != cache.completion_cache_key(_request())
+
+
+@pytest.mark.parametrize("request_kwargs", [
+    _request(temperature=0.9),
+    _request(messages=[
+        {"role": "user", "content": "Hi"},
+        {"role": "assistant", "content": "Hello!"},
+        {"role": "user", "content": "What is our PTO policy?"}
+    ]),
+    _request(messages=[{"role": "user", "content": [
+        {"type": "text", "text": "What is in this image?"},
+        {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,AAAA"}}
+    ]}]),
+])
+def test_uncacheable_requests_bypass_the_cache(request_kwargs):
+    before = _count("bypass")
+    assert cache.completion_cache_key(request_kwargs) is None
+    assert _count("bypass") == before + 1
+
+
+def test_stored_completion_is_returned_as_a_copy_marked_cached():
+    key = cache.completion_cache_key(_request())
+    before_miss, before_hit = _count("miss"), _count("hit_memory")
+    assert cache.get_cached_completion(key) is None
+    cache.store_completion(key, _response(), "gpt-4o")
+
+    response, model_name = cache.get_cached_completion(key)
+    assert model_name == "gpt-4o"
+    assert response["cached"] is True
+    assert response["choices"][0]["message"]["content"] == "Twenty days a year."
+    response["choices"][0]["message"]["content"] = "changed"
+    assert cache.get_cached_completion(key)[0]["choices"][0]["message"]["content"] == "Twenty days a year."
+    assert (_count("miss"), _count("hit_memory")) == (before_miss + 1, before_hit + 2)
+
+
+def test_async_lookup_hits_memory():
+    key = cache.completion_cache_key(_request())
+    cache.store_completion(key, _response(), "gpt-4o")
+    response, _ = asyncio.run(cache.get_cached_completion_async(key))
+    assert response["cached"] is True
+
+
+def test_failed_completions_are_not_stored():
+    key = cache.completion_cache_key(_request())
+    cache.store_completion(key, {"error": "content_filter"}, "gpt-4o")
+    assert cache.get_cached_completion(key) is None
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    monkeypatch.setattr(cache, "COMPLETION_CACHE_TTL", -1)
+    key = cache.completion_cache_key(_request())
+    cache.store_completion(key, _response(), "gpt-4o")
+    assert cache.get_cached_completion(key) is None
+    assert cache.get_completion_cache_stats()["memory_entries"] == 0
+
+
+def test_memory_tier_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(cache, "COMPLETION_CACHE_SIZE", 2)
+    keys = [cache.completion_cache_key(_request(f"Question {i}?")) for i in range(3)]
+    cache.store_completion(keys[0], _response(), "gpt-4o")
+    cache.store_completion(keys[1], _response(), "gpt-4o")
+    assert cache.get_cached_completion(keys[0]) is not None  # now the most recently used
+    cache.store_completion(keys[2], _response(), "gpt-4o")
+    assert cache.get_cached_completion(keys[1]) is None
+    assert cache.get_cached_completion(keys[0]) is not None
+    assert cache.get_cached_completion(keys[2]) is not None
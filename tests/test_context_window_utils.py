@@ -0,0 +1,114 @@
+# tests/test_context_window_utils.py
+import asyncio
+import pytest
+
+try:
+    from utils import context_window_utils as window
+except Exception as e:  # token_utils needs tiktoken's encoding
+    pytest.skip(f"tiktoken encoding unavailable: {e}", allow_module_level=True)
+
+
+class FakeSummarizer:
+    """Stands in for the context_summary completion; records every transcript it's asked to fold."""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    async def __call__(self, prompt, instruction, handler="summarize_map"):
+        self.calls.append(prompt)
+        if self.fail:
+            return None, None
+        return f"summary#{len(self.calls)}", {}
+
+
+@pytest.fixture
+def summarizer(monkeypatch):
+    fake = FakeSummarizer()
+    monkeypatch.setattr(window, "summarize_text_with_openai_async", fake)
+    # One token per word keeps the budgets easy to reason about
+    monkeypatch.setattr(window, "count_tokens_cached", lambda texts: [len(text.split()) for text in texts])
+    monkeypatch.setattr(window, "chunk_text", lambda text, size: [text])
+    monkeypatch.setattr(window, "CONTEXT_WINDOW_TOKEN_BUDGET", 100)
+    monkeypatch.setattr(window, "CONTEXT_SUMMARY_MAX_TOKENS", 20)
+    monkeypatch.setattr(window, "_thread_summaries", window.OrderedDict())
+    return fake
+
+
+def _turns(count, words=17):
+    # 17 words + 3 tokens of per-message overhead = 20 tokens per turn
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"turn{i} " + "word " * (words - 1)}
+        for i in range(count)
+    ]
+
+
+def test_recent_start_keeps_what_fits_counting_back_from_the_newest():
+    assert window._recent_start([10, 10, 10, 10], 25) == 2
+    assert window._recent_start([10, 10, 10, 10], 40) == 0
+    assert window._recent_start([5, 50], 10) == 1  # the newest message is always kept
+    assert window._recent_start([], 10) == 0
+
+
+def test_short_threads_are_returned_untouched(summarizer):
+    history = _turns(4)
+    assert asyncio.run(window.fit_chat_history(("C1", "1.0"), history)) is history
+    assert asyncio.run(window.fit_chat_history(("C1", "1.0"), history, total_tokens=80)) is history
+    assert summarizer.calls == []
+
+
+def test_long_thread_folds_old_turns_into_a_summary(summarizer):
+    history = _turns(10)
+    fitted = asyncio.run(window.fit_chat_history(("C1", "1.0"), history))
+    # 100 - 20 tokens for the summary leaves room for 4 turns of 20 tokens
+    assert fitted[0] == {"role": "system", "content": window.CONTEXT_SUMMARY_HEADER + "summary#1"}
+    assert fitted[1:] == history[6:]
+    assert len(summarizer.calls) == 1 and "turn5" in summarizer.calls[0] and "turn6" not in summarizer.calls[0]
+    state = window._thread_summaries[("C1", "1.0")]
+    assert state["folded"] == 6 and state["summary"] == "summary#1"
+    assert state["last_hash"] == window._message_hash(history[5])
+
+
+def test_summary_is_only_extended_with_newly_aged_out_turns(summarizer):
+    history = _turns(10)
+    asyncio.run(window.fit_chat_history(("C1", "1.0"), history))
+    # The same history again needs no new summarization call
+    asyncio.run(window.fit_chat_history(("C1", "1.0"), history))
+    assert len(summarizer.calls) == 1
+
+    history += _turns(2)
+    fitted = asyncio.run(window.fit_chat_history(("C1", "1.0"), history))
+    assert len(summarizer.calls) == 2
+    second_fold = summarizer.calls[1]
+    assert "Existing summary:\nsummary#1" in second_fold
+    assert second_fold.count("turn") == 2  # only the two turns that just aged out
+    assert window._thread_summaries[("C1", "1.0")]["folded"] == 8
+    assert fitted[1:] == history[8:]
+
+
+def test_edited_history_starts_the_summary_over(summarizer):
+    history = _turns(10)
+    asyncio.run(window.fit_chat_history(("C1", "1.0"), history))
+    edited = [dict(message) for message in history]
+    edited[5]["content"] = "edited " + edited[5]["content"]
+    asyncio.run(window.fit_chat_history(("C1", "1.0"), edited))
+    assert len(summarizer.calls) == 2
+    assert "Existing summary:\n(none yet)" in summarizer.calls[1]
+
+
+def test_failed_fold_still_bounds_the_prompt_and_retries_later(summarizer):
+    summarizer.fail = True
+    history = _turns(10)
+    fitted = asyncio.run(window.fit_chat_history(("C1", "1.0"), history))
+    assert fitted == history[6:]
+    assert ("C1", "1.0") not in window._thread_summaries
+
+    summarizer.fail = False
+    fitted = asyncio.run(window.fit_chat_history(("C1", "1.0"), history))
+    assert fitted[0]["role"] == "system" and fitted[1:] == history[6:]
+
+
+def test_disabled_budget_keeps_everything(summarizer, monkeypatch):
+    monkeypatch.setattr(window, "CONTEXT_WINDOW_TOKEN_BUDGET", 0)
+    history = _turns(50)
+    assert asyncio.run(window.fit_chat_history(("C1", "1.0"), history)) is history
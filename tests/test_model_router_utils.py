@@ -0,0 +1,68 @@
+# tests/test_model_router_utils.py  
+import pytest  
+from utils import model_router_utils as router  
+
+
+@pytest.fixture(autouse=True)  
+def routes(monkeypatch):  
+    monkeypatch.setattr(router, "DEFAULT_DEPLOYMENT", "gpt-4o")  
+    monkeypatch.setattr(router, "_routes", [  
+        {"name": "cheap-map", "handler": ["summarize_map", "context_summary"], "deployment": "gpt-35-turbo"},  
+        {"name": "big-map", "handler": "summarize_map", "deployments": ["gpt-35-turbo-16k", "gpt-4o-mini"]},  
+        {"name": "short-chat", "handler": "chat", "max_input_tokens": 2000, "deployments": ["gpt-4o-mini", "gpt-4o"]},  
+    ])  
+    monkeypatch.setattr(router, "_context_windows", {"gpt-35-turbo": 16385, "gpt-35-turbo-16k": 16385, "gpt-4o-mini": 128000})  
+    monkeypatch.setattr(router, "_command_overrides", {"person": "gpt-35-turbo"})  
+    monkeypatch.setattr(router, "_route_targets", {})  
+
+
+def _routed(handler, deployment, route):  
+    return router.MODEL_ROUTE_REQUESTS.values().get((handler, deployment, route), 0)  
+
+
+def test_small_requests_follow_the_first_matching_rule():  
+    assert router.choose_deployment("summarize_map", 8000, 4000) == "gpt-35-turbo"  
+    assert router.choose_deployment("chat", 500, 800) == "gpt-4o-mini"  
+    assert router.choose_deployment("web_search", 500, 800) == "gpt-4o"  
+
+
+def test_candidates_too_small_for_the_request_are_skipped():  
+    # A 127k-token map chunk overflows both 16k deployments, so the next rule's candidate is used  
+    assert router.choose_deployment("summarize_map", 127000, 1000) == "gpt-4o-mini"  
+    # No rule has a candidate big enough for a 60k context fold, so it goes to the default  
+    assert router.choose_deployment("context_summary", 60000, 4000) == "gpt-4o"  
+
+
+def test_command_override_is_ignored_when_it_cannot_hold_the_request():  
+    token = router.set_command_route("person")  
+    try:  
+        assert router.choose_deployment("person_search", 2000, 3096) == "gpt-35-turbo"  
+        assert router.choose_deployment("person_search", 20000, 3096) == "gpt-4o"  
+    finally:  
+        router.reset_command_route(token)  
+
+
+def test_fits_context_window():  
+    assert router.fits_context_window("gpt-35-turbo", 12000, 4000)  
+    assert not router.fits_context_window("gpt-35-turbo", 12386, 4000)  
+    assert router.fits_context_window("unlisted-deployment", 10 ** 6, 4000)  
+
+
+def test_picks_are_only_counted_when_the_request_is_sent():  
+    before = _routed("summarize_map", "gpt-35-turbo", "cheap-map")  
+    router.choose_deployment("summarize_map", 8000, 4000)  
+    # e.g. answered from the completion cache: nothing is counted  
+    assert _routed("summarize_map", "gpt-35-turbo", "cheap-map") == before  
+    router.choose_deployment("summarize_map", 8000, 4000)  
+    router.count_routed_request("summarize_map", "gpt-35-turbo")  
+    assert _routed("summarize_map", "gpt-35-turbo", "cheap-map") == before + 1  
+
+
+def test_latency_target_prefers_a_fast_enough_candidate(monkeypatch):  
+    monkeypatch.setattr(router, "_route_targets", {"chat": {"max_p95_latency": 5}})  
+    monkeypatch.setattr(router, "_latencies", {})  
+    for _ in range(router.MODEL_LATENCY_MIN_SAMPLES):  
+        router.record_model_call("chat", "gpt-4o-mini", 9.0)  
+        router.record_model_call("chat", "gpt-4o", 2.0)  
+    assert router.get_p95_latency("gpt-4o-mini") == 9.0  
+    assert router.choose_deployment("chat", 500, 800) == "gpt-4o"  
@@ -0,0 +1,48 @@
+# tests/test_openai_utils.py  
+import pytest  
+
+try:  
+    from utils import openai_utils  
+    from utils.openai_resilience_utils import CircuitOpenError  
+    from utils.rate_limit_utils import RateBudgetExceeded  
+except Exception as e:  # token_utils needs tiktoken's encoding  
+    pytest.skip(f"tiktoken encoding unavailable: {e}", allow_module_level=True)  
+
+
+class FakeSummarize:  
+    """Stands in for one map-phase summarization; plays back a scripted list of outcomes."""  
+
+    def __init__(self, *outcomes):  
+        self.outcomes = list(outcomes)  
+        self.calls = 0  
+
+    def __call__(self, chunk, instruction, handler):  
+        self.calls += 1  
+        outcome = self.outcomes.pop(0)  
+        if isinstance(outcome, Exception):  
+            raise outcome  
+        return outcome  
+
+
+@pytest.fixture(autouse=True)  
+def no_backoff(monkeypatch):  
+    monkeypatch.setattr(openai_utils, "SUMMARIZATION_RETRY_BACKOFF", 0)  
+
+
+@pytest.mark.parametrize("error", [CircuitOpenError("gpt-4o", 30), RateBudgetExceeded("no budget")])  
+def test_overload_is_not_retried_on_top_of_the_resilience_layer(monkeypatch, error):  
+    fake = FakeSummarize(error, ("summary", {"total_tokens": 10}))  
+    monkeypatch.setattr(openai_utils, "_summarize_text", fake)  
+    result = openai_utils.summarize_chunk_with_retries(0, "chunk", retries=2)  
+    assert fake.calls == 1  
+    assert result["response"] is None  
+    assert result["attempts"] == 1  
+
+
+def test_other_failures_are_retried(monkeypatch):  
+    fake = FakeSummarize(ValueError("bad json"), (None, None), ("summary", {"total_tokens": 10}))  
+    monkeypatch.setattr(openai_utils, "_summarize_text", fake)  
+    result = openai_utils.summarize_chunk_with_retries(0, "chunk", retries=2)  
+    assert fake.calls == 3  
+    assert result["response"] == "summary"  
+    assert result["attempts"] == 3  
@@ -0,0 +1,70 @@
+# tests/test_pdf_utils.py
+import os
+import sys
+import glob
+import tempfile
+import subprocess
+import textwrap
+import pytest
+from utils import pdf_utils
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module", autouse=True)
+def shutdown_pool():
+    yield
+    pdf_utils.shutdown_pdf_process_pool()
+
+
+def _temp_pdfs():
+    return set(glob.glob(os.path.join(tempfile.gettempdir(), "pdf_pages_*.pdf")))
+
+
+def test_small_documents_are_parsed_in_process(make_pdf):
+    batches = list(pdf_utils.iter_pdf_page_batches(make_pdf([f"page {i}" for i in range(5)]), batch_size=2))
+    assert [start for start, _ in batches] == [0, 2, 4]
+    assert [text for _, texts in batches for text in texts] == [f"page {i}" for i in range(5)]
+
+
+def test_process_pool_yields_batches_in_order_and_cleans_up(make_pdf, monkeypatch):
+    monkeypatch.setattr(pdf_utils, "PDF_PROCESS_POOL_MIN_PAGES", 0)
+    before = _temp_pdfs()
+    pages = [f"page {i}" for i in range(23)]
+    batches = list(pdf_utils.iter_pdf_page_batches(make_pdf(pages), batch_size=4))
+    assert [start for start, _ in batches] == list(range(0, 23, 4))
+    assert [text for _, texts in batches for text in texts] == pages
+    assert _temp_pdfs() == before
+
+
+def test_process_pool_stopped_early_cleans_up(make_pdf, monkeypatch):
+    monkeypatch.setattr(pdf_utils, "PDF_PROCESS_POOL_MIN_PAGES", 0)
+    before = _temp_pdfs()
+    batches = pdf_utils.iter_pdf_page_batches(make_pdf([f"page {i}" for i in range(40)]), batch_size=2)
+    assert next(batches) == (0, ["page 0", "page 1"])
+    batches.close()
+    assert _temp_pdfs() == before
+
+
+def test_workers_do_not_rerun_the_main_script(make_pdf, tmp_path):
+    # A stand-in for `python app.py`: module-level setup that must run once, in the parent only
+    marker = tmp_path / "setup_runs"
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(make_pdf([f"page {i}" for i in range(12)]))
+    script = tmp_path / "main_script.py"
+    script.write_text(textwrap.dedent(f"""
+        import os, sys
+        sys.path.insert(0, {REPO_ROOT!r})
+        with open({str(marker)!r}, "a") as file:
+            file.write(str(os.getpid()) + "\\n")
+        from utils import pdf_utils
+        pdf_utils.PDF_PROCESS_POOL_MIN_PAGES = 0
+        if __name__ == "__main__":
+            texts = [text for _, batch in pdf_utils.iter_pdf_page_batches({str(pdf_path)!r}, batch_size=2) for text in batch]
+            pdf_utils.shutdown_pdf_process_pool()
+            print(len(texts))
+    """))
+    result = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "12"
+    assert len(marker.read_text().split()) == 1
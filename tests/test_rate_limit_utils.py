@@ -0,0 +1,73 @@
+# tests/test_rate_limit_utils.py  
+import threading  
+import pytest  
+
+try:  
+    from utils import rate_limit_utils as rate  
+except Exception as e:  # token_utils needs tiktoken's encoding  
+    pytest.skip(f"tiktoken encoding unavailable: {e}", allow_module_level=True)  
+
+WINDOW = rate.RATE_LIMIT_WINDOW  
+
+
+def test_fits_under_both_quotas():  
+    rows = [(100.0, 3000), (110.0, 4000)]  
+    assert rate.reservation_wait(rows, 3000, tpm=10000, rpm=3, now=120.0) == 0.0  
+    assert rate.reservation_wait([], 500, tpm=0, rpm=0, now=120.0) == 0.0  
+
+
+def test_tpm_waits_for_just_enough_of_the_oldest_rows_to_expire():  
+    rows = [(100.0, 3000), (110.0, 4000), (115.0, 2000)]  
+    # 9000 used: 2000 more needs the first row gone, 5000 more needs the second gone too  
+    assert rate.reservation_wait(rows, 2000, tpm=10000, rpm=0, now=120.0) == pytest.approx(100.0 + WINDOW - 120.0)  
+    assert rate.reservation_wait(rows, 5000, tpm=10000, rpm=0, now=120.0) == pytest.approx(110.0 + WINDOW - 120.0)  
+
+
+def test_rpm_waits_for_the_oldest_request():  
+    rows = [(100.0, 10), (105.0, 10)]  
+    assert rate.reservation_wait(rows, 10, tpm=0, rpm=2, now=120.0) == pytest.approx(100.0 + WINDOW - 120.0)  
+
+
+def test_wait_never_drops_to_zero_before_a_row_has_expired():  
+    rows = [(100.0, 9000)]  
+    assert rate.reservation_wait(rows, 2000, tpm=10000, rpm=0, now=100.0 + WINDOW) == 0.01  
+
+
+def test_oversized_request_goes_through_only_once_the_window_is_empty():  
+    assert rate.reservation_wait([], 50000, tpm=10000, rpm=0, now=120.0) == 0.0  
+    rows = [(100.0, 1000), (110.0, 1000)]  
+    assert rate.reservation_wait(rows, 50000, tpm=10000, rpm=0, now=120.0) == pytest.approx(110.0 + WINDOW - 120.0)  
+
+
+def test_sqlite_store_reserves_settles_and_refuses_past_the_quota(tmp_path):  
+    store = rate.SqliteBudgetStore(str(tmp_path / "budget.sqlite3"))  
+    first, wait = store.try_reserve("gpt-4o", 6000, 10000, 0)  
+    assert first is not None and wait == 0.0  
+    reservation_id, wait = store.try_reserve("gpt-4o", 6000, 10000, 0)  
+    assert reservation_id is None and 0 < wait <= WINDOW  
+    # Other deployments have their own budget  
+    assert store.try_reserve("gpt-4o-mini", 6000, 10000, 0)[0] is not None  
+    # Settling with the real usage frees the unspent part of the estimate  
+    store.settle(first, 2000)  
+    reservation_id, wait = store.try_reserve("gpt-4o", 6000, 10000, 0)  
+    assert reservation_id is not None and wait == 0.0  
+
+
+def test_sqlite_store_never_oversubscribes_across_threads(tmp_path):  
+    store = rate.SqliteBudgetStore(str(tmp_path / "budget.sqlite3"))  
+    granted = []  
+    barrier = threading.Barrier(8)  
+
+    def reserve():  
+        barrier.wait()  
+        for _ in range(5):  
+            reservation_id, _ = store.try_reserve("gpt-4o", 1000, 10000, 0)  
+            if reservation_id is not None:  
+                granted.append(reservation_id)  
+
+    threads = [threading.Thread(target=reserve) for _ in range(8)]  
+    for thread in threads:  
+        thread.start()  
+    for thread in threads:  
+        thread.join()  
+    assert len(granted) == 10  
@@ -0,0 +1,64 @@
+# tests/test_slack_dedup_utils.py
+import asyncio
+import pytest
+from utils import slack_dedup_utils as dedup
+
+
+class FakeClaims:
+    """Stands in for the Postgres claim table shared by every instance."""
+
+    def __init__(self):
+        self.rows = {}  # event key -> "in_flight" or "completed"
+
+    async def claim(self, event_key):
+        if event_key in self.rows:
+            return False
+        self.rows[event_key] = "in_flight"
+        return True
+
+    async def finish(self, event_key, completed):
+        if completed:
+            self.rows[event_key] = "completed"
+        elif self.rows.get(event_key) == "in_flight":
+            del self.rows[event_key]
+
+
+@pytest.fixture
+def claims(monkeypatch):
+    fake = FakeClaims()
+    monkeypatch.setattr(dedup, "SLACK_EVENT_DEDUP_USE_DB", True)
+    monkeypatch.setattr(dedup, "claim_slack_event_async", fake.claim)
+    monkeypatch.setattr(dedup, "finish_slack_event_async", fake.finish)
+    monkeypatch.setattr(dedup, "_seen_events", dedup.OrderedDict())
+    return fake
+
+
+def _deliver(event_key):
+    return asyncio.run(dedup.is_duplicate_slack_event(event_key))
+
+
+def test_redelivery_is_dropped_while_in_flight_and_after_completion(claims):
+    assert _deliver("Ev1") is False
+    assert _deliver("Ev1") is True
+    asyncio.run(dedup.finish_slack_event("Ev1", completed=True))
+    assert claims.rows["Ev1"] == "completed"
+    assert _deliver("Ev1") is True
+
+
+def test_failed_turn_releases_its_claim_for_the_redelivery(claims):
+    assert _deliver("Ev2") is False
+    asyncio.run(dedup.finish_slack_event("Ev2", completed=False))
+    assert "Ev2" not in claims.rows
+    assert _deliver("Ev2") is False
+    assert claims.rows["Ev2"] == "in_flight"
+
+
+def test_other_instances_claim_is_respected(claims):
+    claims.rows["Ev3"] = "in_flight"
+    assert _deliver("Ev3") is True
+
+
+def test_events_without_a_key_are_never_dropped(claims):
+    assert _deliver(None) is False
+    assert _deliver(None) is False
+    asyncio.run(dedup.finish_slack_event(None, completed=False))
@@ -0,0 +1,122 @@
+# tests/test_slack_streaming_utils.py
+import asyncio
+import pytest
+
+try:
+    from utils import slack_streaming_utils
+    from utils.slack_streaming_utils import SlackStreamingMessage, MAX_BLOCK_TEXT_LENGTH
+    from utils.slack_utils import build_slack_post_payloads
+except Exception as e:  # footer_utils needs tiktoken's encoding
+    pytest.skip(f"tiktoken encoding unavailable: {e}", allow_module_level=True)
+
+
+class FakeSlack:
+    """Records chat.postMessage / chat.update calls the way Slack would answer them.
+
+    Posts are split into one message per payload, like post_message_to_slack_async does.
+    """
+
+    def __init__(self):
+        self.messages = {}
+        self.updates = []
+        self._next_ts = 1
+
+    async def post(self, token, channel, text, blocks=None, thread_ts=None):
+        responses = []
+        for payload in build_slack_post_payloads(channel, text, blocks, thread_ts):
+            ts = f"{self._next_ts}.000"
+            self._next_ts += 1
+            self.messages[ts] = payload["text"]
+            responses.append({"ok": True, "ts": ts, "message": {"ts": ts, "text": payload["text"]}})
+        return responses
+
+    async def update(self, token, channel, ts, text, blocks=None):
+        for block in blocks or []:
+            if len(block.get("text", {}).get("text", "")) > MAX_BLOCK_TEXT_LENGTH:
+                return {"ok": False, "error": "invalid_blocks"}
+        self.messages[ts] = text
+        self.updates.append((ts, text))
+        return {"ok": True, "ts": ts, "message": {"ts": ts, "text": text}}
+
+
+@pytest.fixture
+def slack(monkeypatch):
+    fake = FakeSlack()
+    monkeypatch.setattr(slack_streaming_utils, "post_message_to_slack_async", fake.post)
+    monkeypatch.setattr(slack_streaming_utils, "update_message_in_slack_async", fake.update)
+    return fake
+
+
+def _paragraphs(count):
+    return "".join(f"Paragraph {i} " + "word " * 60 + "\n\n" for i in range(count))
+
+
+def _stream(deltas):
+    async def run():
+        message = SlackStreamingMessage("token", "C1", "100.000")
+        message.start()
+        for delta in deltas:
+            await message.append(delta)
+        return await message.finish("footer")
+    return asyncio.run(run())
+
+
+def test_rolled_over_segments_record_their_final_text(slack):
+    text = _paragraphs(20)
+    responses = _stream([text[i:i + 50] for i in range(0, len(text), 50)])
+    assert len(slack.messages) > 1
+    # The last response per ts is what the thread history cache keeps
+    recorded = {response["ts"]: response["message"]["text"] for response in responses if response.get("ok")}
+    assert set(recorded) == set(slack.messages)
+    for ts, text in recorded.items():
+        assert text == slack.messages[ts]
+        assert slack_streaming_utils.SLACK_STREAMING_PLACEHOLDER not in text
+
+
+@pytest.mark.parametrize("length", [5720, 12000])
+def test_long_cached_reply_in_one_delta_fits_slack_blocks(slack, length):
+    # A completion cache hit is replayed as a single delta holding the whole reply
+    text = _paragraphs(length // 300 + 1)[:length]
+    responses = _stream([text])
+    assert all(response.get("ok") for response in responses), responses
+    assert len(slack.messages) >= length // MAX_BLOCK_TEXT_LENGTH + 1
+    for message_text in slack.messages.values():
+        assert len(message_text) <= MAX_BLOCK_TEXT_LENGTH
+    # Nothing lost or repeated at the cuts, and in order; the last message also carries the footer
+    assert " ".join(slack.messages.values()).split() == text.split() + ["footer"]
+
+
+def test_long_reply_in_one_delta_is_never_posted_twice(slack):
+    text = _paragraphs(19)[:5720]
+    _stream([text])
+    posted = [word for message_text in slack.messages.values() for word in message_text.split()]
+    assert len(posted) == len(text.split()) + 1
+    headings = [word for message_text in slack.messages.values() for word in message_text.split() if word.isdigit()]
+    assert headings == sorted(headings, key=int)
+
+
+def test_code_block_cut_by_a_rollover_renders_in_both_messages(slack):
+    code = "".join(f"    value_{i} = compute({i})  # step {i}\n" for i in range(150))
+    text = "Here is the script:\n\n```python\n" + code + "```\n\nThat is all."
+    _stream([text[i:i + 40] for i in range(0, len(text), 40)])
+    assert len(slack.messages) > 1
+    for message_text in slack.messages.values():
+        assert message_text.count("```") % 2 == 0, message_text
+    posted = [line for message_text in slack.messages.values() for line in message_text.splitlines() if "```" not in line]
+    assert [line for line in posted if "compute" in line] == code.splitlines()
+
+
+def test_head_is_posted_when_the_placeholder_failed(slack, monkeypatch):
+    post = slack.post
+    calls = []
+
+    async def flaky_post(token, channel, text, blocks=None, thread_ts=None):
+        calls.append(text)
+        if len(calls) == 1:
+            return [{"ok": False, "error": "ratelimited"}]
+        return await post(token, channel, text, blocks, thread_ts)
+
+    monkeypatch.setattr(slack_streaming_utils, "post_message_to_slack_async", flaky_post)
+    text = _paragraphs(12)
+    _stream([text[i:i + 50] for i in range(0, len(text), 50)])
+    assert " ".join(slack.messages.values()).split() == text.split() + ["footer"]
@@ -0,0 +1,123 @@
+# tests/test_slack_utils.py
+import re
+import time
+import pytest
+
+try:
+    from utils.slack_utils import convert_openai_response_to_slack_mrkdwn, split_message_into_chunks, split_first_chunk
+except Exception as e:  # footer_utils needs tiktoken's encoding
+    pytest.skip(f"tiktoken encoding unavailable: {e}", allow_module_level=True)
+
+
+def _legacy_convert(text):
+    """The multi-pass converter slack_utils used before the single-pattern rewrite."""
+    code_blocks = re.compile(r'```(.*?)```', re.DOTALL).findall(text)
+    for i, block in enumerate(code_blocks):
+        text = text.replace(f"```{block}```", f"{{{{code_block_{i}}}}}")
+    text = re.sub(r'### (.*?)\n', r'```\1```\n', text)
+    text = re.sub(r'\*\*(.*?)\*\*', r'*\1*', text)
+    text = re.sub(r'_(.*?)_', r'_\1_', text)
+    text = re.sub(r'~(.*?)~', r'~\1~', text)
+    text = re.sub(r'`(.*?)`', r'`\1`', text)
+    for i, block in enumerate(code_blocks):
+        text = text.replace(f"{{{{code_block_{i}}}}}", f"```{block}```")
+    text = re.sub(r'^\* (.*?)$', r'• \1', text, flags=re.MULTILINE)
+    text = re.sub(r'^1\. (.*?)$', r'1. \1', text, flags=re.MULTILINE)
+    text = re.sub(r'^> (.*?)$', r'> \1', text, flags=re.MULTILINE)
+    text = re.sub(r'\[(.*?)\]\((.*?)\)', r'<\2|\1>', text)
+    text = re.sub(r'@(\w+)', r'<@\1>', text)
+    text = re.sub(r'#(\w+)', r'<#\1>', text)
+    return text
+
+
+GOLDEN_CASES = [
+    ("**bold** text", "*bold* text"),
+    ("_italic_ and ~strike~ are already mrkdwn", "_italic_ and ~strike~ are already mrkdwn"),
+    ("**bold** with _italic_ inside a sentence", "*bold* with _italic_ inside a sentence"),
+    ("### Summary\nDetails follow", "```Summary```\nDetails follow"),
+    ("See [the docs](https://example.com/a_b) now", "See <https://example.com/a_b|the docs> now"),
+    ("* first\n* second\n1. third", "• first\n• second\n1. third"),
+    ("> quoted **point**", "> quoted *point*"),
+    ("ask @alice in #general", "ask <@alice> in <#general>"),
+    ("mail a@b.com or open http://x.com/#frag", "mail a@b.com or open http://x.com/#frag"),
+    ("<@U123> and <https://x.com|x> stay as they are", "<@U123> and <https://x.com|x> stay as they are"),
+    ("use `a**b**` inline", "use `a**b**` inline"),
+    (
+        "```python\nx = **not bold**  # @nobody #nothing\n```\nthen **bold**",
+        "```python\nx = **not bold**  # @nobody #nothing\n```\nthen *bold*",
+    ),
+    (
+        "### Steps\n* run `make`\n* read [guide](https://e.x/g)\n```\n### not a header\n```",
+        "```Steps```\n• run `make`\n• read <https://e.x/g|guide>\n```\n### not a header\n```",
+    ),
+]
+
+
+@pytest.mark.parametrize("text, expected", GOLDEN_CASES)
+def test_golden_output(text, expected):
+    assert convert_openai_response_to_slack_mrkdwn(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", GOLDEN_CASES)
+def test_rendering_is_idempotent(text, expected):
+    assert convert_openai_response_to_slack_mrkdwn(expected) == expected
+
+
+def test_matches_the_legacy_converter_on_plain_markdown():
+    text = "### Plan\n**Goal**: ship it\n* step [one](https://e.x/1)\n* step two for @bob\n> note\n"
+    assert convert_openai_response_to_slack_mrkdwn(text) == _legacy_convert(text)
+
+
+def test_single_pass_is_faster_than_the_legacy_converter():
+    section = (
+        "### Section\nSome **bold** words, a [link](https://example.com/page) and `code`.\n"
+        "* a bullet for @someone in #channel\n```\nprint('**x**')\n```\n\n"
+    )
+    text = section * 200
+    rounds = 20
+    started = time.perf_counter()
+    for _ in range(rounds):
+        convert_openai_response_to_slack_mrkdwn(text)
+    new_elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(rounds):
+        _legacy_convert(text)
+    old_elapsed = time.perf_counter() - started
+    print(f"single pass: {new_elapsed / rounds * 1000:.2f}ms, legacy: {old_elapsed / rounds * 1000:.2f}ms per {len(text)}-char reply")
+    assert new_elapsed < old_elapsed
+
+
+def _code_reply():
+    code = "".join(f"    value_{i} = compute({i})  # step {i}\n" for i in range(120))
+    return "Intro paragraph.\n\n```python\n" + code + "```\n\nClosing words after the code."
+
+
+def _strip_fences(chunks):
+    return [line for chunk in chunks for line in chunk.splitlines() if line.strip() and not line.startswith("```")]
+
+
+def test_split_chunks_keep_code_fences_balanced():
+    text = _code_reply()
+    chunks = split_message_into_chunks(text, 1000)
+    assert len(chunks) > 2
+    for chunk in chunks:
+        assert len(chunk) <= 1000
+        assert chunk.count("```") % 2 == 0, chunk
+    assert _strip_fences(chunks) == _strip_fences([text])
+
+
+def test_split_first_chunk_repeated_matches_split_message_into_chunks():
+    text = _code_reply()
+    chunks, rest = [], text
+    while len(rest) > 1000:
+        head, rest = split_first_chunk(rest, 1000)
+        chunks.append(head)
+    chunks.append(rest.rstrip("\n"))
+    assert chunks == split_message_into_chunks(text, 1000)
+
+
+def test_opening_fence_is_not_sent_alone_before_an_overlong_line():
+    text = "```\n" + "x" * 2500 + "\n```"
+    chunks = split_message_into_chunks(text, 1000)
+    assert all(chunk.replace("```", "").strip() for chunk in chunks)
+    assert "".join(_strip_fences(chunks)) == "x" * 2500
@@ -0,0 +1,88 @@
+# tests/test_token_utils.py
+import time
+import pytest
+
+try:
+    from utils import token_utils
+except Exception as e:  # tiktoken downloads its encoding on first use
+    pytest.skip(f"tiktoken encoding unavailable: {e}", allow_module_level=True)
+
+
+def _chunk_text_per_word(text, max_chunk_size):
+    """The chunker openai_utils used before token_utils: encode every word separately."""
+    words = text.split()
+    chunks = []
+    current_chunk = []
+    current_length = 0
+    for word in words:
+        word_length = len(token_utils.encoding.encode(word))
+        if current_length + word_length + 1 <= max_chunk_size:
+            current_chunk.append(word)
+            current_length += word_length + 1
+        else:
+            chunks.append(' '.join(current_chunk))
+            current_chunk = [word]
+            current_length = word_length + 1
+    chunks.append(' '.join(current_chunk))
+    return chunks
+
+
+def _large_document(pages=200):
+    paragraph = "The quarterly report covers revenue, churn and hiring across every region. " * 3
+    page = "\n\n".join(f"Section {i}. {paragraph}" for i in range(12))
+    return "\f".join(f"Page {n}\n{page}" for n in range(pages))
+
+
+def test_short_text_is_one_chunk():
+    assert token_utils.chunk_text("hello world", 100) == ["hello world"]
+
+
+def test_chunks_cover_the_same_text_as_the_per_word_chunker():
+    text = _large_document(pages=20)
+    new_chunks = token_utils.chunk_text(text, 2000)
+    old_chunks = _chunk_text_per_word(text, 2000)
+    # Both cover the whole document; slicing also keeps its original whitespace
+    assert " ".join(old_chunks).split() == text.split()
+    assert "".join(new_chunks) == text
+    assert abs(len(new_chunks) - len(old_chunks)) <= len(old_chunks) // 10 + 1
+
+
+@pytest.mark.parametrize("snap", [True, False])
+def test_cuts_never_split_a_multibyte_character(snap):
+    # cl100k encodes many CJK characters and emoji as several byte-level tokens
+    line = "数据仓库的季度报告 🚀 naïve café Ünïcödé 😀👍🏽 分析平台。"
+    text = "\n\n".join(f"{i} " + line * 3 for i in range(200))
+    chunks = token_utils.chunk_text(text, 50, snap_to_boundaries=snap)
+    assert len(chunks) > 10
+    assert not any("\ufffd" in chunk for chunk in chunks)
+    assert "".join(chunks) == text
+    overlapping = token_utils.chunk_text(text, 50, overlap=7, snap_to_boundaries=False)
+    assert not any("\ufffd" in chunk for chunk in overlapping)
+
+
+def test_chunks_respect_the_token_limit_and_snap_to_breaks():
+    chunks = token_utils.chunk_text(_large_document(pages=20), 2000)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(token_utils.encoding.encode(chunk, disallowed_special=())) <= 2000
+    for chunk in chunks[:-1]:
+        assert chunk.endswith(("\f", "\n\n", "\n"))
+
+
+def test_overlap_repeats_the_end_of_the_previous_chunk():
+    chunks = token_utils.chunk_text(_large_document(pages=5), 500, overlap=50, snap_to_boundaries=False)
+    for previous, current in zip(chunks, chunks[1:]):
+        tail = token_utils.encoding.decode(token_utils.encoding.encode(previous, disallowed_special=())[-50:])
+        assert current.startswith(tail)
+
+
+def test_single_pass_chunker_is_faster_on_a_large_document():
+    text = _large_document()
+    started = time.perf_counter()
+    token_utils.chunk_text(text, 2000)
+    new_elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    _chunk_text_per_word(text, 2000)
+    old_elapsed = time.perf_counter() - started
+    print(f"chunk_text: {new_elapsed:.3f}s, per-word chunker: {old_elapsed:.3f}s for {len(text)} chars")
+    assert new_elapsed < old_elapsed
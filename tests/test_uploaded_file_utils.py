@@ -0,0 +1,39 @@
+# tests/test_uploaded_file_utils.py
+import io
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+try:
+    from utils import uploaded_file_utils
+except Exception as e:  # openai_utils needs tiktoken's encoding
+    pytest.skip(f"tiktoken encoding unavailable: {e}", allow_module_level=True)
+
+
+@pytest.fixture
+def summarize_pages(monkeypatch):
+    """Replace the OpenAI summarization with one that returns the extracted text."""
+    def fake_process_and_summarize_pages(page_batches, file_type, attempt_sizes):
+        return "\n".join(text for _, texts in page_batches for text in texts)
+    monkeypatch.setattr(uploaded_file_utils, "process_and_summarize_pages", fake_process_and_summarize_pages)
+
+
+def test_concurrent_pdfs_each_get_their_own_text(make_pdf, summarize_pages, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    documents = {f"doc{n}": make_pdf([f"doc{n} page{page}" for page in range(5)]) for n in range(8)}
+
+    def process(name):
+        return name, uploaded_file_utils.process_pdf(io.BytesIO(documents[name]))
+
+    with ThreadPoolExecutor(max_workers=len(documents)) as executor:
+        results = dict(executor.map(process, list(documents) * 3))
+
+    for name, text in results.items():
+        assert text.split("\n") == [f"{name} page{page}" for page in range(5)]
+    # Nothing is staged through a shared file in the working directory any more
+    assert not (tmp_path / "temp.pdf").exists()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_pdf_without_text_is_an_error(make_pdf, summarize_pages):
+    with pytest.raises(ValueError):
+        uploaded_file_utils.process_pdf(io.BytesIO(make_pdf([""])))
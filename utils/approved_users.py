@@ -1,8 +1,17 @@
 import json  
 import os  
+import time  
 import logging  
+import threading  
 
 APPROVED_USERS_FILE = os.path.join(os.path.dirname(__file__), 'approved_users.json')  
+# How often the background watcher checks the file's mtime for changes  
+APPROVED_USERS_RELOAD_INTERVAL = float(os.environ.get("APPSETTING_APPROVED_USERS_RELOAD_INTERVAL", "30"))  
+
+_approved_users = frozenset()  
+_approved_users_mtime = None  
+_approved_users_lock = threading.Lock()  
+_watcher_thread = None  
 
 def load_approved_users():  
     try:  
@@ -14,14 +23,55 @@ def load_approved_users():
         return []  
     except json.JSONDecodeError as e:  
         logging.error(f"Error decoding JSON from {APPROVED_USERS_FILE}: {e}")  
-        return []  
+        return None  
     except Exception as e:  
         logging.error(f"An error occurred while loading approved users: {e}")  
-        return []  
+        return None  
+
+def _file_mtime():  
+    try:  
+        return os.stat(APPROVED_USERS_FILE).st_mtime_ns  
+    except OSError:  
+        return None  
+
+# Function to reload the cached ACL if the file changed since the last load  
+def reload_approved_users(force=False):  
+    global _approved_users, _approved_users_mtime  
+    mtime = _file_mtime()  
+    with _approved_users_lock:  
+        if not force and mtime == _approved_users_mtime:  
+            return False  
+        approved_users = load_approved_users()  
+        _approved_users_mtime = mtime  
+        if approved_users is None:  
+            # Keep serving the last good list until the file is fixed (its mtime changes again)  
+            return False  
+        _approved_users = frozenset(approved_users)  
+    logging.info(f"Loaded {len(_approved_users)} approved user(s) from {APPROVED_USERS_FILE}")  
+    return True  
+
+def _watch_approved_users():  
+    while True:  
+        time.sleep(APPROVED_USERS_RELOAD_INTERVAL)  
+        try:  
+            reload_approved_users()  
+        except Exception as e:  
+            logging.error(f"Error reloading approved users: {e}")  
+
+def _ensure_loaded():  
+    global _watcher_thread  
+    if _watcher_thread is not None:  
+        return  
+    with _approved_users_lock:  
+        if _watcher_thread is not None:  
+            return  
+        _watcher_thread = threading.Thread(target=_watch_approved_users, name="approved-users-watcher", daemon=True)  
+    reload_approved_users(force=True)  
+    _watcher_thread.start()  
 
 def is_user_approved(user_id):  
-    approved_users = load_approved_users()  
-    if user_id in approved_users:  
+    _ensure_loaded()  
+    if user_id in _approved_users:  
         logging.info(f"User {user_id} is approved.")  
         return True  
     else:  
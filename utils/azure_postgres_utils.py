@@ -1,11 +1,14 @@
 import os  
 import psycopg2  
 from psycopg2 import pool  
+from psycopg2.extras import execute_values  
 import logging  
+import time  
+import threading  
+from collections import OrderedDict, Counter  
 from datetime import datetime, timezone  
-  
-# Configure logging  
-logging.basicConfig(level=logging.DEBUG)  
+from utils.http_utils import run_blocking, BLOCKING_EXECUTOR_WORKERS  
+from utils.batch_writer_utils import BackgroundBatchWriter  
   
 # Load environment variables with defaults  
 DATABASE_USER = os.environ.get("APPSETTING_2023oct9_AZURE_POSTGRES_USER", "default_user")  
@@ -14,6 +17,45 @@ DATABASE_NAME = os.environ.get("APPSETTING_2023oct9_AZURE_POSTGRES_DATABASE", "d
 DATABASE_PASSWORD = os.environ.get("APPSETTING_2023oct9_AZURE_POSTGRES_PASSWORD", "default_password")  
 DATABASE_PORT = os.environ.get("APPSETTING_2023oct9_AZURE_POSTGRES_PORT", "5432")  
 DATABASE_INGRESS_TABLE = os.environ.get("APPSETTING_2023oct9_AZURE_POSTGRES_DATABASE_INGRESS_TABLE", "default_table")  
+# Enough connections for every blocking-executor thread plus the background batch writers' flush threads  
+DATABASE_POOL_MAX_SIZE = int(os.environ.get("APPSETTING_DATABASE_POOL_MAX_SIZE", str(BLOCKING_EXECUTOR_WORKERS + 8)))  
+  
+# Background invocation log writer settings  
+INVOCATION_LOG_BATCH_SIZE = int(os.environ.get("APPSETTING_INVOCATION_LOG_BATCH_SIZE", "50"))  
+INVOCATION_LOG_FLUSH_INTERVAL = float(os.environ.get("APPSETTING_INVOCATION_LOG_FLUSH_INTERVAL", "2.0"))  
+INVOCATION_LOG_MAX_QUEUE_SIZE = int(os.environ.get("APPSETTING_INVOCATION_LOG_MAX_QUEUE_SIZE", "5000"))  
+INVOCATION_LOG_OVERFLOW_POLICY = os.environ.get("APPSETTING_INVOCATION_LOG_OVERFLOW_POLICY", "drop_newest")  # or "drop_oldest"  
+  
+INVOCATION_LOG_COLUMNS = [  
+    "channel_id", "message_type", "message_id", "timestamp_from_endpoint",  
+    "local_timestamp_from_endpoint", "local_timezone_from_endpoint",  
+    "service_url", "from_id", "from_name", "conversation_id",  
+    "attachment_exists", "recipient_id", "recipient_name",  
+    "channeldata_slack_app_id", "channeldata_slack_event_id",  
+    "channeldata_slack_event_time", "message_payload", "interacting_user_id",  
+    "channeldata_slack_thread_ts"  
+]  
+  
+# Uploaded-file result cache settings (memory tier in front of bot_file_upload_hashes)  
+FILE_HASH_CACHE_SIZE = int(os.environ.get("APPSETTING_FILE_HASH_CACHE_SIZE", "256"))  
+FILE_HASH_REUSE_FLUSH_INTERVAL = float(os.environ.get("APPSETTING_FILE_HASH_REUSE_FLUSH_INTERVAL", "10.0"))  
+# Unique index the save upsert needs; created by the one-off migration in the README, never at runtime  
+FILE_HASH_UNIQUE_INDEX = "public.bot_file_upload_hashes_hash_value_key"  
+FILE_HASH_INDEX_RECHECK_INTERVAL = 600  
+  
+# Slack event de-duplication shared across instances  
+SLACK_EVENT_DEDUP_TABLE = "public.bot_slack_event_dedup"  
+SLACK_EVENT_DEDUP_RETENTION_HOURS = int(os.environ.get("APPSETTING_SLACK_EVENT_DEDUP_RETENTION_HOURS", "24"))  
+# An in-flight claim older than this is taken over by a redelivery (its instance probably died mid-turn);  
+# Slack retries after 1 and 5 minutes, so keep this under 5  
+SLACK_EVENT_INFLIGHT_TTL_SECONDS = int(os.environ.get("APPSETTING_SLACK_EVENT_INFLIGHT_TTL_SECONDS", "240"))  
+
+# Shared tier of the completion cache (see completion_cache_utils.py)  
+COMPLETION_CACHE_TABLE = "public.bot_completion_cache"  
+COMPLETION_CACHE_FLUSH_INTERVAL = float(os.environ.get("APPSETTING_COMPLETION_CACHE_FLUSH_INTERVAL", "2.0"))  
+  
+# Shared Azure OpenAI token/request budget (see rate_limit_utils.py)  
+RATE_BUDGET_TABLE = "public.bot_openai_rate_budget"  
   
 # Print environment variable values for verification  
 print("DATABASE_USER:", DATABASE_USER)  
@@ -26,10 +68,10 @@ print("DATABASE_INGRESS_TABLE:", DATABASE_INGRESS_TABLE)
 # Log the connection parameters (excluding sensitive information)  
 logging.debug(f"DATABASE_HOST: {DATABASE_HOST}, DATABASE_PORT: {DATABASE_PORT}, DATABASE_USER: {DATABASE_USER}, DATABASE_NAME: {DATABASE_NAME}")  
   
-# Initialize connection pool  
+# Initialize connection pool; DB helpers run on the blocking executor's threads, so it must be thread-safe  
 try:  
-    connection_pool = psycopg2.pool.SimpleConnectionPool(  
-        1, 20, user=DATABASE_USER, password=DATABASE_PASSWORD,  
+    connection_pool = psycopg2.pool.ThreadedConnectionPool(  
+        1, DATABASE_POOL_MAX_SIZE, user=DATABASE_USER, password=DATABASE_PASSWORD,  
         host=DATABASE_HOST, port=DATABASE_PORT,  
         database=DATABASE_NAME, sslmode='require'  
     )  
@@ -81,96 +123,443 @@ def release_db_connection(connection):
     except Exception as e:  
         logging.error(f"Error releasing connection back to pool: {e}")  
   
-def log_invocation_to_db(data):  
+# Function to write a batch of queued invocations (runs on the background writer thread)  
+def write_invocation_log_batch(rows):  
+    """Insert a batch of invocation rows with a single multi-row INSERT."""  
     connection = get_db_connection()  
     if connection is None:  
-        logging.error("No database connection available. Skipping log invocation.")  
-        return  
+        raise RuntimeError("No database connection available")  
   
     try:  
-        cursor = connection.cursor()  
-        query = f"""  
-            INSERT INTO {DATABASE_INGRESS_TABLE} (  
-                channel_id, message_type, message_id, timestamp_from_endpoint,  
-                local_timestamp_from_endpoint, local_timezone_from_endpoint,  
-                service_url, from_id, from_name, conversation_id,  
-                attachment_exists, recipient_id, recipient_name,  
-                channeldata_slack_app_id, channeldata_slack_event_id,  
-                channeldata_slack_event_time, message_payload, interacting_user_id,  
-                channeldata_slack_thread_ts  
-            ) VALUES (  
-                %(channel_id)s, %(message_type)s, %(message_id)s, %(timestamp_from_endpoint)s,  
-                %(local_timestamp_from_endpoint)s, %(local_timezone_from_endpoint)s,  
-                %(service_url)s, %(from_id)s, %(from_name)s, %(conversation_id)s,  
-                %(attachment_exists)s, %(recipient_id)s, %(recipient_name)s,  
-                %(channeldata_slack_app_id)s, %(channeldata_slack_event_id)s,  
-                %(channeldata_slack_event_time)s, %(message_payload)s, %(interacting_user_id)s,  
-                %(channeldata_slack_thread_ts)s  
-            ) RETURNING pk_id, message_id  
-        """  
-        logging.debug(f"Executing query: {query}")  
-        logging.debug(f"With data: {data}")  
-        # Ensure local_timestamp_from_endpoint is a datetime object  
-        data['local_timestamp_from_endpoint'] = convert_timestamp_to_datetime(data['local_timestamp_from_endpoint'])  
-        cursor.execute(query, data)  
+        with connection.cursor() as cursor:  
+            query = f"INSERT INTO {DATABASE_INGRESS_TABLE} ({', '.join(INVOCATION_LOG_COLUMNS)}) VALUES %s"  
+            template = "(" + ", ".join(f"%({column})s" for column in INVOCATION_LOG_COLUMNS) + ")"  
+            execute_values(cursor, query, rows, template=template, page_size=len(rows))  
         connection.commit()  
-        result = cursor.fetchone()  
-        cursor.close()  
-  
-        if result:  
-            logging.info(f"Data saved to bot_invoke_log with messageID: {result[1]}, and pk_id: {result[0]}")  
-        else:  
-            logging.info("No data returned after insert operation for Slack invocation.")  
-    except Exception as e:  
-        logging.error(f"Failed to save Slack data to Postgres: {e}")  
+        logging.debug(f"Flushed {len(rows)} invocation log row(s) to {DATABASE_INGRESS_TABLE}")  
+    except Exception:  
+        connection.rollback()  
+        raise  
     finally:  
         release_db_connection(connection)  
   
+invocation_log_writer = BackgroundBatchWriter(  
+    "invocation_log",  
+    write_invocation_log_batch,  
+    batch_size=INVOCATION_LOG_BATCH_SIZE,  
+    flush_interval=INVOCATION_LOG_FLUSH_INTERVAL,  
+    max_queue_size=INVOCATION_LOG_MAX_QUEUE_SIZE,  
+    overflow_policy=INVOCATION_LOG_OVERFLOW_POLICY  
+)  
+  
+# Queue an invocation for the background writer; returns immediately  
+def enqueue_invocation_log(data):  
+    row = {column: data.get(column) for column in INVOCATION_LOG_COLUMNS}  
+    row['local_timestamp_from_endpoint'] = convert_timestamp_to_datetime(row['local_timestamp_from_endpoint'])  
+    return invocation_log_writer.enqueue(row)  
+  
 # Function to convert timestamp to datetime  
 def convert_timestamp_to_datetime(timestamp):  
     return datetime.fromtimestamp(timestamp, tz=timezone.utc)  
 
-def save_or_fetch_file_hash(hash_value, openai_response, uploaded_by):  
+_file_hash_cache = OrderedDict()  # hash_value -> file_payload  
+_file_hash_cache_lock = threading.Lock()  
+  
+def _get_cached_file_response(hash_value):  
+    with _file_hash_cache_lock:  
+        payload = _file_hash_cache.get(hash_value)  
+        if payload is not None:  
+            _file_hash_cache.move_to_end(hash_value)  
+        return payload  
+  
+def _cache_file_response(hash_value, payload):  
+    if not payload:  
+        return  
+    with _file_hash_cache_lock:  
+        _file_hash_cache[hash_value] = payload  
+        _file_hash_cache.move_to_end(hash_value)  
+        while len(_file_hash_cache) > FILE_HASH_CACHE_SIZE:  
+            _file_hash_cache.popitem(last=False)  
+  
+# Function to write back reuse counts collected from memory-cache hits (runs on the background writer thread)  
+def write_file_hash_reuse_batch(hash_values):  
+    connection = get_db_connection()  
+    if connection is None:  
+        raise RuntimeError("No database connection available")  
+  
+    increments = list(Counter(hash_values).items())  
+    try:  
+        with connection.cursor() as cursor:  
+            query = """  
+                UPDATE public.bot_file_upload_hashes AS t  
+                SET reuse_count = t.reuse_count + v.hits  
+                FROM (VALUES %s) AS v(hash_value, hits)  
+                WHERE t.hash_value = v.hash_value  
+            """  
+            execute_values(cursor, query, increments, page_size=len(increments))  
+        connection.commit()  
+        logging.debug(f"Flushed reuse counts for {len(increments)} file hash(es)")  
+    except Exception:  
+        connection.rollback()  
+        raise  
+    finally:  
+        release_db_connection(connection)  
+  
+file_hash_reuse_writer = BackgroundBatchWriter(  
+    "file_hash_reuse",  
+    write_file_hash_reuse_batch,  
+    batch_size=100,  
+    flush_interval=FILE_HASH_REUSE_FLUSH_INTERVAL,  
+    max_queue_size=10000  
+)  
+  
+# Function to look up a previous response for an uploaded file and count the reuse  
+def fetch_file_hash_response(hash_value):  
+    payload = _get_cached_file_response(hash_value)  
+    if payload is not None:  
+        logging.info(f"File with hash {hash_value} found in memory cache.")  
+        file_hash_reuse_writer.enqueue(hash_value)  
+        return payload  
+  
+    connection = get_db_connection()  
+    if connection is None:  
+        logging.error("No database connection available. Skipping fetch file operation.")  
+        return None  
+  
+    try:  
+        with connection.cursor() as cursor:  
+            # Lookup and reuse-count increment in one statement  
+            query = """  
+                UPDATE public.bot_file_upload_hashes  
+                SET reuse_count = reuse_count + 1  
+                WHERE hash_value = %s  
+                RETURNING file_payload  
+            """  
+            cursor.execute(query, (hash_value,))  
+            existing_record = cursor.fetchone()  
+        connection.commit()  
+    except Exception as e:  
+        connection.rollback()  
+        logging.error(f"Failed to fetch file hash: {e}")  
+        return None  
+    finally:  
+        release_db_connection(connection)  
+  
+    if existing_record:  
+        logging.info(f"File with hash {hash_value} already exists. Fetching existing record.")  
+        _cache_file_response(hash_value, existing_record[0])  
+        return existing_record[0]  
+    return None  
+  
+_file_hash_index_ready = False  
+_file_hash_index_checked_at = 0.0  
+  
+def _file_hash_index_exists(cursor):  
+    """Whether the unique index on hash_value is in place; re-checked every few minutes while it's missing."""  
+    global _file_hash_index_ready, _file_hash_index_checked_at  
+    if _file_hash_index_ready:  
+        return True  
+    now = time.time()  
+    if now - _file_hash_index_checked_at < FILE_HASH_INDEX_RECHECK_INTERVAL:  
+        return False  
+    _file_hash_index_checked_at = now  
+    # A CONCURRENTLY build that failed leaves an invalid index behind, which ON CONFLICT can't use  
+    cursor.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (FILE_HASH_UNIQUE_INDEX,))  
+    row = cursor.fetchone()  
+    _file_hash_index_ready = bool(row and row[0])  
+    if not _file_hash_index_ready:  
+        logging.warning(f"{FILE_HASH_UNIQUE_INDEX} is missing, saving file hashes without the upsert. Run the migration in the README.")  
+    return _file_hash_index_ready  
+  
+# Function to store the response for a newly processed file  
+def save_file_hash_response(hash_value, openai_response, uploaded_by):  
+    _cache_file_response(hash_value, openai_response)  
+  
+    connection = get_db_connection()  
+    if connection is None:  
+        logging.error("No database connection available. Skipping save file operation.")  
+        return  
+  
+    try:  
+        with connection.cursor() as cursor:  
+            if _file_hash_index_exists(cursor):  
+                # Atomic against a concurrent upload of the same file: the unique index turns the second insert into a no-op  
+                query = """  
+                    INSERT INTO public.bot_file_upload_hashes (hash_value, file_payload, uploaded_by, reuse_count)  
+                    VALUES (%s, %s, %s, 0)  
+                    ON CONFLICT (hash_value) DO NOTHING  
+                    RETURNING pk_id  
+                """  
+                cursor.execute(query, (hash_value, openai_response, uploaded_by))  
+            else:  
+                # Skips files that are already saved, though two concurrent uploads can still both insert  
+                query = """  
+                    INSERT INTO public.bot_file_upload_hashes (hash_value, file_payload, uploaded_by, reuse_count)  
+                    SELECT %s, %s, %s, 0  
+                    WHERE NOT EXISTS (SELECT 1 FROM public.bot_file_upload_hashes WHERE hash_value = %s)  
+                    RETURNING pk_id  
+                """  
+                cursor.execute(query, (hash_value, openai_response, uploaded_by, hash_value))  
+            inserted = cursor.fetchone()  
+        connection.commit()  
+        if inserted:  
+            logging.info(f"File with hash {hash_value} saved successfully with pk_id: {inserted[0]}")  
+        else:  
+            logging.info(f"File with hash {hash_value} was already saved by another upload.")  
+    except Exception as e:  
+        connection.rollback()  
+        logging.error(f"Failed to save file hash: {e}")  
+    finally:  
+        release_db_connection(connection)  
+  
+# Memory-cache hits are answered without a trip through the thread pool  
+async def fetch_file_hash_response_async(hash_value):  
+    payload = _get_cached_file_response(hash_value)  
+    if payload is not None:  
+        logging.info(f"File with hash {hash_value} found in memory cache.")  
+        file_hash_reuse_writer.enqueue(hash_value)  
+        return payload  
+    return await run_blocking(fetch_file_hash_response, hash_value)  
+  
+async def save_file_hash_response_async(hash_value, openai_response, uploaded_by):  
+    await run_blocking(save_file_hash_response, hash_value, openai_response, uploaded_by)  
+  
+_slack_event_table_ready = False  
+_slack_event_last_prune = 0.0  
+  
+def _ensure_slack_event_table(cursor):  
+    global _slack_event_table_ready  
+    if not _slack_event_table_ready:  
+        cursor.execute(f"""  
+            CREATE TABLE IF NOT EXISTS {SLACK_EVENT_DEDUP_TABLE} (  
+                event_key TEXT PRIMARY KEY,  
+                first_seen TIMESTAMPTZ NOT NULL DEFAULT now(),  
+                completed_at TIMESTAMPTZ  
+            )  
+        """)  
+        # Tables created before claims tracked completion; NULL reads as in flight, so old rows just expire  
+        cursor.execute(  
+            "SELECT 1 FROM information_schema.columns WHERE table_schema || '.' || table_name = %s AND column_name = 'completed_at'",  
+            (SLACK_EVENT_DEDUP_TABLE,)  
+        )  
+        if cursor.fetchone() is None:  
+            cursor.execute(f"ALTER TABLE {SLACK_EVENT_DEDUP_TABLE} ADD COLUMN IF NOT EXISTS completed_at TIMESTAMPTZ")  
+        _slack_event_table_ready = True  
+  
+def _prune_slack_events(cursor):  
+    global _slack_event_last_prune  
+    now = time.time()  
+    if now - _slack_event_last_prune < 3600:  
+        return  
+    _slack_event_last_prune = now  
+    cursor.execute(  
+        f"DELETE FROM {SLACK_EVENT_DEDUP_TABLE} WHERE first_seen < now() - make_interval(hours => %s)",  
+        (SLACK_EVENT_DEDUP_RETENTION_HOURS,)  
+    )  
+  
+# Function to claim a Slack event; returns True if this instance is the first to see it (or takes over  
+# an in-flight claim that went stale), False if another delivery holds it, and None if the database is unavailable  
+def claim_slack_event(event_key):  
     connection = get_db_connection()  
     if connection is None:  
-        logging.error("No database connection available. Skipping save or fetch file operation.")  
         return None  
   
     try:  
-        cursor = connection.cursor()  
-  
-        # Check if the hash value already exists  
-        query_check = "SELECT pk_id, file_payload, reuse_count FROM public.bot_file_upload_hashes WHERE hash_value = %s"  
-        cursor.execute(query_check, (hash_value,))  
-        existing_record = cursor.fetchone()  
-  
-        if existing_record:  
-            logging.info(f"File with hash {hash_value} already exists. Fetching existing record.")  
-              
-            # Increment the reuse count  
-            pk_id = existing_record[0]  
-            current_reuse_count = existing_record[2]  
-            new_reuse_count = current_reuse_count + 1  
-              
-            query_update = "UPDATE public.bot_file_upload_hashes SET reuse_count = %s WHERE pk_id = %s"  
-            cursor.execute(query_update, (new_reuse_count, pk_id))  
-            connection.commit()  
-              
-            return existing_record[1]  # Return the existing OpenAI response  
-  
-        # Insert the new file record  
-        query_insert = """  
-            INSERT INTO public.bot_file_upload_hashes (hash_value, file_payload, uploaded_by, reuse_count)  
-            VALUES (%s, %s, %s, %s) RETURNING pk_id  
-        """  
-        cursor.execute(query_insert, (hash_value, openai_response, uploaded_by, 0))  
+        with connection.cursor() as cursor:  
+            _ensure_slack_event_table(cursor)  
+            cursor.execute(  
+                f"""  
+                INSERT INTO {SLACK_EVENT_DEDUP_TABLE} AS t (event_key) VALUES (%s)  
+                ON CONFLICT (event_key) DO UPDATE SET first_seen = now()  
+                WHERE t.completed_at IS NULL AND t.first_seen < now() - make_interval(secs => %s)  
+                RETURNING event_key  
+                """,  
+                (event_key, SLACK_EVENT_INFLIGHT_TTL_SECONDS)  
+            )  
+            claimed = cursor.fetchone() is not None  
+            _prune_slack_events(cursor)  
         connection.commit()  
-        pk_id = cursor.fetchone()[0]  
-        cursor.close()  
-        logging.info(f"File with hash {hash_value} saved successfully with pk_id: {pk_id}")  
+        return claimed  
+    except Exception as e:  
+        connection.rollback()  
+        logging.error(f"Failed to claim Slack event {event_key}: {e}")  
         return None  
+    finally:  
+        release_db_connection(connection)  
+  
+async def claim_slack_event_async(event_key):  
+    return await run_blocking(claim_slack_event, event_key)  
+  
+# Function to settle a claim once its turn ends: completed claims block redeliveries until they're pruned,  
+# released ones are deleted so Slack's next redelivery gets handled  
+def finish_slack_event(event_key, completed):  
+    connection = get_db_connection()  
+    if connection is None:  
+        return  
+  
+    try:  
+        with connection.cursor() as cursor:  
+            if completed:  
+                cursor.execute(f"UPDATE {SLACK_EVENT_DEDUP_TABLE} SET completed_at = now() WHERE event_key = %s", (event_key,))  
+            else:  
+                cursor.execute(f"DELETE FROM {SLACK_EVENT_DEDUP_TABLE} WHERE event_key = %s AND completed_at IS NULL", (event_key,))  
+        connection.commit()  
+    except Exception as e:  
+        connection.rollback()  
+        logging.error(f"Failed to finish Slack event {event_key}: {e}")  
+    finally:  
+        release_db_connection(connection)  
+  
+async def finish_slack_event_async(event_key, completed):  
+    await run_blocking(finish_slack_event, event_key, completed)  
+
+_completion_cache_table_ready = False  
+_completion_cache_last_prune = 0.0  
+
+def _ensure_completion_cache_table(cursor):  
+    global _completion_cache_table_ready  
+    if not _completion_cache_table_ready:  
+        cursor.execute(f"""  
+            CREATE TABLE IF NOT EXISTS {COMPLETION_CACHE_TABLE} (  
+                cache_key TEXT PRIMARY KEY,  
+                response TEXT NOT NULL,  
+                model_name TEXT,  
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),  
+                expires_at TIMESTAMPTZ NOT NULL  
+            )  
+        """)  
+        _completion_cache_table_ready = True  
+
+def _prune_completion_cache(cursor):  
+    global _completion_cache_last_prune  
+    now = time.time()  
+    if now - _completion_cache_last_prune < 3600:  
+        return  
+    _completion_cache_last_prune = now  
+    cursor.execute(f"DELETE FROM {COMPLETION_CACHE_TABLE} WHERE expires_at < now()")  
+
+# Function to look up an unexpired cached completion; returns (response_json, model_name, expires_at_epoch) or None  
+def fetch_cached_completion(cache_key):  
+    connection = get_db_connection()  
+    if connection is None:  
+        return None  
+
+    try:  
+        with connection.cursor() as cursor:  
+            _ensure_completion_cache_table(cursor)  
+            cursor.execute(  
+                f"SELECT response, model_name, EXTRACT(EPOCH FROM expires_at) FROM {COMPLETION_CACHE_TABLE} WHERE cache_key = %s AND expires_at > now()",  
+                (cache_key,)  
+            )  
+            row = cursor.fetchone()  
+        connection.commit()  
+        return (row[0], row[1], float(row[2])) if row else None  
     except Exception as e:  
-        logging.error(f"Failed to save or fetch file: {e}")  
+        connection.rollback()  
+        logging.error(f"Failed to read completion cache entry {cache_key}: {e}")  
         return None  
     finally:  
         release_db_connection(connection)  
+
+# Function to upsert a batch of cached completions (runs on the background writer thread)  
+def write_completion_cache_batch(rows):  
+    connection = get_db_connection()  
+    if connection is None:  
+        raise RuntimeError("No database connection available")  
+
+    # ON CONFLICT can't touch the same row twice in one statement, so keep the newest entry per key  
+    latest = {row[0]: row for row in rows}  
+    try:  
+        with connection.cursor() as cursor:  
+            _ensure_completion_cache_table(cursor)  
+            query = f"""  
+                INSERT INTO {COMPLETION_CACHE_TABLE} (cache_key, response, model_name, expires_at)  
+                VALUES %s  
+                ON CONFLICT (cache_key) DO UPDATE  
+                SET response = EXCLUDED.response, model_name = EXCLUDED.model_name,  
+                    created_at = now(), expires_at = EXCLUDED.expires_at  
+            """  
+            execute_values(cursor, query, list(latest.values()), template="(%s, %s, %s, to_timestamp(%s))", page_size=len(latest))  
+            _prune_completion_cache(cursor)  
+        connection.commit()  
+        logging.debug(f"Flushed {len(latest)} completion cache entr(ies) to {COMPLETION_CACHE_TABLE}")  
+    except Exception:  
+        connection.rollback()  
+        raise  
+    finally:  
+        release_db_connection(connection)  
+
+completion_cache_writer = BackgroundBatchWriter(  
+    "completion_cache",  
+    write_completion_cache_batch,  
+    batch_size=50,  
+    flush_interval=COMPLETION_CACHE_FLUSH_INTERVAL,  
+    max_queue_size=1000  
+)  
+
+# Queue a completion for the shared cache tier; returns immediately  
+def enqueue_completion_cache_write(cache_key, response_json, model_name, expires_at):  
+    return completion_cache_writer.enqueue((cache_key, response_json, model_name, expires_at))  
+
+_rate_budget_table_ready = False  
+
+def _ensure_rate_budget_table(cursor):  
+    global _rate_budget_table_ready  
+    if not _rate_budget_table_ready:  
+        cursor.execute(f"""  
+            CREATE TABLE IF NOT EXISTS {RATE_BUDGET_TABLE} (  
+                id BIGSERIAL PRIMARY KEY,  
+                deployment TEXT NOT NULL,  
+                tokens INTEGER NOT NULL,  
+                created DOUBLE PRECISION NOT NULL  
+            )  
+        """)  
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS bot_openai_rate_budget_by_deployment ON {RATE_BUDGET_TABLE} (deployment, created)")  
+        _rate_budget_table_ready = True  
+
+# Function to try to reserve budget on a deployment; ``decide(rows, now)`` gets the window's (created, tokens)  
+# rows, oldest first, and returns 0 to reserve or the seconds to wait. Returns (reservation_id, wait).  
+def reserve_rate_budget(deployment, tokens, window, decide):  
+    connection = get_db_connection()  
+    if connection is None:  
+        raise RuntimeError("No database connection available")  
+
+    try:  
+        with connection.cursor() as cursor:  
+            _ensure_rate_budget_table(cursor)  
+            # Serialize reservations per deployment across every instance for this transaction  
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (deployment,))  
+            now = time.time()  
+            cursor.execute(f"DELETE FROM {RATE_BUDGET_TABLE} WHERE deployment = %s AND created < %s", (deployment, now - window))  
+            cursor.execute(f"SELECT created, tokens FROM {RATE_BUDGET_TABLE} WHERE deployment = %s ORDER BY created", (deployment,))  
+            wait = decide(cursor.fetchall(), now)  
+            reservation_id = None  
+            if not wait:  
+                cursor.execute(  
+                    f"INSERT INTO {RATE_BUDGET_TABLE} (deployment, tokens, created) VALUES (%s, %s, %s) RETURNING id",  
+                    (deployment, tokens, now)  
+                )  
+                reservation_id = cursor.fetchone()[0]  
+        connection.commit()  
+        return reservation_id, wait  
+    except Exception:  
+        connection.rollback()  
+        raise  
+    finally:  
+        release_db_connection(connection)  
+
+# Function to replace a reservation's estimated tokens with the actual usage  
+def settle_rate_budget(reservation_id, tokens):  
+    connection = get_db_connection()  
+    if connection is None:  
+        raise RuntimeError("No database connection available")  
+
+    try:  
+        with connection.cursor() as cursor:  
+            cursor.execute(f"UPDATE {RATE_BUDGET_TABLE} SET tokens = %s WHERE id = %s", (tokens, reservation_id))  
+        connection.commit()  
+    except Exception:  
+        connection.rollback()  
+        raise  
+    finally:  
+        release_db_connection(connection)  
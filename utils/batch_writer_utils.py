@@ -0,0 +1,129 @@
+# utils/batch_writer_utils.py  
+import time  
+import atexit  
+import logging  
+import threading  
+from collections import deque  
+
+OVERFLOW_DROP_NEWEST = "drop_newest"  
+OVERFLOW_DROP_OLDEST = "drop_oldest"  
+
+_writers = []  
+_writers_lock = threading.Lock()  
+
+
+class BackgroundBatchWriter:  
+    """Buffers items in memory and hands them to ``flush_func`` in batches from a daemon thread.  
+
+    ``enqueue`` never blocks: it appends to a bounded buffer and returns. A batch is  
+    flushed as soon as ``batch_size`` items are waiting, and whatever is buffered is  
+    flushed every ``flush_interval`` seconds. When the buffer is full the  
+    ``overflow_policy`` decides whether the new item or the oldest buffered item is  
+    dropped. Every writer is flushed at interpreter exit and by ``shutdown_batch_writers``.  
+    """  
+
+    def __init__(self, name, flush_func, batch_size=50, flush_interval=2.0, max_queue_size=5000, overflow_policy=OVERFLOW_DROP_NEWEST):  
+        self.name = name  
+        self.flush_func = flush_func  
+        self.batch_size = max(1, batch_size)  
+        self.flush_interval = flush_interval  
+        self.max_queue_size = max(1, max_queue_size)  
+        self.overflow_policy = overflow_policy  
+        self.dropped_count = 0  
+        self.flushed_count = 0  
+        self.failed_count = 0  
+        self._buffer = deque()  
+        self._condition = threading.Condition()  
+        self._thread = None  
+        self._stopping = False  
+        with _writers_lock:  
+            _writers.append(self)  
+
+    def _ensure_started(self):  
+        if self._thread is None or not self._thread.is_alive():  
+            self._stopping = False  
+            self._thread = threading.Thread(target=self._run, name=f"batch-writer-{self.name}", daemon=True)  
+            self._thread.start()  
+
+    def enqueue(self, item):  
+        """Buffer an item for the next batch. Returns False if the item was dropped."""  
+        with self._condition:  
+            if self._stopping:  
+                self.dropped_count += 1  
+                return False  
+            self._ensure_started()  
+            if len(self._buffer) >= self.max_queue_size:  
+                self.dropped_count += 1  
+                if self.overflow_policy == OVERFLOW_DROP_OLDEST:  
+                    self._buffer.popleft()  
+                else:  
+                    logging.warning(f"[{self.name}] buffer full ({self.max_queue_size}), dropping new item")  
+                    return False  
+            self._buffer.append(item)  
+            if len(self._buffer) >= self.batch_size:  
+                self._condition.notify()  
+        return True  
+
+    def _take_batch(self):  
+        batch = []  
+        while self._buffer and len(batch) < self.batch_size:  
+            batch.append(self._buffer.popleft())  
+        return batch  
+
+    def _write(self, batch):  
+        try:  
+            self.flush_func(batch)  
+            self.flushed_count += len(batch)  
+        except Exception as e:  
+            self.failed_count += len(batch)  
+            logging.error(f"[{self.name}] failed to flush batch of {len(batch)}: {e}")  
+
+    def _run(self):  
+        while True:  
+            with self._condition:  
+                deadline = time.time() + self.flush_interval  
+                while not self._stopping and len(self._buffer) < self.batch_size:  
+                    remaining = deadline - time.time()  
+                    if remaining <= 0:  
+                        break  
+                    self._condition.wait(remaining)  
+                batch = self._take_batch()  
+                stopping = self._stopping  
+            if batch:  
+                self._write(batch)  
+            if stopping:  
+                with self._condition:  
+                    if not self._buffer:  
+                        return  
+
+    def flush(self):  
+        """Synchronously write everything currently buffered."""  
+        while True:  
+            with self._condition:  
+                batch = self._take_batch()  
+            if not batch:  
+                return  
+            self._write(batch)  
+
+    def shutdown(self, timeout=10.0):  
+        """Stop accepting items and drain the buffer."""  
+        with self._condition:  
+            self._stopping = True  
+            self._condition.notify_all()  
+            thread = self._thread  
+        if thread is not None and thread.is_alive():  
+            thread.join(timeout)  
+        self.flush()  
+        if self.dropped_count:  
+            logging.warning(f"[{self.name}] dropped {self.dropped_count} item(s) due to overflow or shutdown")  
+
+
+def shutdown_batch_writers(timeout=10.0):  
+    """Drain every background writer (called on app shutdown and at interpreter exit)."""  
+    with _writers_lock:  
+        writers = list(_writers)  
+    for writer in writers:  
+        writer.shutdown(timeout)  
+
+
+atexit.register(shutdown_batch_writers)  
@@ -0,0 +1,151 @@
+# utils/completion_cache_utils.py  
+import os  
+import json  
+import time  
+import hashlib  
+import logging  
+import threading  
+from collections import OrderedDict  
+from utils.http_utils import run_blocking  
+from utils.metrics_utils import Counter  
+
+### GLOBAL VARIABLES ###  
+# Opt-in: repeated questions are answered from the cache instead of a new completion  
+COMPLETION_CACHE_ENABLED = os.environ.get("APPSETTING_COMPLETION_CACHE_ENABLED", "false").lower() == "true"  
+COMPLETION_CACHE_SIZE = int(os.environ.get("APPSETTING_COMPLETION_CACHE_SIZE", "500"))  
+COMPLETION_CACHE_TTL = int(os.environ.get("APPSETTING_COMPLETION_CACHE_TTL", "86400"))  # seconds  
+# Also keep entries in Postgres so every instance (and restarts) share them  
+COMPLETION_CACHE_DB_ENABLED = os.environ.get("APPSETTING_COMPLETION_CACHE_DB_ENABLED", "true").lower() == "true"  
+# Calls sampled above this temperature are meant to vary, so they're never cached  
+COMPLETION_CACHE_MAX_TEMPERATURE = float(os.environ.get("APPSETTING_COMPLETION_CACHE_MAX_TEMPERATURE", "0.5"))  
+
+# Request parameters that change the answer and so belong in the key  
+CACHE_KEY_PARAMS = ("temperature", "top_p", "max_tokens", "frequency_penalty", "presence_penalty", "stop")  
+
+COMPLETION_CACHE_REQUESTS = Counter(  
+    "bot_completion_cache_requests",  
+    "Completion cache lookups by result (hit_memory, hit_db, miss, bypass).",  
+    ["result"]  
+)  
+
+_memory_cache = OrderedDict()  # cache_key -> (expires_at, response, model_name)  
+_memory_cache_lock = threading.Lock()  
+
+
+def _normalize_content(content):  
+    return " ".join(content.split())  
+
+
+# Function to build the cache key for a chat completion request, or None when the request must not be cached  
+def completion_cache_key(request_kwargs):  
+    if not COMPLETION_CACHE_ENABLED:  
+        return None  
+
+    messages = request_kwargs.get("messages") or []  
+    temperature = request_kwargs.get("temperature") or 0  
+    # Anything beyond the system prompt and the new question depends on the conversation so far  
+    conversation = [message for message in messages if message.get("role") != "system"]  
+    if temperature > COMPLETION_CACHE_MAX_TEMPERATURE or len(conversation) != 1:  
+        COMPLETION_CACHE_REQUESTS.inc(result="bypass")  
+        return None  
+    if not all(isinstance(message.get("content"), str) for message in messages):  
+        COMPLETION_CACHE_REQUESTS.inc(result="bypass")  # image parts and other structured content  
+        return None  
+
+    canonical = {  
+        "model": request_kwargs.get("model"),  
+        "messages": [[message["role"], _normalize_content(message["content"])] for message in messages],  
+        "params": {name: request_kwargs.get(name) for name in CACHE_KEY_PARAMS}  
+    }  
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)  
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()  
+
+
+def _remember(cache_key, expires_at, response, model_name):  
+    with _memory_cache_lock:  
+        _memory_cache[cache_key] = (expires_at, response, model_name)  
+        _memory_cache.move_to_end(cache_key)  
+        while len(_memory_cache) > COMPLETION_CACHE_SIZE:  
+            _memory_cache.popitem(last=False)  
+
+
+def _lookup_memory(cache_key):  
+    with _memory_cache_lock:  
+        entry = _memory_cache.get(cache_key)  
+        if entry is None:  
+            return None  
+        if entry[0] <= time.time():  
+            del _memory_cache[cache_key]  
+            return None  
+        _memory_cache.move_to_end(cache_key)  
+        return entry  
+
+
+def _cached_result(response, model_name):  
+    # Copy so callers can't mutate the cached entry; "cached" lets the footer label the reply  
+    result = json.loads(json.dumps(response))  
+    result["cached"] = True  
+    return result, model_name  
+
+
+def _lookup_db(cache_key):  
+    # Imported here so the local chatbot, which runs without the database, never opens the pool  
+    from utils.azure_postgres_utils import fetch_cached_completion  
+    row = fetch_cached_completion(cache_key)  
+    if row is None:  
+        return None  
+    response_json, model_name, expires_at = row  
+    try:  
+        response = json.loads(response_json)  
+    except ValueError as e:  
+        logging.error(f"Ignoring unreadable completion cache entry {cache_key}: {e}")  
+        return None  
+    _remember(cache_key, expires_at, response, model_name)  
+    return expires_at, response, model_name  
+
+
+# Function to look up a cached completion; returns (response, model_name) or None  
+def get_cached_completion(cache_key):  
+    entry = _lookup_memory(cache_key)  
+    result = "hit_memory"  
+    if entry is None and COMPLETION_CACHE_DB_ENABLED:  
+        entry = _lookup_db(cache_key)  
+        result = "hit_db"  
+    if entry is None:  
+        COMPLETION_CACHE_REQUESTS.inc(result="miss")  
+        return None  
+    COMPLETION_CACHE_REQUESTS.inc(result=result)  
+    logging.info(f"Completion cache {result} for key {cache_key[:12]}")  
+    return _cached_result(entry[1], entry[2])  
+
+
+# Awaitable version of get_cached_completion; memory hits don't leave the event loop  
+async def get_cached_completion_async(cache_key):  
+    entry = _lookup_memory(cache_key)  
+    if entry is not None:  
+        COMPLETION_CACHE_REQUESTS.inc(result="hit_memory")  
+        logging.info(f"Completion cache hit_memory for key {cache_key[:12]}")  
+        return _cached_result(entry[1], entry[2])  
+    if not COMPLETION_CACHE_DB_ENABLED:  
+        COMPLETION_CACHE_REQUESTS.inc(result="miss")  
+        return None  
+    return await run_blocking(get_cached_completion, cache_key)  
+
+
+# Function to store a successful completion in both tiers (the database write happens in the background)  
+def store_completion(cache_key, response, model_name):  
+    if not cache_key or "choices" not in response:  
+        return  
+    expires_at = time.time() + COMPLETION_CACHE_TTL  
+    _remember(cache_key, expires_at, response, model_name)  
+    if COMPLETION_CACHE_DB_ENABLED:  
+        from utils.azure_postgres_utils import enqueue_completion_cache_write  
+        enqueue_completion_cache_write(cache_key, json.dumps(response), model_name, expires_at)  
+
+
+# Function to report cache counters, e.g. for logging or a health check  
+def get_completion_cache_stats():  
+    stats = {result: count for (result,), count in COMPLETION_CACHE_REQUESTS.values().items()}  
+    with _memory_cache_lock:  
+        stats["memory_entries"] = len(_memory_cache)  
+    return stats  
@@ -0,0 +1,126 @@
+# utils/context_window_utils.py  
+import os  
+import asyncio  
+import hashlib  
+import logging  
+import zlib  
+from collections import OrderedDict  
+from utils.token_utils import count_tokens_cached, chunk_text  
+from utils.openai_utils import summarize_text_with_openai_async  
+
+### GLOBAL VARIABLES ###  
+# Tokens of thread history sent with each turn; older turns are folded into a rolling summary (0 disables)  
+CONTEXT_WINDOW_TOKEN_BUDGET = int(os.environ.get("APPSETTING_CONTEXT_WINDOW_TOKEN_BUDGET", "12000"))  
+# Part of the budget kept free for the summary itself  
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.environ.get("APPSETTING_CONTEXT_SUMMARY_MAX_TOKENS", "1000"))  
+# Turns that age out are summarized in slices of at most this many tokens  
+CONTEXT_SUMMARY_FOLD_TOKENS = int(os.environ.get("APPSETTING_CONTEXT_SUMMARY_FOLD_TOKENS", "60000"))  
+CONTEXT_SUMMARY_CACHE_SIZE = int(os.environ.get("APPSETTING_CONTEXT_SUMMARY_CACHE_SIZE", "500"))  
+
+TOKENS_PER_MESSAGE = 3  # same per-message overhead num_tokens_from_messages charges  
+CONTEXT_SUMMARY_PROMPT = (  
+    "You maintain a running summary of a Slack thread between users and an AI assistant. "  
+    "Merge the new messages into the existing summary, keeping names, decisions, facts, figures, "  
+    "open questions and anything the assistant committed to. Reply with the updated summary only, "  
+    f"in at most {CONTEXT_SUMMARY_MAX_TOKENS * 3 // 4} words."  
+)  
+CONTEXT_SUMMARY_HEADER = "Summary of the earlier part of this thread:\n"  
+
+# (channel, thread_ts) -> {"folded": number of leading turns in the summary, "last_hash": hash of the last one, "summary": str}  
+_thread_summaries = OrderedDict()  
+# Striped locks so two turns in one thread never fold the same messages twice  
+_fold_locks = [asyncio.Lock() for _ in range(64)]  
+
+
+def _message_hash(message):  
+    return hashlib.sha1(f"{message.get('role')}:{message.get('content') or ''}".encode("utf-8", "surrogatepass")).hexdigest()  
+
+
+def _get_summary_state(thread_key, chat_history):  
+    """Return the thread's summary state if it still matches the start of ``chat_history``."""  
+    state = _thread_summaries.get(thread_key)  
+    if state is None:  
+        return None  
+    folded = state["folded"]  
+    if folded >= len(chat_history) or _message_hash(chat_history[folded - 1]) != state["last_hash"]:  
+        # The thread was edited or trimmed under us; start the summary over  
+        logging.debug(f"Discarding stale context summary for thread {thread_key}")  
+        del _thread_summaries[thread_key]  
+        return None  
+    _thread_summaries.move_to_end(thread_key)  
+    return state  
+
+
+def _store_summary_state(thread_key, chat_history, folded, summary):  
+    _thread_summaries[thread_key] = {  
+        "folded": folded,  
+        "last_hash": _message_hash(chat_history[folded - 1]),  
+        "summary": summary  
+    }  
+    _thread_summaries.move_to_end(thread_key)  
+    while len(_thread_summaries) > CONTEXT_SUMMARY_CACHE_SIZE:  
+        _thread_summaries.popitem(last=False)  
+
+
+def _recent_start(message_tokens, budget):  
+    """Index of the oldest message that still fits in ``budget`` counting back from the newest (which always fits)."""  
+    used = 0  
+    start = len(message_tokens)  
+    for i in range(len(message_tokens) - 1, -1, -1):  
+        if used + message_tokens[i] > budget and start < len(message_tokens):  
+            break  
+        used += message_tokens[i]  
+        start = i  
+    return start  
+
+
+async def _fold_into_summary(summary, messages):  
+    """Extend ``summary`` with ``messages``; returns None if a summarization call failed."""  
+    transcript = "\n".join(f"{message.get('role')}: {message.get('content') or ''}" for message in messages)  
+    for piece in chunk_text(transcript, CONTEXT_SUMMARY_FOLD_TOKENS):  
+        prompt = f"Existing summary:\n{summary or '(none yet)'}\n\nNew messages:\n{piece}"  
+        result, _ = await summarize_text_with_openai_async(prompt, CONTEXT_SUMMARY_PROMPT, handler="context_summary")  
+        if not result:  
+            return None  
+        summary = result.strip()  
+    return summary  
+
+
+async def fit_chat_history(thread_key, chat_history, total_tokens=None):  
+    """Bound a thread's history to CONTEXT_WINDOW_TOKEN_BUDGET tokens.  
+
+    The newest turns are kept verbatim; turns that no longer fit are folded into a  
+    rolling summary, cached per ``thread_key`` and sent as one system message. The  
+    summary is only extended when more turns age out, so each turn costs at most one  
+    small summarization call. ``total_tokens`` (from update_thread_token_total) lets  
+    short threads skip counting altogether.  
+    """  
+    if CONTEXT_WINDOW_TOKEN_BUDGET <= 0 or len(chat_history) < 2:  
+        return chat_history  
+    if thread_key not in _thread_summaries and total_tokens is not None and total_tokens <= CONTEXT_WINDOW_TOKEN_BUDGET:  
+        return chat_history  
+
+    message_tokens = [count + TOKENS_PER_MESSAGE for count in count_tokens_cached([message.get("content") or "" for message in chat_history])]  
+    if thread_key not in _thread_summaries and sum(message_tokens) <= CONTEXT_WINDOW_TOKEN_BUDGET:  
+        return chat_history  
+
+    async with _fold_locks[zlib.crc32(repr(thread_key).encode("utf-8")) % len(_fold_locks)]:  
+        state = _get_summary_state(thread_key, chat_history)  
+        folded = state["folded"] if state else 0  
+        summary = state["summary"] if state else ""  
+        # Turns already in the summary stay there even if the recent window could hold them again  
+        start = max(_recent_start(message_tokens, CONTEXT_WINDOW_TOKEN_BUDGET - CONTEXT_SUMMARY_MAX_TOKENS), folded)  
+        if start > folded:  
+            new_summary = await _fold_into_summary(summary, chat_history[folded:start])  
+            if new_summary is None:  
+                # Keep the prompt bounded anyway; the same turns are retried on the next turn  
+                logging.error(f"Could not summarize {start - folded} aged-out turn(s) of thread {thread_key}; sending without them")  
+            else:  
+                summary = new_summary  
+                _store_summary_state(thread_key, chat_history, start, summary)  
+                logging.info(f"Folded {start - folded} turn(s) of thread {thread_key} into its summary, {len(chat_history) - start} recent turn(s) kept")  
+
+    recent = chat_history[start:]  
+    if not summary:  
+        return recent  
+    return [{"role": "system", "content": CONTEXT_SUMMARY_HEADER + summary}] + recent  
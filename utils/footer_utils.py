@@ -3,7 +3,7 @@ from .openai_utils import calculate_cost  # Use relative import
   
 APP_VERSION = "1.0707.1611"  
   
-def generate_footer(platform: str, response_time: float, model_name: str = "gpt-4o", input_tokens: int = 0, output_tokens: int = 0) -> str:  
+def generate_footer(platform: str, response_time: float, model_name: str = "gpt-4o", input_tokens: int = 0, output_tokens: int = 0, cached: bool = False) -> str:  
     """Generates a footer string with application version, OpenAI model information, cost, and response time.  
       
     Args:  
@@ -12,6 +12,7 @@ def generate_footer(platform: str, response_time: float, model_name: str = "gpt-
         model_name (str, optional): The name of the OpenAI model used. Defaults to "gpt-4o".  
         input_tokens (int, optional): The number of input tokens used. Defaults to 0.  
         output_tokens (int, optional): The number of output tokens used. Defaults to 0.  
+        cached (bool, optional): Whether the reply was served from the completion cache. Defaults to False.  
   
     Returns:  
         str: The formatted footer string.  
@@ -28,12 +29,18 @@ def generate_footer(platform: str, response_time: float, model_name: str = "gpt-
   
     logging.debug(f"Calculating cost for model {model_name} with input tokens {input_tokens} and output tokens {output_tokens}")  
     estimated_cost = calculate_cost(model_name, input_tokens, output_tokens)  
+    if cached:  
+        estimated_cost = 0.0  # No completion was made for a cached reply  
     logging.debug(f"Calculated cost for model {model_name}: input_cost={input_tokens}, output_cost={output_tokens}, total_cost={estimated_cost:.4f}")  
   
     footer = f"App Version: {APP_VERSION} | OpenAI Model: {model_name} (Cost: ~${estimated_cost:.4f}) | Response Time: {response_time:.3f}s"  
   
     if platform == "slack":  
         footer = f"*App Version*: `{APP_VERSION}` | *OpenAI Model*: `{model_name}` (Cost: ~`${estimated_cost:.4f}`) | *Response Time*: `{response_time:.3f}s`"  
+        if cached:  
+            footer += " | *Cache*: `hit`"  
+    elif cached:  
+        footer += " | Cache: hit"  
   
     logging.debug(f"Generated footer: {footer}")  
     return footer  
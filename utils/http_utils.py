@@ -0,0 +1,65 @@
+# utils/http_utils.py  
+import os  
+import asyncio  
+import functools  
+import logging  
+from concurrent.futures import ThreadPoolExecutor  
+import aiohttp  
+
+### GLOBAL VARIABLES ###  
+# Outbound HTTP pool shared by every async Slack / web call in the process  
+HTTP_MAX_CONNECTIONS = int(os.environ.get("APPSETTING_HTTP_MAX_CONNECTIONS", "100"))  
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("APPSETTING_HTTP_MAX_CONNECTIONS_PER_HOST", "30"))  
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get("APPSETTING_HTTP_KEEPALIVE_TIMEOUT", "60"))  
+HTTP_REQUEST_TIMEOUT = float(os.environ.get("APPSETTING_HTTP_REQUEST_TIMEOUT", "30"))  
+
+# Thread pool for the calls that have to stay synchronous (psycopg2, PyPDF2, jira, requests)  
+BLOCKING_EXECUTOR_WORKERS = int(os.environ.get("APPSETTING_BLOCKING_EXECUTOR_WORKERS", "32"))  
+
+_http_session = None  
+_blocking_executor = None  
+
+
+def get_http_session():  
+    """Returns the shared aiohttp.ClientSession, creating it on first use inside the running loop."""  
+    global _http_session  
+    if _http_session is None or _http_session.closed:  
+        logging.debug("Creating shared aiohttp ClientSession")  
+        connector = aiohttp.TCPConnector(  
+            limit=HTTP_MAX_CONNECTIONS,  
+            limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,  
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT  
+        )  
+        _http_session = aiohttp.ClientSession(  
+            connector=connector,  
+            timeout=aiohttp.ClientTimeout(total=HTTP_REQUEST_TIMEOUT)  
+        )  
+    return _http_session  
+
+
+def get_blocking_executor():  
+    """Returns the shared thread pool used to keep synchronous I/O off the event loop."""  
+    global _blocking_executor  
+    if _blocking_executor is None:  
+        _blocking_executor = ThreadPoolExecutor(  
+            max_workers=BLOCKING_EXECUTOR_WORKERS,  
+            thread_name_prefix="blocking-io"  
+        )  
+    return _blocking_executor  
+
+
+async def run_blocking(func, *args, **kwargs):  
+    """Runs a synchronous function in the shared thread pool and awaits its result."""  
+    loop = asyncio.get_running_loop()  
+    return await loop.run_in_executor(get_blocking_executor(), functools.partial(func, *args, **kwargs))  
+
+
+async def close_http_resources():  
+    """Closes the shared HTTP session and thread pool (called on app shutdown)."""  
+    global _http_session, _blocking_executor  
+    if _http_session is not None and not _http_session.closed:  
+        await _http_session.close()  
+    _http_session = None  
+    if _blocking_executor is not None:  
+        _blocking_executor.shutdown(wait=True)  
+        _blocking_executor = None  
@@ -3,6 +3,7 @@ import os
 import logging  
 from jira import JIRA, JIRAError  
 from dotenv import load_dotenv  
+from utils.http_utils import run_blocking  
   
 # Load environment variables from .env file  
 load_dotenv()  
@@ -20,7 +21,7 @@ jira = JIRA(server=jira_server, basic_auth=(username, api_token))
   
 async def fetch_issue_details(issue_key):  
     try:  
-        issue = jira.issue(issue_key)  
+        issue = await run_blocking(jira.issue, issue_key)  
         logging.debug("Raw JIRA issue data received... (debug by #uncommenting in jira_utils.py)")  
   
         comments = [  
@@ -35,7 +36,7 @@ async def fetch_issue_details(issue_key):
         child_issues = []  
         if issue.fields.issuetype.name.lower() == 'epic':  
             jql = f'"Epic Link" = {issue_key}'  
-            child_issues_result = jira.search_issues(jql)  
+            child_issues_result = await run_blocking(jira.search_issues, jql)  
             child_issues = [  
                 {  
                     "key": child.key,  
@@ -100,7 +101,7 @@ async def create_jira_task(subject, context):
             }  
         }  
   
-        issue = jira.create_issue(fields=task_data['fields'])  
+        issue = await run_blocking(jira.create_issue, fields=task_data['fields'])  
         return f"Task {issue.key} has been created under {parent_key} with the subject: {subject}. You can view the task [here]({jira_server}/browse/{issue.key})."  
     except JIRAError as e:  
         logging.error(f"Error creating JIRA task: {e}")  
@@ -108,7 +109,7 @@ async def create_jira_task(subject, context):
   
 async def get_issue_id(issue_key):  
     try:  
-        issue = jira.issue(issue_key)  
+        issue = await run_blocking(jira.issue, issue_key)  
         return issue.id  
     except JIRAError as e:  
         logging.error(f"Error fetching issue ID: {e}")  
@@ -0,0 +1,99 @@
+# utils/logging_utils.py  
+import os  
+import json  
+import time  
+import random  
+import logging  
+import threading  
+from collections import deque  
+
+### GLOBAL VARIABLES ###  
+LOG_LEVEL = os.environ.get("APPSETTING_LOG_LEVEL", "INFO").upper()  
+# Per-logger overrides, e.g. "openai=WARNING,httpx=WARNING,utils.search_utils=DEBUG"  
+LOG_LEVELS = os.environ.get("APPSETTING_LOG_LEVELS", "openai=WARNING,httpx=WARNING,httpcore=WARNING,urllib3=WARNING")  
+# "text" keeps the classic one-line format; "json" emits one JSON object per record  
+LOG_FORMAT = os.environ.get("APPSETTING_LOG_FORMAT", "text").lower()  
+# Fraction of large payloads (OpenAI responses, Slack payloads, activities) written to the log at DEBUG  
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("APPSETTING_LOG_PAYLOAD_SAMPLE_RATE", "0.01"))  
+# Recent payloads kept in memory regardless of sampling, for on-demand inspection  
+LOG_PAYLOAD_BUFFER_SIZE = int(os.environ.get("APPSETTING_LOG_PAYLOAD_BUFFER_SIZE", "200"))  
+
+TEXT_LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'  
+
+_payload_buffer = deque(maxlen=LOG_PAYLOAD_BUFFER_SIZE)  
+_payload_buffer_lock = threading.Lock()  
+_configured = False  
+
+
+class JsonFormatter(logging.Formatter):  
+    """One JSON object per record, with any ``extra`` fields passed to the log call."""  
+
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}  
+
+    def format(self, record):  
+        entry = {  
+            "time": self.formatTime(record),  
+            "level": record.levelname,  
+            "logger": record.name,  
+            "message": record.getMessage()  
+        }  
+        for key, value in vars(record).items():  
+            if key not in self.RESERVED:  
+                entry[key] = value  
+        if record.exc_info:  
+            entry["exception"] = self.formatException(record.exc_info)  
+        return json.dumps(entry, default=str)  
+
+
+class LazyJson:  
+    """Defers json.dumps until a log record is actually emitted: logging.debug("x: %s", LazyJson(obj))."""  
+
+    __slots__ = ("obj", "indent")  
+
+    def __init__(self, obj, indent=None):  
+        self.obj = obj  
+        self.indent = indent  
+
+    def __str__(self):  
+        try:  
+            return json.dumps(self.obj, indent=self.indent, default=str)  
+        except (TypeError, ValueError):  
+            return repr(self.obj)  
+
+
+def configure_logging():  
+    """Set up root logging once: level, format and per-logger levels from APPSETTING_LOG_* settings."""  
+    global _configured  
+    if _configured:  
+        return  
+    _configured = True  
+
+    handler = logging.StreamHandler()  
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_LOG_FORMAT))  
+    root = logging.getLogger()  
+    root.handlers = [handler]  
+    root.setLevel(LOG_LEVEL)  
+
+    for override in filter(None, (item.strip() for item in LOG_LEVELS.split(","))):  
+        name, _, level = override.partition("=")  
+        if name and level:  
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())  
+
+
+def log_payload(kind, payload, message=None):  
+    """Keep ``payload`` in the in-memory ring buffer and log it in full only for a sample of calls.  
+
+    Nothing is serialized unless DEBUG is enabled and the call is sampled, so this is  
+    cheap enough for every turn.  
+    """  
+    with _payload_buffer_lock:  
+        _payload_buffer.append({"kind": kind, "time": time.time(), "payload": payload})  
+    if logging.getLogger().isEnabledFor(logging.DEBUG) and random.random() < LOG_PAYLOAD_SAMPLE_RATE:  
+        logging.debug("%s: %s", message or kind, LazyJson(payload, indent=2))  
+
+
+def get_recent_payloads(kind=None, limit=50):  
+    """Return up to ``limit`` of the most recent buffered payloads (newest last), optionally of one kind."""  
+    with _payload_buffer_lock:  
+        entries = [entry for entry in _payload_buffer if kind is None or entry["kind"] == kind]  
+    return entries[-limit:]  
@@ -0,0 +1,148 @@
+# utils/metrics_utils.py  
+import time  
+import logging  
+import threading  
+import contextvars  
+from contextlib import contextmanager  
+
+### GLOBAL VARIABLES ###  
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  
+
+# Labels and phase timings of the turn running in the current task  
+_current_turn = contextvars.ContextVar("current_turn", default=None)  
+# Every metric created below, in the order they're rendered on /metrics  
+_registry = []  
+
+
+def _escape_label_value(value):  
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")  
+
+
+class Histogram:  
+    """A minimal Prometheus-style histogram keyed by label values."""  
+
+    def __init__(self, name, documentation, label_names, buckets=LATENCY_BUCKETS):  
+        self.name = name  
+        self.documentation = documentation  
+        self.label_names = tuple(label_names)  
+        self.buckets = tuple(buckets)  
+        self._series = {}  # label values -> [bucket counts, sum, count]  
+        self._lock = threading.Lock()  
+        _registry.append(self)  
+
+    def observe(self, value, **labels):  
+        key = tuple(str(labels.get(name, "unknown")) for name in self.label_names)  
+        with self._lock:  
+            series = self._series.get(key)  
+            if series is None:  
+                series = [[0] * len(self.buckets), 0.0, 0]  
+                self._series[key] = series  
+            for i, bound in enumerate(self.buckets):  
+                if value <= bound:  
+                    series[0][i] += 1  
+            series[1] += value  
+            series[2] += 1  
+
+    def render(self):  
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]  
+        with self._lock:  
+            snapshot = [(key, list(series[0]), series[1], series[2]) for key, series in sorted(self._series.items())]  
+        for key, bucket_counts, total, count in snapshot:  
+            labels = ",".join(f"{name}=\"{_escape_label_value(value)}\"" for name, value in zip(self.label_names, key))  
+            prefix = f"{labels}," if labels else ""  
+            for bound, bucket_count in zip(self.buckets, bucket_counts):  
+                lines.append(f"{self.name}_bucket{{{prefix}le=\"{bound}\"}} {bucket_count}")  
+            lines.append(f"{self.name}_bucket{{{prefix}le=\"+Inf\"}} {count}")  
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")  
+            lines.append(f"{self.name}_count{{{labels}}} {count}")  
+        return lines  
+
+
+class Counter:  
+    """A minimal Prometheus-style counter keyed by label values."""  
+
+    def __init__(self, name, documentation, label_names):  
+        self.name = name  
+        self.documentation = documentation  
+        self.label_names = tuple(label_names)  
+        self._values = {}  # label values -> count  
+        self._lock = threading.Lock()  
+        _registry.append(self)  
+
+    def inc(self, amount=1, **labels):  
+        key = tuple(str(labels.get(name, "unknown")) for name in self.label_names)  
+        with self._lock:  
+            self._values[key] = self._values.get(key, 0) + amount  
+
+    def values(self):  
+        """Return ``{label values: count}`` for every series seen so far."""  
+        with self._lock:  
+            return dict(self._values)  
+
+    def render(self):  
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]  
+        for key, value in sorted(self.values().items()):  
+            labels = ",".join(f"{name}=\"{_escape_label_value(label)}\"" for name, label in zip(self.label_names, key))  
+            lines.append(f"{self.name}_total{{{labels}}} {value}")  
+        return lines  
+
+
+TURN_LATENCY = Histogram(  
+    "bot_turn_duration_seconds",  
+    "End-to-end time to handle one incoming activity.",  
+    ["channel", "handler"]  
+)  
+PHASE_LATENCY = Histogram(  
+    "bot_turn_phase_duration_seconds",  
+    "Time spent in each phase of a turn.",  
+    ["channel", "handler", "phase"]  
+)  
+
+
+@contextmanager  
+def track_turn(channel="unknown", handler="unknown"):  
+    """Time one turn. Phases recorded with ``span`` inside it are attributed to its labels."""  
+    turn = {"channel": channel, "handler": handler, "phases": []}  
+    token = _current_turn.set(turn)  
+    start = time.perf_counter()  
+    try:  
+        yield turn  
+    finally:  
+        elapsed = time.perf_counter() - start  
+        _current_turn.reset(token)  
+        # Phases are observed here, once the turn's final labels are known  
+        TURN_LATENCY.observe(elapsed, channel=turn["channel"], handler=turn["handler"])  
+        for phase, duration in turn["phases"]:  
+            PHASE_LATENCY.observe(duration, channel=turn["channel"], handler=turn["handler"], phase=phase)  
+        phases = ", ".join(f"{phase}={duration:.3f}s" for phase, duration in turn["phases"])  
+        logging.debug(f"Turn on {turn['channel']}/{turn['handler']} took {elapsed:.3f}s ({phases})")  
+
+
+def set_turn_labels(**labels):  
+    """Fill in labels (channel, handler) once they are known partway through a turn."""  
+    turn = _current_turn.get()  
+    if turn is not None:  
+        turn.update({name: value for name, value in labels.items() if value})  
+
+
+@contextmanager  
+def span(phase):  
+    """Time a phase of the current turn (works around awaits as well as plain code)."""  
+    start = time.perf_counter()  
+    try:  
+        yield  
+    finally:  
+        elapsed = time.perf_counter() - start  
+        turn = _current_turn.get()  
+        if turn is not None:  
+            turn["phases"].append((phase, elapsed))  
+        else:  
+            PHASE_LATENCY.observe(elapsed, phase=phase)  
+
+
+def render_metrics():  
+    """Return every metric in Prometheus text exposition format."""  
+    lines = []  
+    for metric in _registry:  
+        lines.extend(metric.render())  
+    return "\n".join(lines) + "\n"  
@@ -0,0 +1,175 @@
+# utils/model_router_utils.py  
+import os  
+import json  
+import logging  
+import threading  
+import contextvars  
+from collections import deque  
+from utils.metrics_utils import Counter, Histogram  
+
+### GLOBAL VARIABLES ###  
+DEFAULT_DEPLOYMENT = os.environ.get("APPSETTING_CHAT_COMPLETIONS_DEPLOYMENT_NAME")  
+# Ordered routing rules; the first match wins and anything unmatched goes to DEFAULT_DEPLOYMENT, e.g.  
+# [{"name": "cheap-map", "handler": ["summarize_map", "context_summary"], "max_input_tokens": 12000, "deployment": "gpt-35-turbo"},  
+#  {"name": "short-chat", "handler": "chat", "max_input_tokens": 2000, "deployments": ["gpt-4o", "gpt-35-turbo"]}]  
+# Map chunks run to 127k tokens and context folds to 60k, so size rules against the deployments' context windows  
+MODEL_ROUTES = os.environ.get("APPSETTING_MODEL_ROUTES", "[]")  
+# Per special command deployment, e.g. {"person": "gpt-4o"}; beats every rule  
+MODEL_COMMAND_OVERRIDES = os.environ.get("APPSETTING_MODEL_COMMAND_OVERRIDES", "{}")  
+# Targets a rule's candidate deployments are checked against, per handler, e.g. {"chat": {"max_p95_latency": 8, "max_cost": 0.05}}  
+MODEL_ROUTE_TARGETS = os.environ.get("APPSETTING_MODEL_ROUTE_TARGETS", "{}")  
+# Pricing name for each deployment (deployment names are arbitrary in Azure), e.g. {"gpt-35-turbo": "gpt-3.5-turbo"}  
+MODEL_DEPLOYMENT_MODELS = os.environ.get("APPSETTING_MODEL_DEPLOYMENT_MODELS", "{}")  
+# Context window of each deployment in tokens, e.g. {"gpt-35-turbo": 16385, "gpt-4o": 128000}; a deployment  
+# is never picked for a request whose prompt plus max_tokens would overflow it (unlisted means no limit)  
+MODEL_DEPLOYMENT_CONTEXT_WINDOWS = os.environ.get("APPSETTING_MODEL_DEPLOYMENT_CONTEXT_WINDOWS", "{}")  
+# Recent successful call latencies kept per deployment for the p95 estimate  
+MODEL_LATENCY_WINDOW = int(os.environ.get("APPSETTING_MODEL_LATENCY_WINDOW", "200"))  
+MODEL_LATENCY_MIN_SAMPLES = 20  
+
+MODEL_ROUTE_REQUESTS = Counter(  
+    "bot_model_route_requests",  
+    "Completion requests sent to Azure OpenAI (cache hits excluded) by handler, deployment and the rule that picked it.",  
+    ["handler", "deployment", "route"]  
+)  
+MODEL_CALL_LATENCY = Histogram(  
+    "bot_model_call_duration_seconds",  
+    "Time until Azure OpenAI answered (first chunk for streams), by deployment.",  
+    ["handler", "deployment", "outcome"]  
+)  
+
+# Special command being handled in the current task, for MODEL_COMMAND_OVERRIDES  
+_current_command = contextvars.ContextVar("current_command", default=None)  
+# (handler, deployment, route) of the last pick in the current task, counted once the request is actually sent  
+_last_route = contextvars.ContextVar("last_route", default=None)  
+_latencies = {}  # deployment -> deque of recent latencies  
+_latencies_lock = threading.Lock()  
+
+
+def _load_json_setting(name, raw, default):  
+    try:  
+        value = json.loads(raw)  
+        if isinstance(value, type(default)):  
+            return value  
+        logging.error(f"{name} must be a JSON {type(default).__name__}, ignoring it")  
+    except ValueError as e:  
+        logging.error(f"Could not parse {name}: {e}")  
+    return default  
+
+
+_routes = _load_json_setting("APPSETTING_MODEL_ROUTES", MODEL_ROUTES, [])  
+_command_overrides = _load_json_setting("APPSETTING_MODEL_COMMAND_OVERRIDES", MODEL_COMMAND_OVERRIDES, {})  
+_route_targets = _load_json_setting("APPSETTING_MODEL_ROUTE_TARGETS", MODEL_ROUTE_TARGETS, {})  
+_deployment_models = _load_json_setting("APPSETTING_MODEL_DEPLOYMENT_MODELS", MODEL_DEPLOYMENT_MODELS, {})  
+_context_windows = _load_json_setting("APPSETTING_MODEL_DEPLOYMENT_CONTEXT_WINDOWS", MODEL_DEPLOYMENT_CONTEXT_WINDOWS, {})  
+
+
+def set_command_route(command):  
+    """Mark the current task as handling special command ``command``; pass the result to reset_command_route."""  
+    return _current_command.set(command)  
+
+
+def reset_command_route(token):  
+    _current_command.reset(token)  
+
+
+def _rule_matches(rule, handler, input_tokens):  
+    handlers = rule.get("handler")  
+    if handlers is not None and handler not in ([handlers] if isinstance(handlers, str) else handlers):  
+        return False  
+    if input_tokens < rule.get("min_input_tokens", 0):  
+        return False  
+    max_input_tokens = rule.get("max_input_tokens")  
+    return max_input_tokens is None or input_tokens <= max_input_tokens  
+
+
+def fits_context_window(deployment, input_tokens, max_tokens):  
+    """False if ``deployment``'s configured context window can't hold the prompt plus the requested completion."""  
+    window = _context_windows.get(deployment)  
+    return window is None or input_tokens + max_tokens <= window  
+
+
+def get_p95_latency(deployment):  
+    """Return the p95 of recent call latencies for ``deployment``, or None until there are enough samples."""  
+    with _latencies_lock:  
+        samples = sorted(_latencies.get(deployment, ()))  
+    if len(samples) < MODEL_LATENCY_MIN_SAMPLES:  
+        return None  
+    return samples[min(len(samples) - 1, int(len(samples) * 0.95))]  
+
+
+def estimate_request_cost(deployment, input_tokens, max_tokens):  
+    """Upper-bound cost of one request in dollars, priced as the deployment's model."""  
+    from utils.openai_utils import calculate_cost  # openai_utils imports this module  
+    return calculate_cost(_deployment_models.get(deployment, deployment or ""), input_tokens, max_tokens)  
+
+
+def _pick_candidate(handler, candidates, input_tokens, max_tokens):  
+    """First available candidate that meets the handler's latency and cost targets, else the fastest one."""  
+    from utils.openai_resilience_utils import is_deployment_available  # it imports this module  
+    if len(candidates) > 1:  
+        # Skip deployments whose circuit is open, unless that's all of them  
+        candidates = [deployment for deployment in candidates if is_deployment_available(deployment)] or candidates  
+    targets = _route_targets.get(handler)  
+    if not targets or len(candidates) == 1:  
+        return candidates[0]  
+    max_latency = targets.get("max_p95_latency")  
+    max_cost = targets.get("max_cost")  
+    for deployment in candidates:  
+        p95 = get_p95_latency(deployment)  
+        if max_latency is not None and p95 is not None and p95 > max_latency:  
+            continue  
+        if max_cost is not None and estimate_request_cost(deployment, input_tokens, max_tokens) > max_cost:  
+            continue  
+        return deployment  
+    return min(candidates, key=lambda deployment: get_p95_latency(deployment) or 0.0)  
+
+
+def choose_deployment(handler, input_tokens=0, max_tokens=0):  
+    """Pick the deployment for one completion request and count the choice.  
+
+    ``handler`` is one of chat, image, summarize_map, summarize_reduce, context_summary,  
+    person_search or web_search. A special command override wins, then the first matching  
+    rule in APPSETTING_MODEL_ROUTES, then the default deployment. Overrides and rule  
+    candidates whose context window is too small for the request are passed over. The  
+    pick is only counted by count_routed_request, once the request isn't served from cache.  
+    """  
+    command = _current_command.get()  
+    deployment, route = DEFAULT_DEPLOYMENT, "default"  
+    override = _command_overrides.get(command) if command else None  
+    if override and fits_context_window(override, input_tokens, max_tokens):  
+        deployment, route = override, f"command:{command}"  
+    else:  
+        if override:  
+            logging.warning(f"Ignoring the {command} override: {input_tokens + max_tokens} tokens don't fit {override}")  
+        for index, rule in enumerate(_routes):  
+            if not _rule_matches(rule, handler, input_tokens):  
+                continue  
+            candidates = [candidate for candidate in rule.get("deployments") or [rule.get("deployment")]  
+                          if candidate and fits_context_window(candidate, input_tokens, max_tokens)]  
+            if candidates:  
+                deployment = _pick_candidate(handler, candidates, input_tokens, max_tokens)  
+                route = rule.get("name", f"rule{index}")  
+                break  
+
+    _last_route.set((handler, deployment, route))  
+    logging.debug(f"Routed {handler} request ({input_tokens} input tokens) to {deployment} via {route}")  
+    return deployment  
+
+
+def count_routed_request(handler, deployment):  
+    """Count a request that is actually being sent to ``deployment``, under the rule that picked it."""  
+    last_route = _last_route.get()  
+    route = last_route[2] if last_route and last_route[:2] == (handler, deployment) else "unrouted"  
+    MODEL_ROUTE_REQUESTS.inc(handler=handler, deployment=deployment, route=route)  
+
+
+def record_model_call(handler, deployment, elapsed, success=True):  
+    """Record how long ``deployment`` took to answer; successful calls feed the p95 used for routing."""  
+    MODEL_CALL_LATENCY.observe(elapsed, handler=handler, deployment=deployment, outcome="ok" if success else "error")  
+    if success:  
+        with _latencies_lock:  
+            samples = _latencies.get(deployment)  
+            if samples is None:  
+                samples = _latencies[deployment] = deque(maxlen=MODEL_LATENCY_WINDOW)  
+            samples.append(elapsed)  
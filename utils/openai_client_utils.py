@@ -0,0 +1,103 @@
+# utils/openai_client_utils.py  
+import os  
+import asyncio  
+import logging  
+import threading  
+import weakref  
+try:  
+    import httpx  
+except ImportError:  # newer openai releases depend on the httpx2 fork instead of httpx  
+    import httpx2 as httpx  
+import openai  
+from dotenv import load_dotenv  
+
+# Load environment variables from .env file  
+load_dotenv()  
+
+### GLOBAL VARIABLES ###  
+# API Configuration (shared with openai_utils.py)  
+OPENAI_API_KEY = os.environ.get("APPSETTING_2024may22_GPT4o_API_KEY")  
+AZURE_OPENAI_ENDPOINT = os.environ.get("APPSETTING_AZURE_OPENAI_ENDPOINT")  
+AZURE_OPENAI_API_VERSION = os.environ.get("APPSETTING_AZURE_OPENAI_API_VERSION")  
+
+# Connection pool tuning, one pool per process  
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("APPSETTING_OPENAI_MAX_CONNECTIONS", "50"))  
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("APPSETTING_OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))  
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("APPSETTING_OPENAI_KEEPALIVE_EXPIRY", "120"))  
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("APPSETTING_OPENAI_CONNECT_TIMEOUT", "10"))  
+OPENAI_REQUEST_TIMEOUT = float(os.environ.get("APPSETTING_OPENAI_REQUEST_TIMEOUT", "300"))  
+# The SDK's own retries; off by default because openai_resilience_utils.py retries with backoff,  
+# Retry-After and a circuit breaker (and SDK retries would multiply with those)  
+OPENAI_MAX_RETRIES = int(os.environ.get("APPSETTING_OPENAI_MAX_RETRIES", "0"))  
+
+_sync_client = None  
+_sync_client_lock = threading.Lock()  
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncAzureOpenAI  
+
+
+def _build_limits():  
+    return httpx.Limits(  
+        max_connections=OPENAI_MAX_CONNECTIONS,  
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,  
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY  
+    )  
+
+
+def _build_timeout():  
+    return httpx.Timeout(OPENAI_REQUEST_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)  
+
+
+def get_openai_client():  
+    """Returns the process-wide synchronous Azure OpenAI client, creating it on first use."""  
+    global _sync_client  
+    if _sync_client is None:  
+        with _sync_client_lock:  
+            if _sync_client is None:  
+                logging.debug("Creating shared AzureOpenAI client")  
+                _sync_client = openai.AzureOpenAI(  
+                    azure_endpoint=AZURE_OPENAI_ENDPOINT,  
+                    api_key=OPENAI_API_KEY,  
+                    api_version=AZURE_OPENAI_API_VERSION,  
+                    max_retries=OPENAI_MAX_RETRIES,  
+                    http_client=httpx.Client(limits=_build_limits(), timeout=_build_timeout())  
+                )  
+    return _sync_client  
+
+
+def get_async_openai_client():  
+    """Returns the process-wide AsyncAzureOpenAI client for the running event loop.  
+
+    The underlying httpx pool is bound to the loop it was created on, so each  
+    loop (the aiohttp loop, or a worker thread driving its own ``asyncio.run``)  
+    gets one client that is reused for every call made on that loop.  
+    """  
+    loop = asyncio.get_running_loop()  
+    client = _async_clients.get(loop)  
+    if client is None:  
+        logging.debug("Creating shared AsyncAzureOpenAI client")  
+        client = openai.AsyncAzureOpenAI(  
+            azure_endpoint=AZURE_OPENAI_ENDPOINT,  
+            api_key=OPENAI_API_KEY,  
+            api_version=AZURE_OPENAI_API_VERSION,  
+            max_retries=OPENAI_MAX_RETRIES,  
+            http_client=httpx.AsyncClient(limits=_build_limits(), timeout=_build_timeout())  
+        )  
+        _async_clients[loop] = client  
+    return client  
+
+
+async def close_openai_clients():  
+    """Closes the shared clients and their connection pools (called on app shutdown)."""  
+    global _sync_client  
+    client = _async_clients.pop(asyncio.get_running_loop(), None)  
+    if client is not None:  
+        try:  
+            await client.close()  
+        except Exception as e:  
+            logging.error(f"Error closing async OpenAI client: {e}")  
+    if _sync_client is not None:  
+        try:  
+            _sync_client.close()  
+        except Exception as e:  
+            logging.error(f"Error closing OpenAI client: {e}")  
+        _sync_client = None  
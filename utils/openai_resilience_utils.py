@@ -0,0 +1,288 @@
+# utils/openai_resilience_utils.py  
+import os  
+import time  
+import random  
+import asyncio  
+import inspect  
+import logging  
+import threading  
+from email.utils import parsedate_to_datetime  
+from datetime import datetime, timezone  
+import openai  
+from utils.metrics_utils import Counter  
+from utils.model_router_utils import get_p95_latency  
+
+### GLOBAL VARIABLES ###  
+# Retries after the first attempt for throttling (429), server errors (5xx), timeouts and connection errors  
+OPENAI_RETRY_ATTEMPTS = int(os.environ.get("APPSETTING_OPENAI_RETRY_ATTEMPTS", "3"))  
+OPENAI_RETRY_BASE_DELAY = float(os.environ.get("APPSETTING_OPENAI_RETRY_BASE_DELAY", "1.0"))  
+OPENAI_RETRY_MAX_DELAY = float(os.environ.get("APPSETTING_OPENAI_RETRY_MAX_DELAY", "30"))  
+# No retry (or Retry-After wait) is started if it would end more than this long after the first attempt  
+OPENAI_RETRY_DEADLINE = float(os.environ.get("APPSETTING_OPENAI_RETRY_DEADLINE", "90"))  
+# Consecutive failures that open a deployment's circuit, and how long it stays open  
+OPENAI_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("APPSETTING_OPENAI_BREAKER_FAILURE_THRESHOLD", "5"))  
+OPENAI_BREAKER_COOLDOWN = float(os.environ.get("APPSETTING_OPENAI_BREAKER_COOLDOWN", "30"))  
+# Hedging: if an interactive call hasn't answered within the deployment's p95 latency, fire a second one  
+OPENAI_HEDGE_ENABLED = os.environ.get("APPSETTING_OPENAI_HEDGE_ENABLED", "false").lower() == "true"  
+OPENAI_HEDGE_HANDLERS = {name.strip() for name in os.environ.get("APPSETTING_OPENAI_HEDGE_HANDLERS", "chat").split(",") if name.strip()}  
+OPENAI_HEDGE_MIN_DELAY = float(os.environ.get("APPSETTING_OPENAI_HEDGE_MIN_DELAY", "2.0"))  
+# Used until a deployment has enough latency samples for a p95  
+OPENAI_HEDGE_DEFAULT_DELAY = float(os.environ.get("APPSETTING_OPENAI_HEDGE_DEFAULT_DELAY", "10.0"))  
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}  
+
+OPENAI_RETRIES = Counter(  
+    "bot_openai_retries",  
+    "Azure OpenAI calls retried, by deployment and the error that caused the retry.",  
+    ["deployment", "reason"]  
+)  
+OPENAI_HEDGES = Counter(  
+    "bot_openai_hedges",  
+    "Hedged Azure OpenAI calls, by deployment and which request answered first.",  
+    ["deployment", "winner"]  
+)  
+OPENAI_BREAKER_TRANSITIONS = Counter(  
+    "bot_openai_breaker_transitions",  
+    "Circuit breaker state changes, by deployment and new state.",  
+    ["deployment", "state"]  
+)  
+
+_breakers = {}  
+_breakers_lock = threading.Lock()  
+
+
+class CircuitOpenError(Exception):  
+    """Raised instead of calling a deployment whose circuit is open or that is throttled past the deadline."""  
+
+    def __init__(self, deployment, retry_in):  
+        super().__init__(f"Deployment {deployment} is unavailable, retry in {retry_in:.0f}s")  
+        self.deployment = deployment  
+        self.retry_in = retry_in  
+
+
+class CircuitBreaker:  
+    """Per-deployment breaker: closed -> open after repeated failures -> half-open (one probe) -> closed.  
+
+    It also remembers the latest Retry-After from the deployment, so every caller in this  
+    process waits that window out instead of sending more requests into a 429.  
+    """  
+
+    def __init__(self, deployment):  
+        self.deployment = deployment  
+        self.state = "closed"  
+        self.failures = 0  
+        self.opened_until = 0.0  
+        self.throttled_until = 0.0  
+        self.probe_in_flight = False  
+        self._lock = threading.Lock()  
+
+    def _set_state(self, state):  
+        if state != self.state:  
+            self.state = state  
+            OPENAI_BREAKER_TRANSITIONS.inc(deployment=self.deployment, state=state)  
+            logging.warning(f"Circuit for deployment {self.deployment} is now {state}")  
+
+    def is_available(self):  
+        with self._lock:  
+            return self.state != "open" or time.monotonic() >= self.opened_until  
+
+    def before_call(self, deadline):  
+        """Return how long to wait before calling, or raise CircuitOpenError."""  
+        now = time.monotonic()  
+        with self._lock:  
+            if self.state == "open":  
+                if now < self.opened_until:  
+                    raise CircuitOpenError(self.deployment, self.opened_until - now)  
+                self._set_state("half_open")  
+                self.probe_in_flight = False  
+            wait = max(0.0, self.throttled_until - now)  
+            if now + wait > deadline:  
+                raise CircuitOpenError(self.deployment, wait)  
+            if self.state == "half_open":  
+                if self.probe_in_flight:  
+                    raise CircuitOpenError(self.deployment, OPENAI_BREAKER_COOLDOWN)  
+                self.probe_in_flight = True  
+            return wait  
+
+    def record_success(self):  
+        with self._lock:  
+            self.failures = 0  
+            self.probe_in_flight = False  
+            self._set_state("closed")  
+
+    def record_failure(self, retry_after=None):  
+        now = time.monotonic()  
+        with self._lock:  
+            self.failures += 1  
+            self.probe_in_flight = False  
+            if retry_after:  
+                self.throttled_until = max(self.throttled_until, now + retry_after)  
+            if self.state == "half_open" or self.failures >= OPENAI_BREAKER_FAILURE_THRESHOLD:  
+                self.opened_until = now + max(OPENAI_BREAKER_COOLDOWN, retry_after or 0)  
+                self._set_state("open")  
+
+    def record_neutral(self):  
+        """The call failed for a reason that says nothing about the deployment's health (e.g. a 400)."""  
+        with self._lock:  
+            self.probe_in_flight = False  
+
+
+def get_breaker(deployment):  
+    with _breakers_lock:  
+        breaker = _breakers.get(deployment)  
+        if breaker is None:  
+            breaker = _breakers[deployment] = CircuitBreaker(deployment)  
+        return breaker  
+
+
+def is_deployment_available(deployment):  
+    """False while the deployment's circuit is open, so the router can prefer another candidate."""  
+    return get_breaker(deployment).is_available()  
+
+
+def _failure_reason(error):  
+    """Short label for a retryable error, or None if retrying can't help."""  
+    if isinstance(error, openai.APITimeoutError):  
+        return "timeout"  
+    if isinstance(error, openai.APIConnectionError):  
+        return "connection"  
+    status_code = getattr(error, "status_code", None)  
+    if status_code in RETRYABLE_STATUS_CODES or (status_code is not None and status_code >= 500):  
+        return str(status_code)  
+    return None  
+
+
+def get_retry_after(error):  
+    """Seconds the service asked us to wait (retry-after-ms or Retry-After), or None."""  
+    response = getattr(error, "response", None)  
+    headers = getattr(response, "headers", None) or {}  
+    try:  
+        if headers.get("retry-after-ms"):  
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)  
+        value = headers.get("retry-after")  
+        if not value:  
+            return None  
+        try:  
+            return max(0.0, float(value))  
+        except ValueError:  
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())  
+    except (TypeError, ValueError):  
+        return None  
+
+
+def _retry_delay(attempt, retry_after):  
+    backoff = random.uniform(0, min(OPENAI_RETRY_MAX_DELAY, OPENAI_RETRY_BASE_DELAY * (2 ** attempt)))  
+    return max(retry_after, backoff) if retry_after is not None else backoff  
+
+
+def _plan_retry(breaker, attempt, error, deadline):  
+    """Record a failed attempt; return the delay before the next one, or None to give up (and re-raise)."""  
+    reason = _failure_reason(error)  
+    if reason is None:  
+        breaker.record_neutral()  
+        return None  
+    retry_after = get_retry_after(error)  
+    breaker.record_failure(retry_after)  
+    delay = _retry_delay(attempt, retry_after)  
+    # An open circuit means the deployment is down; don't keep this caller waiting on it  
+    if attempt >= OPENAI_RETRY_ATTEMPTS or breaker.state == "open" or time.monotonic() + delay > deadline:  
+        logging.error(f"Giving up on deployment {breaker.deployment} after {attempt + 1} attempt(s): {error}")  
+        return None  
+    OPENAI_RETRIES.inc(deployment=breaker.deployment, reason=reason)  
+    logging.warning(f"Deployment {breaker.deployment} failed ({reason}), retrying in {delay:.1f}s (attempt {attempt + 2} of {OPENAI_RETRY_ATTEMPTS + 1})")  
+    return delay  
+
+
+# Function to run a blocking Azure OpenAI call with backoff and the deployment's circuit breaker  
+def call_with_resilience(deployment, call):  
+    breaker = get_breaker(deployment)  
+    deadline = time.monotonic() + OPENAI_RETRY_DEADLINE  
+    attempt = 0  
+    while True:  
+        wait = breaker.before_call(deadline)  
+        if wait:  
+            time.sleep(wait)  
+        try:  
+            result = call()  
+        except Exception as e:  
+            delay = _plan_retry(breaker, attempt, e, deadline)  
+            if delay is None:  
+                raise  
+            time.sleep(delay)  
+            attempt += 1  
+            continue  
+        breaker.record_success()  
+        return result  
+
+
+def should_hedge(handler):  
+    return OPENAI_HEDGE_ENABLED and handler in OPENAI_HEDGE_HANDLERS  
+
+
+def hedge_delay(deployment):  
+    return max(OPENAI_HEDGE_MIN_DELAY, get_p95_latency(deployment) or OPENAI_HEDGE_DEFAULT_DELAY)  
+
+
+async def _discard(tasks):  
+    """Cancel losing hedge requests, closing any that already produced a response (e.g. an open stream)."""  
+    for task in tasks:  
+        task.cancel()  
+    for result in await asyncio.gather(*tasks, return_exceptions=True):  
+        close = getattr(result, "close", None)  
+        if close is not None and not isinstance(result, BaseException):  
+            try:  
+                closed = close()  
+                if inspect.isawaitable(closed):  
+                    await closed  
+            except Exception as e:  
+                logging.debug(f"Error closing discarded hedge response: {e}")  
+
+
+async def _hedged(deployment, call, breaker):  
+    primary = asyncio.ensure_future(call())  
+    done, _ = await asyncio.wait({primary}, timeout=hedge_delay(deployment))  
+    if done or breaker.state != "closed":  
+        return await primary  
+
+    hedge = asyncio.ensure_future(call())  
+    pending = {primary, hedge}  
+    error = None  
+    try:  
+        while pending:  
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)  
+            for task in done:  
+                if task.exception() is None:  
+                    OPENAI_HEDGES.inc(deployment=deployment, winner="primary" if task is primary else "hedge")  
+                    return task.result()  
+                error = task.exception()  
+        OPENAI_HEDGES.inc(deployment=deployment, winner="none")  
+        raise error  
+    finally:  
+        if pending:  
+            await _discard(pending)  
+
+
+# Awaitable version of call_with_resilience; ``call`` is a zero-argument coroutine function.  
+# With hedge=True a second request is sent if the first is slower than the deployment's p95.  
+async def call_with_resilience_async(deployment, call, hedge=False):  
+    breaker = get_breaker(deployment)  
+    deadline = time.monotonic() + OPENAI_RETRY_DEADLINE  
+    attempt = 0  
+    while True:  
+        wait = breaker.before_call(deadline)  
+        if wait:  
+            await asyncio.sleep(wait)  
+        try:  
+            if hedge:  
+                result = await _hedged(deployment, call, breaker)  
+            else:  
+                result = await call()  
+        except Exception as e:  
+            delay = _plan_retry(breaker, attempt, e, deadline)  
+            if delay is None:  
+                raise  
+            await asyncio.sleep(delay)  
+            attempt += 1  
+            continue  
+        breaker.record_success()  
+        return result  
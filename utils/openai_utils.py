@@ -1,29 +1,34 @@
 import os  
 import base64  
 import openai  
+import asyncio  
+from concurrent.futures import ThreadPoolExecutor  
 import re  
 import time  
 import datetime  
 import PyPDF2  
 from dotenv import load_dotenv  
-import tiktoken  
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider  
 import json  
 from docx import Document  
 import io  
 import logging  
-  
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')  
+from .openai_client_utils import (  
+    get_openai_client,  
+    get_async_openai_client,  
+    OPENAI_API_KEY,  
+    AZURE_OPENAI_ENDPOINT,  
+    AZURE_OPENAI_API_VERSION  
+)  
   
 # Load environment variables from .env file  
 load_dotenv()  
   
 ### GLOBAL VARIABLES ###  
-# API and Model Configuration  
-OPENAI_API_KEY = os.environ.get("APPSETTING_2024may22_GPT4o_API_KEY")  
-AZURE_OPENAI_ENDPOINT = os.environ.get("APPSETTING_AZURE_OPENAI_ENDPOINT")  
-AZURE_OPENAI_API_VERSION = os.environ.get("APPSETTING_AZURE_OPENAI_API_VERSION")  
+# API and Model Configuration (endpoint, key and API version live in openai_client_utils.py)  
 OPENAI_MODEL = os.environ.get("APPSETTING_CHAT_COMPLETIONS_DEPLOYMENT_NAME")  
+# Only API versions 2024-09-01-preview and later accept stream_options, so usage reporting on streams is opt-in  
+OPENAI_STREAM_INCLUDE_USAGE = os.environ.get("APPSETTING_OPENAI_STREAM_INCLUDE_USAGE", "false").lower() == "true"  
 # Messages and Prompts  
 SYSTEM_PROMPT_TEXT = "You are an astute AI assistant."  
 IMAGE_PROMPT_TEXT = "Describe this image in as much detail as possible."  
@@ -31,8 +36,32 @@ INITIAL_SUMMARIZATION_PROMPT = "We will be creating a patent for teradata, I wan
 FINAL_SUMMARIZATION_PROMPT = "Provide a verbose summary of the text given citing key topics if possible, and highlighting the most important points with up to 20 bullet points capturing the key takeaways . Even if some context is missing or have statements saying incomplete, make your most informed analysis based on the available data."  
 BRIEF_SUMMARIZATION_PROMPT = "This text is relatively brief, but attempt to extract as much relevant and valuable information as you can."  
   
-# Initialize Tiktoken encoder  
-encoding = tiktoken.encoding_for_model("gpt-4")  
+# Map phase tuning for process_and_summarize_text  
+SUMMARIZATION_MAX_CONCURRENCY = int(os.environ.get("APPSETTING_SUMMARIZATION_MAX_CONCURRENCY", "4"))  
+SUMMARIZATION_CHUNK_RETRIES = int(os.environ.get("APPSETTING_SUMMARIZATION_CHUNK_RETRIES", "1"))  # on top of call_with_resilience's own retries  
+SUMMARIZATION_RETRY_BACKOFF = float(os.environ.get("APPSETTING_SUMMARIZATION_RETRY_BACKOFF", "2.0"))  
+SUMMARIZATION_CHUNK_TOKENS = 127000  
+SUMMARIZATION_LOG_PREVIEW_CHARS = 500  # how much of each summarized chunk a DEBUG log line shows  
+  
+# Tiktoken encoder and the token-window chunker live in token_utils.py  
+from .token_utils import encoding, chunk_text, num_tokens_from_string, num_tokens_from_messages  
+from .logging_utils import log_payload  
+from .completion_cache_utils import (  
+    completion_cache_key,  
+    get_cached_completion,  
+    get_cached_completion_async,  
+    store_completion  
+)  
+from .model_router_utils import choose_deployment, count_routed_request, record_model_call  
+from .openai_resilience_utils import call_with_resilience, call_with_resilience_async, should_hedge, CircuitOpenError  
+from .rate_limit_utils import (  
+    estimate_request_tokens,  
+    acquire_rate_budget,  
+    acquire_rate_budget_async,  
+    settle_rate_budget,  
+    settle_rate_budget_async,  
+    RateBudgetExceeded  
+)  
 # Pricing details for openai as of 2024july3PRICING = {  
 PRICING = {  
     "gpt-4o": {"input": 5.00, "output": 15.00},  
@@ -65,202 +94,317 @@ def calculate_cost(model_name: str, input_tokens: int, output_tokens: int) -> fl
     logging.debug(f"Calculated cost for model {model_name}: input_cost={input_cost}, output_cost={output_cost}, total_cost={total_cost}")  
     return total_cost  
   
-def num_tokens_from_string(string: str) -> int:  
-    """Returns the number of tokens in a text string."""  
-    num_tokens = len(encoding.encode(string))  
-    return num_tokens  
-  
-def num_tokens_from_messages(messages, model="gpt-4"):  
-    """Return the number of tokens used by a list of messages."""  
-    tokens_per_message = 3  
-    tokens_per_name = 1  
-    num_tokens = 0  
-    for message in messages:  
-        num_tokens += tokens_per_message  
-        for key, value in message.items():  
-            num_tokens += len(encoding.encode(value))  
-            if key == "name":  
-                num_tokens += tokens_per_name  
-    num_tokens += 3  # every reply is primed with  
-    return num_tokens  
+# Function to build the message list sent to the chat completions API  
+def build_chat_messages(user_message, chat_history=None):  
+    messages = [{"role": "system", "content": SYSTEM_PROMPT_TEXT}]  
+    if chat_history:  
+        messages.extend(chat_history)  
+  
+    if not chat_history or chat_history[-1]['content'] != user_message:  
+        messages.append({"role": "user", "content": user_message})  
+    return messages  
+  
+def _chat_completion_kwargs(messages, max_tokens, handler="chat"):  
+    return dict(  
+        model=choose_deployment(handler, num_tokens_from_messages(messages), max_tokens),  
+        messages=messages,  
+        temperature=0.5,  
+        max_tokens=max_tokens,  
+        top_p=0.95,  
+        frequency_penalty=0,  
+        presence_penalty=0,  
+        stop=None  
+    )  
   
-# Function to call OpenAI API for text messages  
-def get_openai_response(user_message, chat_history=None, source=None):  
-    logging.debug("Entered get_openai_response function")  
-    try:  
-        client = openai.AzureOpenAI(  
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,  
-            api_key=OPENAI_API_KEY,  
-            api_version=AZURE_OPENAI_API_VERSION  
-        )  
+def _max_response_tokens(messages):  
+    input_token_count = num_tokens_from_messages(messages)  
+    return min(128000 - input_token_count, 4000)  # Default to 4000 if under the limit  
   
-        messages = [{"role": "system", "content": SYSTEM_PROMPT_TEXT}]  
-        if chat_history:  
-            messages.extend(chat_history)  
+def _parse_chat_completion(completion, source=None):  
+    completion_response = completion.dict()  
   
-        if not chat_history or chat_history[-1]['content'] != user_message:  
-            messages.append({"role": "user", "content": user_message})  
+    # Keep the full JSON response for inspection (logged in full only when sampled)  
+    log_payload("openai_completion", completion_response, "Full JSON response from OpenAI")  
   
-        input_token_count = num_tokens_from_messages(messages)  
-        max_response_tokens = min(128000 - input_token_count, 4000)  # Default to 4000 if under the limit  
+    # Extract the model name  
+    model_name = completion_response.get('model', OPENAI_MODEL)  
   
-        logging.debug("Sending completion request to OpenAI")  
-        completion = client.chat.completions.create(  
-            model=OPENAI_MODEL,  
-            messages=messages,  
-            temperature=0.5,  
-            max_tokens=max_response_tokens,  
-            top_p=0.95,  
-            frequency_penalty=0,  
-            presence_penalty=0,  
-            stop=None  
-        )  
-        completion_response = completion.dict()  
-  
-        # Log the full JSON response  
-        logging.debug("Full JSON response from OpenAI:")  
-        logging.debug(json.dumps(completion_response, indent=2))  
-  
-        # Extract the model name  
-        model_name = completion_response.get('model', OPENAI_MODEL)  
+    if 'choices' in completion_response and len(completion_response['choices']) > 0:  
+        response_message = completion_response['choices'][0]['message']['content']  
+        if source:  
+            completion_response['source'] = source  
+        logging.debug("Exiting get_openai_response function")  
+        return {"choices": [{"message": {"content": response_message}}], "usage": completion_response.get("usage", {})}, model_name  # Return the response message, usage, and model name  
+    else:  
+        return {"error": "No choices in response."}, OPENAI_MODEL  
+  
+def _actual_tokens(completion):  
+    usage = getattr(completion, "usage", None)  # streams report usage only at the end, if at all  
+    return getattr(usage, "total_tokens", None)  
+  
+# Function to send a chat completion request, with retries and the deployment's circuit breaker.  
+# Each attempt first takes its share of the deployment's shared TPM/RPM budget (rate_limit_utils.py)  
+# and records how long it took  
+def create_chat_completion(handler, request_kwargs):  
+    deployment = request_kwargs["model"]  
+    count_routed_request(handler, deployment)  
+    estimated_tokens = estimate_request_tokens(request_kwargs)  
+  
+    def attempt():  
+        reservation = acquire_rate_budget(deployment, estimated_tokens)  
+        start = time.perf_counter()  
+        try:  
+            completion = get_openai_client().chat.completions.create(**request_kwargs)  
+        except Exception:  
+            record_model_call(handler, deployment, time.perf_counter() - start, success=False)  
+            settle_rate_budget(reservation, 0)  # failed calls still count against RPM  
+            raise  
+        record_model_call(handler, deployment, time.perf_counter() - start)  
+        if _actual_tokens(completion) is not None:  
+            settle_rate_budget(reservation, _actual_tokens(completion))  
+        return completion  
+  
+    return call_with_resilience(deployment, attempt)  
+  
+# Awaitable version of create_chat_completion (for streams, the time to the first response).  
+# Interactive handlers may hedge: see APPSETTING_OPENAI_HEDGE_* in openai_resilience_utils.py  
+async def create_chat_completion_async(handler, request_kwargs):  
+    deployment = request_kwargs["model"]  
+    count_routed_request(handler, deployment)  
+    estimated_tokens = estimate_request_tokens(request_kwargs)  
+  
+    async def attempt():  
+        reservation = await acquire_rate_budget_async(deployment, estimated_tokens)  
+        start = time.perf_counter()  
+        try:  
+            completion = await get_async_openai_client().chat.completions.create(**request_kwargs)  
+        except Exception:  
+            record_model_call(handler, deployment, time.perf_counter() - start, success=False)  
+            await settle_rate_budget_async(reservation, 0)  
+            raise  
+        record_model_call(handler, deployment, time.perf_counter() - start)  
+        if _actual_tokens(completion) is not None:  
+            await settle_rate_budget_async(reservation, _actual_tokens(completion))  
+        return completion  
+  
+    return await call_with_resilience_async(deployment, attempt, hedge=should_hedge(handler))  
+  
+def _chat_error_response(e):  
+    if isinstance(e, (CircuitOpenError, RateBudgetExceeded)):  
+        logging.error(f"Skipped OpenAI call: {e}")  
+        return {"error": "The AI service is overloaded right now. Please try again in a minute."}, OPENAI_MODEL  
+    if 'content_filter' in str(e):  
+        return {"error": "Your message triggered the content filter. Please modify your message and try again."}, OPENAI_MODEL  
+    logging.error(f"Error calling OpenAI API: {e}")  
+    return {"error": f"Sorry, I couldn't process your request. Error: {e}"}, OPENAI_MODEL  
   
-        if 'choices' in completion_response and len(completion_response['choices']) > 0:  
-            response_message = completion_response['choices'][0]['message']['content']  
-            if source:  
-                completion_response['source'] = source  
-            logging.debug("Exiting get_openai_response function")  
-            return {"choices": [{"message": {"content": response_message}}], "usage": completion_response.get("usage", {})}, model_name  # Return the response message, usage, and model name  
-        else:  
-            return {"error": "No choices in response."}, OPENAI_MODEL  
+# Function to call OpenAI API for text messages  
+def get_openai_response(user_message, chat_history=None, source=None):  
+    logging.debug("Entered get_openai_response function")  
+    try:  
+        messages = build_chat_messages(user_message, chat_history)  
+        request_kwargs = _chat_completion_kwargs(messages, _max_response_tokens(messages))  
+        cache_key = completion_cache_key(request_kwargs)  
+        if cache_key:  
+            cached = get_cached_completion(cache_key)  
+            if cached:  
+                return cached  
+        logging.debug("Sending completion request to OpenAI")  
+        completion = create_chat_completion("chat", request_kwargs)  
+        response, model_name = _parse_chat_completion(completion, source)  
+        store_completion(cache_key, response, model_name)  
+        return response, model_name  
+    except Exception as e:  
+        return _chat_error_response(e)  
   
+# Awaitable version of get_openai_response for the aiohttp handlers  
+async def get_openai_response_async(user_message, chat_history=None, source=None):  
+    logging.debug("Entered get_openai_response_async function")  
+    try:  
+        messages = build_chat_messages(user_message, chat_history)  
+        request_kwargs = _chat_completion_kwargs(messages, _max_response_tokens(messages))  
+        cache_key = completion_cache_key(request_kwargs)  
+        if cache_key:  
+            cached = await get_cached_completion_async(cache_key)  
+            if cached:  
+                return cached  
+        logging.debug("Sending async completion request to OpenAI")  
+        completion = await create_chat_completion_async("chat", request_kwargs)  
+        response, model_name = _parse_chat_completion(completion, source)  
+        store_completion(cache_key, response, model_name)  
+        return response, model_name  
+    except Exception as e:  
+        return _chat_error_response(e)  
+  
+# Streaming version of get_openai_response_async. Yields {"delta": text} events as tokens  
+# arrive, then a final {"done": True, "model": ..., "usage": {...}} event. Errors are  
+# reported as a final {"done": True, "error": ...} event so callers always get a terminator.  
+async def stream_openai_response_async(user_message, chat_history=None, source=None):  
+    logging.debug("Entered stream_openai_response_async function")  
+    model_name = OPENAI_MODEL  
+    usage = {}  
+    response_parts = []  
+    try:  
+        messages = build_chat_messages(user_message, chat_history)  
+        request_kwargs = _chat_completion_kwargs(messages, _max_response_tokens(messages))  
+        cache_key = completion_cache_key(request_kwargs)  
+        if cache_key:  
+            cached = await get_cached_completion_async(cache_key)  
+            if cached:  
+                cached_response, model_name = cached  
+                yield {"delta": cached_response["choices"][0]["message"]["content"]}  
+                yield {"done": True, "model": model_name, "usage": cached_response.get("usage", {}), "source": source, "cached": True}  
+                return  
+        request_kwargs["stream"] = True  
+        if OPENAI_STREAM_INCLUDE_USAGE:  
+            request_kwargs["stream_options"] = {"include_usage": True}  
+  
+        logging.debug("Sending streaming completion request to OpenAI")  
+        stream = await create_chat_completion_async("chat", request_kwargs)  
+        async for chunk in stream:  
+            if chunk.model:  
+                model_name = chunk.model  
+            if getattr(chunk, "usage", None):  
+                usage = chunk.usage.dict()  
+            if chunk.choices:  
+                delta = chunk.choices[0].delta.content  
+                if delta:  
+                    response_parts.append(delta)  
+                    yield {"delta": delta}  
+  
+        if not usage:  
+            # Fall back to a local estimate when the API version doesn't report usage on streams  
+            prompt_tokens = num_tokens_from_messages(messages)  
+            completion_tokens = num_tokens_from_string("".join(response_parts))  
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}  
+        if response_parts:  
+            store_completion(cache_key, {"choices": [{"message": {"content": "".join(response_parts)}}], "usage": usage}, model_name)  
+        logging.debug("Exiting stream_openai_response_async function")  
+        yield {"done": True, "model": model_name, "usage": usage, "source": source}  
     except Exception as e:  
-        if 'content_filter' in str(e):  
-            return {"error": "Your message triggered the content filter. Please modify your message and try again."}, OPENAI_MODEL  
-        logging.error(f"Error calling OpenAI API: {e}")  
-        return {"error": f"Sorry, I couldn't process your request. Error: {e}"}, OPENAI_MODEL  
+        error_response, model_name = _chat_error_response(e)  
+        yield {"done": True, "model": model_name, "usage": usage, "error": error_response["error"]}  
+  
+def _parse_moderation(response):  
+    if response is None:  
+        logging.error("Received None response from moderation API")  
+        return None  
+    moderation_result = response['results'][0]  
+    logging.debug(f"Moderation result: {moderation_result}")  
+    return moderation_result  
   
 def moderate_content(content):  
     logging.debug("Entered moderate_content function")  
     try:  
-        client = openai.AzureOpenAI(  
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,  
-            api_key=OPENAI_API_KEY,  
-            api_version=AZURE_OPENAI_API_VERSION  
-        )  
-        response = client.moderations.create(input=content)  
-        if response is None:  
-            logging.error("Received None response from moderation API")  
-            return None  
-        moderation_result = response['results'][0]  
-        logging.debug(f"Moderation result: {moderation_result}")  
-        return moderation_result  
+        response = get_openai_client().moderations.create(input=content)  
+        return _parse_moderation(response)  
     except Exception as e:  
         logging.error(f"Error during content moderation: {e}")  
         return None  
   
-# Function to call OpenAI API for image messages  
-def get_openai_image_response(image_data_url):  
+async def moderate_content_async(content):  
+    logging.debug("Entered moderate_content_async function")  
     try:  
-        client = openai.AzureOpenAI(  
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,  
-            api_key=OPENAI_API_KEY,  
-            api_version=AZURE_OPENAI_API_VERSION  
-        )  
-        message_text = [  
-            {  
-                "role": "user",  
-                "content": [  
-                    {  
-                        "type": "text",  
-                        "text": IMAGE_PROMPT_TEXT  
-                    },  
-                    {  
-                        "type": "image_url",  
-                        "image_url": {  
-                            "url": image_data_url  
-                        }  
+        response = await get_async_openai_client().moderations.create(input=content)  
+        return _parse_moderation(response)  
+    except Exception as e:  
+        logging.error(f"Error during content moderation: {e}")  
+        return None  
+  
+def _image_completion_kwargs(image_data_url):  
+    message_text = [  
+        {  
+            "role": "user",  
+            "content": [  
+                {  
+                    "type": "text",  
+                    "text": IMAGE_PROMPT_TEXT  
+                },  
+                {  
+                    "type": "image_url",  
+                    "image_url": {  
+                        "url": image_data_url  
                     }  
-                ]  
-            }  
-        ]  
+                }  
+            ]  
+        }  
+    ]  
+    return dict(  
+        model=choose_deployment("image", max_tokens=800),  
+        messages=message_text,  
+        temperature=0.5,  
+        max_tokens=800,  
+        top_p=0.95,  
+        frequency_penalty=0,  
+        presence_penalty=0,  
+        stop=None  
+    )  
   
+# Function to call OpenAI API for image messages  
+def get_openai_image_response(image_data_url):  
+    try:  
         # Log the message payload  
         print("Sending a payload to OpenAI... (debug by #uncommenting openai_utils.py...)")  
   
-        completion = client.chat.completions.create(  
-            model=OPENAI_MODEL,  
-            messages=message_text,  
-            temperature=0.5,  
-            max_tokens=800,  
-            top_p=0.95,  
-            frequency_penalty=0,  
-            presence_penalty=0,  
-            stop=None  
-        )  
+        completion = create_chat_completion("image", _image_completion_kwargs(image_data_url))  
         completion_response = completion.dict()  
         return completion_response['choices'][0]['message']['content']  
     except Exception as e:  
         print(f"Error calling OpenAI API: {e}")  
         return "Sorry, I couldn't process your request."  
   
-# Function to call OpenAI API for text summarization  
-def summarize_text_with_openai(chunk, instruction):  
+async def get_openai_image_response_async(image_data_url):  
     try:  
-        client = openai.AzureOpenAI(  
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,  
-            api_key=OPENAI_API_KEY,  
-            api_version=AZURE_OPENAI_API_VERSION  
-        )  
-        message_text = [  
-            {"role": "system", "content": instruction},  
-            {"role": "user", "content": chunk}  
-        ]  
-        print("Sending the following input to OpenAI:")  
-        print(message_text)  # Print the message being sent to OpenAI  
-  
-        input_token_count = num_tokens_from_messages(message_text)  
-        max_response_tokens = min(128000 - input_token_count, 4000)  # Default to 4000 if under the limit  
-  
-        completion = client.chat.completions.create(  
-            model=OPENAI_MODEL,  
-            messages=message_text,  
-            temperature=0.5,  
-            max_tokens=max_response_tokens,  
-            top_p=0.95,  
-            frequency_penalty=0,  
-            presence_penalty=0,  
-            stop=None  
-        )  
+        completion = await create_chat_completion_async("image", _image_completion_kwargs(image_data_url))  
         completion_response = completion.dict()  
-        print("Received the following response from OpenAI:")  
-        print(completion_response)  # Print the response received from OpenAI  
+        return completion_response['choices'][0]['message']['content']  
+    except Exception as e:  
+        print(f"Error calling OpenAI API: {e}")  
+        return "Sorry, I couldn't process your request."  
+  
+def _summarization_messages(chunk, instruction):  
+    # Chunks run to ~127k tokens, so only a short preview ever reaches the log  
+    logging.debug(f"Summarizing {len(chunk)} characters with instruction '{instruction[:80]}': {chunk[:SUMMARIZATION_LOG_PREVIEW_CHARS]!r}")  
+    return [  
+        {"role": "system", "content": instruction},  
+        {"role": "user", "content": chunk}  
+    ]  
+  
+def _parse_summarization(completion):  
+    completion_response = completion.dict()  
+    log_payload("openai_summarization", completion_response, "Summarization response from OpenAI")  
   
-        if 'choices' in completion_response and len(completion_response['choices']) > 0:  
-            return completion_response['choices'][0]['message']['content'], completion_response.get('usage', {})  
-        else:  
-            return None, None  
+    if 'choices' in completion_response and len(completion_response['choices']) > 0:  
+        return completion_response['choices'][0]['message']['content'], completion_response.get('usage', {})  
+    else:  
+        return None, None  
+  
+# Function to call OpenAI API for text summarization  
+def _summarize_text(chunk, instruction, handler):  
+    message_text = _summarization_messages(chunk, instruction)  
+  
+    completion = create_chat_completion(  
+        handler, _chat_completion_kwargs(message_text, _max_response_tokens(message_text), handler)  
+    )  
+    return _parse_summarization(completion)  
+  
+def summarize_text_with_openai(chunk, instruction, handler="summarize_map"):  
+    try:  
+        return _summarize_text(chunk, instruction, handler)  
     except Exception as e:  
         print(f"Error processing chunk with the instruction '{instruction}': {e}")  
         return None, None  
   
-# Function to chunk text  
-def chunk_text(text, max_chunk_size):  
-    words = text.split()  
-    chunks = []  
-    current_chunk = []  
-    current_length = 0  
-  
-    for word in words:  
-        word_length = len(encoding.encode(word))  
-        if current_length + word_length + 1 <= max_chunk_size:  
-            current_chunk.append(word)  
-            current_length += word_length + 1  
-        else:  
-            chunks.append(' '.join(current_chunk))  
-            current_chunk = [word]  
-            current_length = word_length + 1  
-    chunks.append(' '.join(current_chunk))  
-    return chunks  
+async def summarize_text_with_openai_async(chunk, instruction, handler="summarize_map"):  
+    try:  
+        message_text = _summarization_messages(chunk, instruction)  
+        completion = await create_chat_completion_async(  
+            handler, _chat_completion_kwargs(message_text, _max_response_tokens(message_text), handler)  
+        )  
+        return _parse_summarization(completion)  
+    except Exception as e:  
+        print(f"Error processing chunk with the instruction '{instruction}': {e}")  
+        return None, None  
   
 # Function to estimate tokens from characters  
 def estimate_tokens_from_chars(char_count):  
@@ -273,37 +417,129 @@ def estimate_cost(input_tokens, output_tokens, input_cost_per_million=0.50, outp
     total_cost = input_cost + output_cost  
     return input_cost, output_cost, total_cost  
   
+# Function to summarize a single chunk, retrying failed attempts with exponential backoff.  
+# Transient API errors are already retried inside call_with_resilience, and an open breaker or  
+# an exhausted rate budget will not clear within the backoff, so those end the chunk at once.  
+def summarize_chunk_with_retries(index, chunk, instruction=INITIAL_SUMMARIZATION_PROMPT, retries=None):  
+    retries = SUMMARIZATION_CHUNK_RETRIES if retries is None else retries  
+    start_time = time.time()  
+    response, usage, attempts = None, None, 0  
+    for attempt in range(retries + 1):  
+        attempts += 1  
+        try:  
+            response, usage = _summarize_text(chunk, instruction, "summarize_map")  
+        except (CircuitOpenError, RateBudgetExceeded) as e:  
+            print(f"Chunk {index + 1} skipped on attempt {attempts}: {e}")  
+            break  
+        except Exception as e:  
+            print(f"Error processing chunk with the instruction '{instruction}': {e}")  
+            response, usage = None, None  
+        if response:  
+            break  
+        if attempt < retries:  
+            delay = SUMMARIZATION_RETRY_BACKOFF * (2 ** attempt)  
+            print(f"Chunk {index + 1} failed on attempt {attempts}, retrying in {delay:.1f}s")  
+            time.sleep(delay)  
+    return {  
+        "index": index,  
+        "response": response,  
+        "usage": usage or {},  
+        "attempts": attempts,  
+        "elapsed": time.time() - start_time  
+    }  
+
+# Function to run the map phase concurrently; results come back in chunk order  
+def map_summarize_chunks(chunks, max_concurrency=None):  
+    max_concurrency = max(1, SUMMARIZATION_MAX_CONCURRENCY if max_concurrency is None else max_concurrency)  
+    if len(chunks) <= 1 or max_concurrency == 1:  
+        return [summarize_chunk_with_retries(i, chunk) for i, chunk in enumerate(chunks)]  
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(chunks)), thread_name_prefix="summarize-map") as executor:  
+        return list(executor.map(summarize_chunk_with_retries, range(len(chunks)), chunks))  
+
 # Function to summarize text  
 def process_and_summarize_text(input_text, source, attempt_sizes):  
     start_time = time.time()  
     char_count = len(input_text)  
-    token_estimate = estimate_tokens_from_chars(char_count)  
     print(f"Size of input text: {char_count} characters")  
-    print(f"Initial token estimate: {token_estimate} tokens")  
-  
-    chunks = chunk_text(input_text, 127000)  # Updated chunk size for 127,000 tokens  
-    chunk_responses = []  
+    print(f"Initial token estimate: {estimate_tokens_from_chars(char_count)} tokens")  
+
+    chunks = chunk_text(input_text, SUMMARIZATION_CHUNK_TOKENS)  
+    print(f"Processing {len(chunks)} chunk(s) with up to {SUMMARIZATION_MAX_CONCURRENCY} concurrent requests")  
+    chunk_results = map_summarize_chunks(chunks)  
+    return reduce_and_report(chunk_results, source, char_count, start_time)  
+
+# Function to summarize a document that arrives as page batches  
+def process_and_summarize_pages(page_batches, source, attempt_sizes):  
+    """Map-reduce summarization over ``(start_page, [page_text, ...])`` batches.  
+
+    Full chunks are handed to the map phase as soon as enough pages have arrived,  
+    so the first summarization calls overlap with extraction of later pages. Pages  
+    are joined with form feeds so chunk_text can cut at page boundaries.  
+    """  
+    start_time = time.time()  
+    char_count = 0  
+    buffered_pages = []  
+    buffered_tokens = 0  
+    futures = []  
+
+    with ThreadPoolExecutor(max_workers=max(1, SUMMARIZATION_MAX_CONCURRENCY), thread_name_prefix="summarize-map") as executor:  
+        for start_page, texts in page_batches:  
+            batch_text = "\f".join(texts)  
+            char_count += len(batch_text)  
+            buffered_pages.append(batch_text)  
+            buffered_tokens += num_tokens_from_string(batch_text)  
+            if buffered_tokens <= SUMMARIZATION_CHUNK_TOKENS:  
+                continue  
+            # Dispatch every full chunk and keep the tail buffered until more pages arrive  
+            chunks = chunk_text("\f".join(buffered_pages), SUMMARIZATION_CHUNK_TOKENS)  
+            for chunk in chunks[:-1]:  
+                print(f"Dispatching chunk {len(futures) + 1} after page {start_page + len(texts)}")  
+                futures.append(executor.submit(summarize_chunk_with_retries, len(futures), chunk))  
+            buffered_pages = [chunks[-1]]  
+            buffered_tokens = num_tokens_from_string(chunks[-1])  
+
+        remainder = "\f".join(buffered_pages)  
+        if remainder.strip() or not futures:  
+            for chunk in chunk_text(remainder, SUMMARIZATION_CHUNK_TOKENS):  
+                futures.append(executor.submit(summarize_chunk_with_retries, len(futures), chunk))  
+        chunk_results = [future.result() for future in futures]  
+
+    print(f"Size of input text: {char_count} characters, summarized in {len(chunk_results)} chunk(s)")  
+    return reduce_and_report(chunk_results, source, char_count, start_time)  
+
+# Function to run the reduce phase and build the processing summary  
+def reduce_and_report(chunk_results, source, char_count, start_time):  
+    token_estimate = estimate_tokens_from_chars(char_count)  
+    chunk_count = len(chunk_results)  
     total_completion_tokens = 0  
     total_prompt_tokens = 0  
     total_tokens = 0  
-  
-    for i, chunk in enumerate(chunks):  
-        print(f"Processing chunk {i + 1}/{len(chunks)}")  
-        response, usage = summarize_text_with_openai(chunk, INITIAL_SUMMARIZATION_PROMPT)  
-        if response:  
-            chunk_responses.append(response)  
-            if usage:  
-                completion_tokens = usage.get('completion_tokens', 0)  
-                prompt_tokens = usage.get('prompt_tokens', 0)  
-                total_completion_tokens += completion_tokens  
-                total_prompt_tokens += prompt_tokens  
-                total_tokens += completion_tokens + prompt_tokens  
-                print(f"Chunk {i + 1}/{len(chunks)} processed: {completion_tokens} completion tokens, {prompt_tokens} prompt tokens")  
-  
+    chunk_report_lines = []  
+    failed_chunks = []  
+    for result in chunk_results:  
+        i = result["index"]  
+        usage = result["usage"]  
+        completion_tokens = usage.get('completion_tokens', 0)  
+        prompt_tokens = usage.get('prompt_tokens', 0)  
+        total_completion_tokens += completion_tokens  
+        total_prompt_tokens += prompt_tokens  
+        total_tokens += completion_tokens + prompt_tokens  
+        status = "ok" if result["response"] else "failed"  
+        if not result["response"]:  
+            failed_chunks.append(i + 1)  
+        print(f"Chunk {i + 1}/{chunk_count} {status}: {completion_tokens} completion tokens, {prompt_tokens} prompt tokens, {result['elapsed']:.2f}s, {result['attempts']} attempt(s)")  
+        chunk_report_lines.append(  
+            f"**Chunk {i + 1}/{chunk_count}:** {status}, {result['elapsed']:.2f}s, {prompt_tokens} prompt / {completion_tokens} completion tokens, {result['attempts']} attempt(s)\n | "  
+        )  
+
+    # Keep chunk order in the reduce input even though the map phase ran concurrently  
+    chunk_responses = [result["response"] for result in chunk_results]  
     second_input = ' '.join(filter(None, chunk_responses))  
     final_summary_logic = FINAL_SUMMARIZATION_PROMPT if len(second_input) > 100 else BRIEF_SUMMARIZATION_PROMPT  
-    final_summary_response, final_usage = summarize_text_with_openai(second_input, final_summary_logic)  
-  
+    reduce_start_time = time.time()  
+    final_summary_response, final_usage = summarize_text_with_openai(second_input, final_summary_logic, handler="summarize_reduce")  
+    reduce_elapsed = time.time() - reduce_start_time  
+
     if final_summary_response:  
         final_summary = final_summary_response  
         if final_usage:  
@@ -312,11 +548,11 @@ def process_and_summarize_text(input_text, source, attempt_sizes):
             total_tokens += final_usage.get('total_tokens', 0)  
     else:  
         final_summary = None  
-  
+
     elapsed_time = time.time() - start_time  
     elapsed_time_str = str(datetime.timedelta(seconds=elapsed_time))  
     input_cost, output_cost, total_cost = estimate_cost(total_prompt_tokens, total_completion_tokens)  
-  
+
     processing_summary = (  
         f"**====PROCESSING SUMMARY====**\n"  
         f"**Source:** {source}\n | "  
@@ -327,8 +563,12 @@ def process_and_summarize_text(input_text, source, attempt_sizes):
         f"**Total tokens (OpenAI):** {total_tokens}\n | "  
         f"**Actual cost based on total tokens:** ${total_cost:.4f}\n | "  
         f"**Total execution time:** {elapsed_time_str}\n | "  
+        + "".join(chunk_report_lines) +  
+        f"**Final summary time:** {reduce_elapsed:.2f}s\n | "  
     )  
-  
+    if failed_chunks:  
+        processing_summary += f"**Chunks that could not be summarized:** {', '.join(str(i) for i in failed_chunks)}\n | "  
+
     return final_summary + "\n\n" + processing_summary if final_summary else processing_summary  
   
 # Function to read file contents  
@@ -344,14 +584,19 @@ def read_file_contents(file_path):
         return None  
   
 # Function to extract text from PDF  
-def extract_text_from_pdf(pdf_path):  
+def extract_text_from_pdf(pdf_source):  
+    """Extract the text of every page. ``pdf_source`` is a path, raw bytes, or a binary file object."""  
     try:  
-        with open(pdf_path, 'rb') as file:  
-            reader = PyPDF2.PdfReader(file)  
-            text = "".join([page.extract_text() for page in reader.pages])  
-            return text  
+        if isinstance(pdf_source, (bytes, bytearray)):  
+            pdf_source = io.BytesIO(pdf_source)  
+        if isinstance(pdf_source, (str, os.PathLike)):  
+            with open(pdf_source, 'rb') as file:  
+                reader = PyPDF2.PdfReader(file)  
+                return "".join([page.extract_text() for page in reader.pages])  
+        reader = PyPDF2.PdfReader(pdf_source)  
+        return "".join([page.extract_text() for page in reader.pages])  
     except Exception as e:  
-        print(f"Error reading PDF file {pdf_path}: {e}")  
+        print(f"Error reading PDF file: {e}")  
         return None  
   
 def extract_text_from_docx(file_content):  
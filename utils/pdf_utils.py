@@ -0,0 +1,146 @@
+# utils/pdf_utils.py  
+import io  
+import os  
+import sys  
+import logging  
+import tempfile  
+import multiprocessing.context  
+from collections import deque  
+from concurrent.futures import ProcessPoolExecutor  
+import PyPDF2  
+
+### GLOBAL VARIABLES ###  
+PDF_PAGE_BATCH_SIZE = int(os.environ.get("APPSETTING_PDF_PAGE_BATCH_SIZE", "10"))  
+# Documents shorter than this are parsed in the calling thread; the process pool isn't worth the pickling  
+PDF_PROCESS_POOL_MIN_PAGES = int(os.environ.get("APPSETTING_PDF_PROCESS_POOL_MIN_PAGES", "40"))  
+PDF_PROCESS_POOL_WORKERS = int(os.environ.get("APPSETTING_PDF_PROCESS_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))  
+# Hard cap on pages read from any one upload (0 means no cap)  
+PDF_MAX_PAGES = int(os.environ.get("APPSETTING_PDF_MAX_PAGES", "0"))  
+
+_process_pool = None  
+_worker_reader = None  # ((path, inode, mtime), PdfReader) of the document this worker process parsed last  
+
+
+class _PdfWorkerProcess(multiprocessing.context.SpawnProcess):  
+    """A spawned worker that starts from this module rather than the parent's ``__main__``.  
+
+    spawn re-imports the parent's main module in every child. Under ``python app.py``  
+    that would re-run the whole bot's setup (logging, DB pool, JIRA login, adapter)  
+    in each PDF worker, so the main module is swapped for this one while it starts.  
+    """  
+
+    @staticmethod  
+    def _Popen(process_obj):  
+        main_module = sys.modules["__main__"]  
+        sys.modules["__main__"] = sys.modules[__name__]  
+        try:  
+            return multiprocessing.context.SpawnProcess._Popen(process_obj)  
+        finally:  
+            sys.modules["__main__"] = main_module  
+
+
+class _PdfWorkerContext(multiprocessing.context.SpawnContext):  
+    Process = _PdfWorkerProcess  
+
+
+def get_pdf_process_pool():  
+    """Returns the shared process pool used for PDF page extraction."""  
+    global _process_pool  
+    if _process_pool is None:  
+        # spawn rather than fork: the app process has event-loop and pool threads running  
+        _process_pool = ProcessPoolExecutor(  
+            max_workers=PDF_PROCESS_POOL_WORKERS,  
+            mp_context=_PdfWorkerContext()  
+        )  
+    return _process_pool  
+
+
+def shutdown_pdf_process_pool():  
+    """Stops the PDF worker processes (called on app shutdown)."""  
+    global _process_pool  
+    if _process_pool is not None:  
+        _process_pool.shutdown(wait=True, cancel_futures=True)  
+        _process_pool = None  
+
+
+def _read_pdf_bytes(pdf_source):  
+    if isinstance(pdf_source, (bytes, bytearray)):  
+        return bytes(pdf_source)  
+    if isinstance(pdf_source, (str, os.PathLike)):  
+        with open(pdf_source, "rb") as file:  
+            return file.read()  
+    return pdf_source.read()  
+
+
+def _extract_page_range(pdf_path, start, end):  
+    """Worker entry point: return the text of pages ``start``..``end - 1``.  
+
+    Each worker parses a document once and keeps the reader for its later batches.  
+    """  
+    global _worker_reader  
+    stat = os.stat(pdf_path)  
+    key = (pdf_path, stat.st_ino, stat.st_mtime_ns)  # a temp path can be reused by a later upload  
+    if _worker_reader is None or _worker_reader[0] != key:  
+        _worker_reader = (key, PyPDF2.PdfReader(pdf_path))  
+    reader = _worker_reader[1]  
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]  
+
+
+def _write_temp_pdf(pdf_bytes):  
+    # Workers get a path instead of the bytes, so a large document isn't pickled into every batch  
+    with tempfile.NamedTemporaryFile(prefix="pdf_pages_", suffix=".pdf", delete=False) as file:  
+        file.write(pdf_bytes)  
+        return file.name  
+
+
+def iter_pdf_page_batches(pdf_source, first_page=0, last_page=None, batch_size=None):  
+    """Yield ``(start_page, [page_text, ...])`` batches in page order.  
+
+    ``pdf_source`` is a path, raw bytes, or a binary file object. Pages are 0-based and  
+    ``last_page`` is exclusive, like a slice. Large documents are parsed in the process  
+    pool with a few batches in flight, so the consumer can start working on the first  
+    pages while later ones are still being extracted.  
+    """  
+    batch_size = max(1, batch_size or PDF_PAGE_BATCH_SIZE)  
+    pdf_bytes = _read_pdf_bytes(pdf_source)  
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))  
+    page_count = len(reader.pages)  
+
+    first_page = max(0, first_page)  
+    last_page = page_count if last_page is None else min(last_page, page_count)  
+    if PDF_MAX_PAGES:  
+        last_page = min(last_page, first_page + PDF_MAX_PAGES)  
+    ranges = [(start, min(start + batch_size, last_page)) for start in range(first_page, last_page, batch_size)]  
+    logging.debug(f"Extracting pages {first_page}-{last_page} of {page_count} in {len(ranges)} batch(es)")  
+
+    if last_page - first_page < PDF_PROCESS_POOL_MIN_PAGES:  
+        for start, end in ranges:  
+            yield start, [reader.pages[i].extract_text() or "" for i in range(start, end)]  
+        return  
+
+    pool = get_pdf_process_pool()  
+    pdf_path = _write_temp_pdf(pdf_bytes)  
+    del pdf_bytes, reader  # don't hold the document in this process while the workers page through it  
+    pending = deque()  
+    next_range = iter(ranges)  
+    max_in_flight = PDF_PROCESS_POOL_WORKERS * 2  
+    try:  
+        for start, end in next_range:  
+            pending.append((start, pool.submit(_extract_page_range, pdf_path, start, end)))  
+            if len(pending) >= max_in_flight:  
+                break  
+        while pending:  
+            start, future = pending.popleft()  
+            texts = future.result()  
+            for next_start, next_end in next_range:  
+                pending.append((next_start, pool.submit(_extract_page_range, pdf_path, next_start, next_end)))  
+                break  
+            yield start, texts  
+    finally:  
+        # The consumer may stop early; don't leave queued batches running  
+        for _, future in pending:  
+            future.cancel()  
+        try:  
+            os.remove(pdf_path)  
+        except OSError as e:  
+            logging.warning(f"Could not remove temporary PDF {pdf_path}: {e}")  
@@ -4,9 +4,12 @@ import re
 import os  
 from dotenv import load_dotenv  
 import json  
-import tiktoken  
 import logging  
-from .openai_utils import openai, AZURE_OPENAI_ENDPOINT, OPENAI_API_KEY, AZURE_OPENAI_API_VERSION, OPENAI_MODEL  
+from .openai_utils import create_chat_completion_async  
+from .model_router_utils import choose_deployment  
+from .http_utils import run_blocking  
+from .token_utils import encoding, num_tokens_from_messages  
+import asyncio  
   
 # Load environment variables from .env file  
 load_dotenv()  
@@ -19,8 +22,6 @@ GPT_MODEL = "gpt-4-turbo"
 MAX_NUMBER_OF_RESULTS_FROM_LINKEDIN = 5  
 MAX_NUMBER_OF_RESULTS_IN_GENERAL = 10  
   
-# Logging configuration  
-logging.basicConfig(level=logging.DEBUG)  
 logger = logging.getLogger(__name__)  
   
 # Define phrases to filter out  
@@ -38,7 +39,7 @@ LINKEDIN_FILTER_PHRASES = [
 ]  
   
 def num_tokens(text):  
-    return len(tiktoken.encoding_for_model(GPT_MODEL).encode(text))  
+    return len(encoding.encode(text))  
   
 def filter_phrases(content):  
     for phrase in FILTER_PHRASES:  
@@ -148,16 +149,21 @@ def format_for_slack(bullet_points):
     return formatted_text.strip()  
   
 async def search_person(query):  
-    linkedin_profile_results = google_search_linkedin_profile(query)[:MAX_NUMBER_OF_RESULTS_FROM_LINKEDIN]  
-    linkedin_post_results = google_search_linkedin_posts(query)[:MAX_NUMBER_OF_RESULTS_FROM_LINKEDIN]  
-    general_results = google_search(query)[:MAX_NUMBER_OF_RESULTS_IN_GENERAL]  
+    linkedin_profile_results, linkedin_post_results, general_results = await asyncio.gather(  
+        run_blocking(google_search_linkedin_profile, query),  
+        run_blocking(google_search_linkedin_posts, query),  
+        run_blocking(google_search, query)  
+    )  
+    linkedin_profile_results = linkedin_profile_results[:MAX_NUMBER_OF_RESULTS_FROM_LINKEDIN]  
+    linkedin_post_results = linkedin_post_results[:MAX_NUMBER_OF_RESULTS_FROM_LINKEDIN]  
+    general_results = general_results[:MAX_NUMBER_OF_RESULTS_IN_GENERAL]  
   
     combined_results = linkedin_profile_results + linkedin_post_results + general_results  
     combined_results = combined_results[:10]  
   
     user_name = query.split()[0]  
-    for result in combined_results:  
-        content, author = extract_main_content(result['link'], user_name)  
+    extracted = await asyncio.gather(*(run_blocking(extract_main_content, result['link'], user_name) for result in combined_results))  
+    for result, (content, author) in zip(combined_results, extracted):  
         result['content'] = content  
         result['author'] = author  
   
@@ -166,15 +172,20 @@ async def search_person(query):
     # Retry with "Teradata" filter if no valid results found  
     if not valid_results:  
         teradata_query = f"{query} Teradata"  
-        linkedin_profile_results = google_search_linkedin_profile(teradata_query)[:MAX_NUMBER_OF_RESULTS_FROM_LINKEDIN]  
-        linkedin_post_results = google_search_linkedin_posts(teradata_query)[:MAX_NUMBER_OF_RESULTS_FROM_LINKEDIN]  
-        general_results = google_search(teradata_query)[:MAX_NUMBER_OF_RESULTS_IN_GENERAL]  
+        linkedin_profile_results, linkedin_post_results, general_results = await asyncio.gather(  
+            run_blocking(google_search_linkedin_profile, teradata_query),  
+            run_blocking(google_search_linkedin_posts, teradata_query),  
+            run_blocking(google_search, teradata_query)  
+        )  
+        linkedin_profile_results = linkedin_profile_results[:MAX_NUMBER_OF_RESULTS_FROM_LINKEDIN]  
+        linkedin_post_results = linkedin_post_results[:MAX_NUMBER_OF_RESULTS_FROM_LINKEDIN]  
+        general_results = general_results[:MAX_NUMBER_OF_RESULTS_IN_GENERAL]  
   
         combined_results = linkedin_profile_results + linkedin_post_results + general_results  
         combined_results = combined_results[:10]  
   
-        for result in combined_results:  
-            content, author = extract_main_content(result['link'], user_name)  
+        extracted = await asyncio.gather(*(run_blocking(extract_main_content, result['link'], user_name) for result in combined_results))  
+        for result, (content, author) in zip(combined_results, extracted):  
             result['content'] = content  
             result['author'] = author  
   
@@ -197,20 +208,15 @@ async def search_person(query):
         }  
     ]  
   
-    client = openai.AzureOpenAI(  
-        azure_endpoint=AZURE_OPENAI_ENDPOINT,  
-        api_key=OPENAI_API_KEY,  
-        api_version=AZURE_OPENAI_API_VERSION  
-    )  
-    response = client.chat.completions.create(  
-        model=OPENAI_MODEL,  
+    response = await create_chat_completion_async("person_search", dict(  
+        model=choose_deployment("person_search", num_tokens_from_messages(messages), 3096),  
         messages=messages,  
         temperature=0.5,  
         max_tokens=3096,  
         top_p=0.95,  
         frequency_penalty=0,  
         presence_penalty=0  
-    )  
+    ))  
   
     if response and response.choices:  
         career_summary = response.choices[0].message.content  
@@ -0,0 +1,242 @@
+# utils/rate_limit_utils.py  
+import os  
+import json  
+import time  
+import random  
+import asyncio  
+import sqlite3  
+import logging  
+import tempfile  
+import threading  
+from utils.http_utils import run_blocking  
+from utils.metrics_utils import Counter, Histogram  
+from utils.token_utils import count_tokens_cached  
+
+### GLOBAL VARIABLES ###  
+# Per-deployment quotas shared by every worker, e.g. {"gpt-4o": {"tpm": 150000, "rpm": 900}}  
+OPENAI_DEPLOYMENT_LIMITS = os.environ.get("APPSETTING_OPENAI_DEPLOYMENT_LIMITS", "{}")  
+# Quota for deployments not listed above (0 means unlimited, i.e. no metering)  
+OPENAI_DEFAULT_TPM = int(os.environ.get("APPSETTING_OPENAI_DEFAULT_TPM", "0"))  
+OPENAI_DEFAULT_RPM = int(os.environ.get("APPSETTING_OPENAI_DEFAULT_RPM", "0"))  
+# "sqlite" shares the budget between the workers on one host; "postgres" across every instance  
+OPENAI_RATE_LIMIT_BACKEND = os.environ.get("APPSETTING_OPENAI_RATE_LIMIT_BACKEND", "sqlite").lower()  
+OPENAI_RATE_LIMIT_DB_PATH = os.environ.get(  
+    "APPSETTING_OPENAI_RATE_LIMIT_DB_PATH", os.path.join(tempfile.gettempdir(), "azure_pythonbot_rate_limit.sqlite3")  
+)  
+# How long a call may queue for budget before giving up  
+OPENAI_RATE_LIMIT_MAX_WAIT = float(os.environ.get("APPSETTING_OPENAI_RATE_LIMIT_MAX_WAIT", "20"))  
+
+RATE_LIMIT_WINDOW = 60.0  # Azure quotas are per minute  
+IMAGE_TOKEN_ESTIMATE = 1000  # rough cost of one image part in a prompt  
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 60.0)  
+
+RATE_LIMIT_WAIT = Histogram(  
+    "bot_openai_rate_limit_wait_seconds",  
+    "Time completion calls queued for the shared token/request budget, by deployment.",  
+    ["deployment"],  
+    buckets=WAIT_BUCKETS  
+)  
+RATE_LIMIT_REJECTIONS = Counter(  
+    "bot_openai_rate_limit_rejections",  
+    "Completion calls that gave up waiting for the shared budget, by deployment.",  
+    ["deployment"]  
+)  
+
+
+class RateBudgetExceeded(Exception):  
+    """Raised when a call can't get budget on its deployment within OPENAI_RATE_LIMIT_MAX_WAIT."""  
+
+
+def _load_limits():  
+    try:  
+        limits = json.loads(OPENAI_DEPLOYMENT_LIMITS)  
+        if isinstance(limits, dict):  
+            return limits  
+        logging.error("APPSETTING_OPENAI_DEPLOYMENT_LIMITS must be a JSON object, ignoring it")  
+    except ValueError as e:  
+        logging.error(f"Could not parse APPSETTING_OPENAI_DEPLOYMENT_LIMITS: {e}")  
+    return {}  
+
+
+_limits = _load_limits()  
+
+
+def get_deployment_limits(deployment):  
+    """Return (tpm, rpm) for ``deployment``; 0 means that dimension isn't metered."""  
+    limits = _limits.get(deployment, {})  
+    return int(limits.get("tpm", OPENAI_DEFAULT_TPM)), int(limits.get("rpm", OPENAI_DEFAULT_RPM))  
+
+
+def estimate_request_tokens(request_kwargs):  
+    """Prompt tokens plus max_tokens, which is what Azure charges against TPM when the request arrives."""  
+    texts = []  
+    images = 0  
+    for message in request_kwargs.get("messages") or []:  
+        content = message.get("content")  
+        if isinstance(content, str):  
+            texts.append(content)  
+        elif isinstance(content, list):  
+            for part in content:  
+                if part.get("type") == "text":  
+                    texts.append(part.get("text") or "")  
+                else:  
+                    images += 1  
+    prompt_tokens = sum(count_tokens_cached(texts)) + 3 * len(request_kwargs.get("messages") or []) + 3  
+    return prompt_tokens + images * IMAGE_TOKEN_ESTIMATE + (request_kwargs.get("max_tokens") or 0)  
+
+
+def reservation_wait(rows, tokens, tpm, rpm, now):  
+    """Seconds until a ``tokens`` reservation fits beside ``rows`` ((created, tokens) in the window, oldest first).  
+
+    Returns 0 if it fits now. A request bigger than the whole TPM quota is let through  
+    once the window is empty, rather than never.  
+    """  
+    used = sum(row_tokens for _, row_tokens in rows)  
+    count = len(rows)  
+
+    def fits(used, count):  
+        return (not tpm or used + tokens <= tpm or count == 0) and (not rpm or count + 1 <= rpm)  
+
+    if fits(used, count):  
+        return 0.0  
+    for created, row_tokens in rows:  
+        used -= row_tokens  
+        count -= 1  
+        if fits(used, count):  
+            return max(0.01, created + RATE_LIMIT_WINDOW - now)  
+    return RATE_LIMIT_WINDOW  
+
+
+class SqliteBudgetStore:  
+    """Sliding one-minute reservation log in a sqlite file that every worker on the host opens.  
+
+    Each reservation runs in a BEGIN IMMEDIATE transaction, which takes the database's  
+    write lock up front, so two workers can never both spend the last of the budget.  
+    """  
+
+    def __init__(self, path):  
+        self.path = path  
+        self._local = threading.local()  
+
+    def _connection(self):  
+        connection = getattr(self._local, "connection", None)  
+        # Reconnect in forked workers; sqlite connections must not cross a fork  
+        if connection is None or self._local.pid != os.getpid():  
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)  
+            connection.execute("PRAGMA journal_mode=WAL")  
+            connection.execute(  
+                "CREATE TABLE IF NOT EXISTS reservations ("  
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, deployment TEXT NOT NULL, tokens INTEGER NOT NULL, created REAL NOT NULL)"  
+            )  
+            connection.execute("CREATE INDEX IF NOT EXISTS reservations_by_deployment ON reservations (deployment, created)")  
+            self._local.connection = connection  
+            self._local.pid = os.getpid()  
+        return connection  
+
+    def try_reserve(self, deployment, tokens, tpm, rpm):  
+        """Return (reservation_id, 0) on success or (None, seconds to wait)."""  
+        connection = self._connection()  
+        now = time.time()  
+        connection.execute("BEGIN IMMEDIATE")  
+        try:  
+            connection.execute("DELETE FROM reservations WHERE created < ?", (now - RATE_LIMIT_WINDOW,))  
+            rows = connection.execute(  
+                "SELECT created, tokens FROM reservations WHERE deployment = ? ORDER BY created", (deployment,)  
+            ).fetchall()  
+            wait = reservation_wait(rows, tokens, tpm, rpm, now)  
+            reservation_id = None  
+            if not wait:  
+                reservation_id = connection.execute(  
+                    "INSERT INTO reservations (deployment, tokens, created) VALUES (?, ?, ?)", (deployment, tokens, now)  
+                ).lastrowid  
+            connection.execute("COMMIT")  
+            return reservation_id, wait  
+        except Exception:  
+            connection.execute("ROLLBACK")  
+            raise  
+
+    def settle(self, reservation_id, tokens):  
+        self._connection().execute("UPDATE reservations SET tokens = ? WHERE id = ?", (tokens, reservation_id))  
+
+
+class PostgresBudgetStore:  
+    """Same reservation log in Postgres, for a budget shared by every instance."""  
+
+    def try_reserve(self, deployment, tokens, tpm, rpm):  
+        from utils.azure_postgres_utils import reserve_rate_budget  # only needed with this backend  
+        return reserve_rate_budget(  
+            deployment, tokens, RATE_LIMIT_WINDOW,  
+            lambda rows, now: reservation_wait(rows, tokens, tpm, rpm, now)  
+        )  
+
+    def settle(self, reservation_id, tokens):  
+        from utils.azure_postgres_utils import settle_rate_budget  
+        settle_rate_budget(reservation_id, tokens)  
+
+
+_store = PostgresBudgetStore() if OPENAI_RATE_LIMIT_BACKEND == "postgres" else SqliteBudgetStore(OPENAI_RATE_LIMIT_DB_PATH)  
+
+
+def _try_reserve(deployment, tokens, tpm, rpm):  
+    try:  
+        return _store.try_reserve(deployment, tokens, tpm, rpm)  
+    except Exception as e:  
+        # A broken budget store must never take the bot down with it  
+        logging.error(f"Rate budget store unavailable, calling {deployment} unmetered: {e}")  
+        return None, 0.0  
+
+
+def _next_sleep(wait, deadline):  
+    # Re-check at least every second: settled reservations often free budget early  
+    return min(wait, 1.0, max(0.0, deadline - time.monotonic())) + random.uniform(0, 0.05)  
+
+
+# Function to take budget for one call, queueing up to OPENAI_RATE_LIMIT_MAX_WAIT; returns a reservation id or None  
+def acquire_rate_budget(deployment, tokens):  
+    tpm, rpm = get_deployment_limits(deployment)  
+    if not tpm and not rpm:  
+        return None  
+    start = time.monotonic()  
+    deadline = start + OPENAI_RATE_LIMIT_MAX_WAIT  
+    while True:  
+        reservation_id, wait = _try_reserve(deployment, tokens, tpm, rpm)  
+        if not wait:  
+            RATE_LIMIT_WAIT.observe(time.monotonic() - start, deployment=deployment)  
+            return reservation_id  
+        if time.monotonic() + min(wait, 1.0) > deadline:  
+            RATE_LIMIT_REJECTIONS.inc(deployment=deployment)  
+            raise RateBudgetExceeded(f"No budget on deployment {deployment} for {tokens} tokens within {OPENAI_RATE_LIMIT_MAX_WAIT:.0f}s")  
+        time.sleep(_next_sleep(wait, deadline))  
+
+
+# Awaitable version of acquire_rate_budget; the store is touched off the event loop, the queueing is an asyncio sleep  
+async def acquire_rate_budget_async(deployment, tokens):  
+    tpm, rpm = get_deployment_limits(deployment)  
+    if not tpm and not rpm:  
+        return None  
+    start = time.monotonic()  
+    deadline = start + OPENAI_RATE_LIMIT_MAX_WAIT  
+    while True:  
+        reservation_id, wait = await run_blocking(_try_reserve, deployment, tokens, tpm, rpm)  
+        if not wait:  
+            RATE_LIMIT_WAIT.observe(time.monotonic() - start, deployment=deployment)  
+            return reservation_id  
+        if time.monotonic() + min(wait, 1.0) > deadline:  
+            RATE_LIMIT_REJECTIONS.inc(deployment=deployment)  
+            raise RateBudgetExceeded(f"No budget on deployment {deployment} for {tokens} tokens within {OPENAI_RATE_LIMIT_MAX_WAIT:.0f}s")  
+        await asyncio.sleep(_next_sleep(wait, deadline))  
+
+
+# Function to replace a reservation's estimate with the tokens the call actually used  
+def settle_rate_budget(reservation_id, tokens):  
+    if reservation_id is None:  
+        return  
+    try:  
+        _store.settle(reservation_id, tokens)  
+    except Exception as e:  
+        logging.error(f"Could not settle rate budget reservation {reservation_id}: {e}")  
+
+
+async def settle_rate_budget_async(reservation_id, tokens):  
+    if reservation_id is not None:  
+        await run_blocking(settle_rate_budget, reservation_id, tokens)  
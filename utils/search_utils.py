@@ -5,9 +5,12 @@ import re
 import os  
 from dotenv import load_dotenv  
 import json  
-import tiktoken  
 import logging  
-from .openai_utils import moderate_content, openai, AZURE_OPENAI_ENDPOINT, OPENAI_API_KEY, AZURE_OPENAI_API_VERSION, OPENAI_MODEL  
+from .openai_utils import moderate_content, create_chat_completion_async  
+from .model_router_utils import choose_deployment  
+from .http_utils import run_blocking  
+from .token_utils import encoding, chunk_text, num_tokens_from_messages  
+import asyncio  
   
 # Load environment variables from .env file  
 load_dotenv()  
@@ -25,9 +28,6 @@ CATEGORY_THRESHOLDS = {key: 0.01 for key in [
     'self-harm/instructions', 'harassment/threatening', 'violence'  
 ]}  
   
-# Logging configuration  
-logging.basicConfig(level=logging.DEBUG)  
-  
 def google_search(query):  
     query = query.replace(' ', '+')  
     headers = {'User-Agent': USER_AGENT}  
@@ -72,26 +72,12 @@ def extract_main_content(url):
     return text_content  
   
 def num_tokens(text):  
-    return len(tiktoken.encoding_for_model(GPT_MODEL).encode(text))  
-  
-def chunk_text(text, max_chunk_size):  
-    chunks, current_chunk, current_length = [], [], 0  
-    for word in text.split():  
-        word_length = num_tokens(word)  
-        if current_length + word_length + 1 > max_chunk_size:  
-            chunks.append(' '.join(current_chunk))  
-            current_chunk, current_length = [word], word_length + 1  
-        else:  
-            current_chunk.append(word)  
-            current_length += word_length + 1  
-    if current_chunk:  
-        chunks.append(' '.join(current_chunk))  
-    return chunks  
+    return len(encoding.encode(text))  
   
 async def search_general(query):  # Renamed function  
-    combined_results = google_search(query)  
-    for result in combined_results:  
-        content = extract_main_content(result['link'])  
+    combined_results = await run_blocking(google_search, query)  
+    contents = await asyncio.gather(*(run_blocking(extract_main_content, result['link']) for result in combined_results))  
+    for result, content in zip(combined_results, contents):  
         result['content'] = content  
     valid_results = [result for result in combined_results if result['content']]  
     if not valid_results:  
@@ -111,20 +97,15 @@ async def search_general(query):  # Renamed function
             {"role": "system", "content": "You are a helpful assistant that summarizes web content."},  
             {"role": "user", "content": f"Summarize the following information in 2000 characters or less: {chunk}"}  
         ]  
-        client = openai.AzureOpenAI(  
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,  
-            api_key=OPENAI_API_KEY,  
-            api_version=AZURE_OPENAI_API_VERSION  
-        )  
-        response = client.chat.completions.create(  
-            model=OPENAI_MODEL,  
+        response = await create_chat_completion_async("web_search", dict(  
+            model=choose_deployment("web_search", num_tokens_from_messages(messages), 1000),  
             messages=messages,  
             temperature=0.5,  
             max_tokens=1000,  
             top_p=0.95,  
             frequency_penalty=0,  
             presence_penalty=0  
-        )  
+        ))  
         if response and response.choices:  
             final_summary += response.choices[0].message.content  
   
@@ -0,0 +1,78 @@
+# utils/slack_dedup_utils.py  
+import os  
+import time  
+import logging  
+from collections import OrderedDict  
+from utils.azure_postgres_utils import claim_slack_event_async, finish_slack_event_async  
+
+### GLOBAL VARIABLES ###  
+# How long an event key is remembered in memory (Slack gives up retrying well before this)  
+SLACK_EVENT_DEDUP_TTL = float(os.environ.get("APPSETTING_SLACK_EVENT_DEDUP_TTL", "900"))  
+SLACK_EVENT_DEDUP_CACHE_SIZE = int(os.environ.get("APPSETTING_SLACK_EVENT_DEDUP_CACHE_SIZE", "10000"))  
+# Also claim events in Postgres so retries landing on another instance are caught  
+SLACK_EVENT_DEDUP_USE_DB = os.environ.get("APPSETTING_SLACK_EVENT_DEDUP_USE_DB", "true").lower() == "true"  
+
+_seen_events = OrderedDict()  # event key -> expiry time, for events in flight or handled by this process  
+
+
+def get_slack_event_key(activity):  
+    """Key identifying a Slack delivery: the envelope event_id, or channel + ts of the message."""  
+    slack_message = activity.channel_data.get("SlackMessage", {}) if activity.channel_data else {}  
+    slack_event = slack_message.get("event", {})  
+    event_id = slack_message.get("event_id") or slack_event.get("event_id")  
+    if event_id:  
+        return event_id  
+    if slack_event.get("channel") and slack_event.get("ts"):  
+        return f"{slack_event['channel']}:{slack_event['ts']}"  
+    return None  
+
+
+def _remember(event_key, now):  
+    while _seen_events:  
+        oldest_key, expires_at = next(iter(_seen_events.items()))  
+        if expires_at > now and len(_seen_events) < SLACK_EVENT_DEDUP_CACHE_SIZE:  
+            break  
+        del _seen_events[oldest_key]  
+    _seen_events[event_key] = now + SLACK_EVENT_DEDUP_TTL  
+
+
+async def is_duplicate_slack_event(event_key):  
+    """Return True if this event was already picked up (here or, via Postgres, on another instance).  
+
+    Otherwise the event is claimed as in flight; settle it with ``finish_slack_event``.  
+    """  
+    if not event_key:  
+        return False  
+    now = time.time()  
+    expires_at = _seen_events.get(event_key)  
+    if expires_at is not None and expires_at > now:  
+        logging.info(f"Dropping duplicate Slack delivery {event_key} (seen in memory)")  
+        return True  
+
+    # Claim locally before awaiting so a retry arriving mid-claim is caught by the check above  
+    _remember(event_key, now)  
+    if not SLACK_EVENT_DEDUP_USE_DB:  
+        return False  
+    claimed = await claim_slack_event_async(event_key)  
+    if claimed is False:  
+        logging.info(f"Dropping duplicate Slack delivery {event_key} (claimed by another instance)")  
+        return True  
+    # None means the database was unavailable; fail open rather than drop real messages  
+    return False  
+
+
+async def finish_slack_event(event_key, completed):  
+    """Settle the claim ``is_duplicate_slack_event`` took once the turn is over.  
+
+    A completed event keeps blocking redeliveries. A failed one is released, here and in  
+    Postgres, so Slack's next redelivery is handled instead of silently dropped.  
+    """  
+    if not event_key:  
+        return  
+    if completed:  
+        _remember(event_key, time.time())  
+    else:  
+        _seen_events.pop(event_key, None)  
+        logging.info(f"Released Slack delivery {event_key} so a redelivery can retry it")  
+    if SLACK_EVENT_DEDUP_USE_DB:  
+        await finish_slack_event_async(event_key, completed)  
@@ -0,0 +1,118 @@
+# utils/slack_history_utils.py  
+import os  
+import time  
+import logging  
+from collections import OrderedDict  
+from utils.slack_utils import get_conversation_replies_async  
+
+### GLOBAL VARIABLES ###  
+SLACK_HISTORY_CACHE_SIZE = int(os.environ.get("APPSETTING_SLACK_HISTORY_CACHE_SIZE", "500"))  
+# Threads untouched for this long are dropped and re-fetched in full next time  
+SLACK_HISTORY_CACHE_TTL = float(os.environ.get("APPSETTING_SLACK_HISTORY_CACHE_TTL", "900"))  
+# A cached thread is served without calling Slack at all if it was synced this recently;  
+# after that, only replies newer than the last cached ts are requested  
+SLACK_HISTORY_RESYNC_INTERVAL = float(os.environ.get("APPSETTING_SLACK_HISTORY_RESYNC_INTERVAL", "30"))  
+
+# (channel, thread_ts) -> {"messages": OrderedDict(ts -> msg), "synced_ts": newest ts seen from Slack,  
+#                          "synced_at": float, "touched_at": float}  
+_thread_history_cache = OrderedDict()  
+
+
+def _ts_sort_key(ts):  
+    seconds, _, fraction = str(ts).partition(".")  
+    return (int(seconds or 0), int(fraction or 0))  
+
+
+def _get_entry(channel, thread_ts):  
+    key = (channel, thread_ts)  
+    entry = _thread_history_cache.get(key)  
+    if entry is not None and time.time() - entry["touched_at"] > SLACK_HISTORY_CACHE_TTL:  
+        logging.debug(f"Slack history cache entry for {key} expired")  
+        del _thread_history_cache[key]  
+        entry = None  
+    return entry  
+
+
+def _store_messages(entry, messages):  
+    """Merge messages into a cache entry by ts, replacing edited copies and keeping ts order."""  
+    stored = entry["messages"]  
+    out_of_order = False  
+    latest = next(reversed(stored), None)  
+    for msg in messages:  
+        ts = msg.get("ts")  
+        if not ts:  
+            continue  
+        if ts not in stored and latest is not None and _ts_sort_key(ts) < _ts_sort_key(latest):  
+            out_of_order = True  
+        stored[ts] = msg  
+        if latest is None or _ts_sort_key(ts) > _ts_sort_key(latest):  
+            latest = ts  
+    if out_of_order:  
+        entry["messages"] = OrderedDict(sorted(stored.items(), key=lambda item: _ts_sort_key(item[0])))  
+    entry["touched_at"] = time.time()  
+
+
+def _new_entry(channel, thread_ts):  
+    entry = {"messages": OrderedDict(), "synced_ts": None, "synced_at": 0.0, "touched_at": time.time()}  
+    _thread_history_cache[(channel, thread_ts)] = entry  
+    while len(_thread_history_cache) > SLACK_HISTORY_CACHE_SIZE:  
+        _thread_history_cache.popitem(last=False)  
+    return entry  
+
+
+def record_thread_message(channel, thread_ts, message):  
+    """Append a message we received or posted to a cached thread (no-op if the thread isn't cached)."""  
+    if not message or not thread_ts:  
+        return  
+    entry = _get_entry(channel, thread_ts)  
+    if entry is None:  
+        return  
+    _store_messages(entry, [message])  
+    _thread_history_cache.move_to_end((channel, thread_ts))  
+
+
+def record_thread_responses(channel, thread_ts, response_data_list):  
+    """Append the messages returned by chat.postMessage / chat.update calls to a cached thread."""  
+    for response_data in response_data_list or []:  
+        if response_data.get("ok") and response_data.get("message"):  
+            message = dict(response_data["message"])  
+            message.setdefault("ts", response_data.get("ts"))  
+            record_thread_message(channel, thread_ts, message)  
+
+
+async def get_thread_messages(token, channel, thread_ts):  
+    """Return the thread's raw Slack messages, fetching only what the cache doesn't have.  
+
+    Returns a dict shaped like the conversations.replies response ({"ok", "messages"}  
+    or {"ok": False, "error"}).  
+    """  
+    entry = _get_entry(channel, thread_ts)  
+    now = time.time()  
+    if entry is not None and entry["synced_at"] and now - entry["synced_at"] < SLACK_HISTORY_RESYNC_INTERVAL:  
+        logging.debug(f"Serving thread {thread_ts} history from cache without calling Slack")  
+        _thread_history_cache.move_to_end((channel, thread_ts))  
+        entry["touched_at"] = now  
+        return {"ok": True, "messages": list(entry["messages"].values())}  
+
+    # Ask only for replies newer than the last one Slack gave us. Messages recorded locally  
+    # since then don't move this marker, so replies we never saw an event for still get fetched.  
+    oldest = entry["synced_ts"] if entry is not None else None  
+    response_data = await get_conversation_replies_async(token, channel, thread_ts, oldest=oldest)  
+    if not response_data.get("ok"):  
+        if entry is not None and entry["messages"]:  
+            logging.error(f"Incremental history fetch failed, serving cached thread {thread_ts}: {response_data.get('error')}")  
+            return {"ok": True, "messages": list(entry["messages"].values())}  
+        return response_data  
+
+    if entry is None:  
+        entry = _new_entry(channel, thread_ts)  
+    fetched_messages = response_data.get("messages", [])  
+    _store_messages(entry, fetched_messages)  
+    for msg in fetched_messages:  
+        ts = msg.get("ts")  
+        if ts and (entry["synced_ts"] is None or _ts_sort_key(ts) > _ts_sort_key(entry["synced_ts"])):  
+            entry["synced_ts"] = ts  
+    entry["synced_at"] = time.time()  
+    _thread_history_cache.move_to_end((channel, thread_ts))  
+    logging.debug(f"Synced thread {thread_ts} history ({'incremental' if oldest else 'full'}), {len(entry['messages'])} messages cached")  
+    return {"ok": True, "messages": list(entry["messages"].values())}  
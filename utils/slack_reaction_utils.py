@@ -0,0 +1,60 @@
+# utils/slack_reaction_utils.py  
+import asyncio  
+import logging  
+from utils.slack_utils import add_reaction_to_message_async, remove_reaction_from_message_async  
+
+# Strong references to in-flight reaction tasks so they aren't garbage collected mid-call  
+_reaction_tasks = set()  
+
+
+class SlackReactions:  
+    """Status reactions (hourglass, then check mark) on one Slack message, kept off the reply's critical path.  
+
+    Every call schedules a background task on the shared aiohttp session and returns  
+    immediately. Tasks for the same message are chained, so "remove hourglass" can never  
+    overtake "add hourglass", and failures are logged instead of raised to the turn.  
+    """  
+
+    def __init__(self, token, channel, timestamp):  
+        self.token = token  
+        self.channel = channel  
+        self.timestamp = timestamp  
+        self._last_task = None  
+
+    def _schedule(self, *steps):  
+        previous = self._last_task  
+        task = asyncio.create_task(self._run_steps(previous, steps))  
+        _reaction_tasks.add(task)  
+        task.add_done_callback(_reaction_tasks.discard)  
+        self._last_task = task  
+        return task  
+
+    async def _run_steps(self, previous, steps):  
+        if previous is not None:  
+            await asyncio.gather(previous, return_exceptions=True)  
+        for action, name in steps:  
+            try:  
+                if action == "add":  
+                    response = await add_reaction_to_message_async(self.token, self.channel, self.timestamp, name)  
+                else:  
+                    response = await remove_reaction_from_message_async(self.token, self.channel, self.timestamp, name)  
+                if not response.get("ok"):  
+                    logging.error(f"Failed to {action} reaction {name}: {response.get('error')}")  
+            except Exception as e:  
+                logging.error(f"Exception while trying to {action} reaction {name}: {e}")  
+
+    def start(self, name="hourglass"):  
+        """Mark the message as being worked on."""  
+        return self._schedule(("add", name))  
+
+    def finish(self, success=True, pending="hourglass", done="white_check_mark"):  
+        """Swap the pending reaction for the done one (or just clear it if the turn failed)."""  
+        if success:  
+            return self._schedule(("remove", pending), ("add", done))  
+        return self._schedule(("remove", pending))  
+
+
+async def drain_reaction_tasks(timeout=5.0):  
+    """Wait briefly for outstanding reaction calls (called on app shutdown)."""  
+    if _reaction_tasks:  
+        await asyncio.wait(list(_reaction_tasks), timeout=timeout)  
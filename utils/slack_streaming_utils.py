@@ -0,0 +1,122 @@
+# utils/slack_streaming_utils.py  
+import os  
+import time  
+import asyncio  
+import logging  
+from utils.slack_utils import (  
+    post_message_to_slack_async,  
+    update_message_in_slack_async,  
+    create_slack_message,  
+    convert_openai_response_to_slack_mrkdwn,  
+    split_first_chunk  
+)  
+
+### GLOBAL VARIABLES ###  
+SLACK_STREAMING_ENABLED = os.environ.get("APPSETTING_SLACK_STREAMING_ENABLED", "false").lower() == "true"  
+# Minimum seconds between chat.update calls on the same message (chat.update is a Tier 3 method)  
+SLACK_STREAMING_UPDATE_INTERVAL = float(os.environ.get("APPSETTING_SLACK_STREAMING_UPDATE_INTERVAL", "1.0"))  
+SLACK_STREAMING_PLACEHOLDER = "_Thinking..._"  
+SLACK_STREAMING_CURSOR = " ▍"  
+
+# Slack block text limit is 3000 characters; the final section also carries the footer,  
+# and mrkdwn conversion can grow the text slightly, so roll over well before the limit  
+MAX_BLOCK_TEXT_LENGTH = 3000  
+SEGMENT_TEXT_LENGTH = MAX_BLOCK_TEXT_LENGTH - 500  
+
+
+class SlackStreamingMessage:  
+    """A Slack reply that is posted early and edited in place as LLM tokens arrive.  
+
+    The first message is posted as a placeholder as soon as ``start`` is called, then  
+    ``append`` buffers deltas and pushes a throttled ``chat.update``. When the current  
+    message would exceed Slack's block limit it is finalized and the remainder rolls  
+    over into a follow-up message in the same thread. ``finish`` writes the final text  
+    of the last message along with the footer blocks.  
+    """  
+
+    def __init__(self, token, channel, thread_ts, prefix=""):  
+        self.token = token  
+        self.channel = channel  
+        self.thread_ts = thread_ts  
+        self.prefix = prefix  
+        self.current_text = f"{prefix} " if prefix else ""  
+        self.current_ts = None  
+        self.responses = []  
+        self.created_at = time.time()  
+        self.first_text_at = None  
+        self._last_update = 0.0  
+        self._start_task = None  
+
+    def start(self):  
+        """Post the placeholder message in the background so the LLM call isn't held up by it."""  
+        self._start_task = asyncio.create_task(self._post_new_message(self.current_text + SLACK_STREAMING_PLACEHOLDER))  
+        return self._start_task  
+
+    async def _post_new_message(self, text):  
+        response_list = await post_message_to_slack_async(self.token, self.channel, text, thread_ts=self.thread_ts)  
+        response_data = response_list[0] if response_list else {"ok": False, "error": "No response from Slack."}  
+        self.responses.append(response_data)  
+        if response_data.get("ok"):  
+            self.current_ts = response_data.get("ts")  
+        else:  
+            self.current_ts = None  
+        return response_data  
+
+    async def _wait_for_start(self):  
+        if self._start_task is not None:  
+            await self._start_task  
+            self._start_task = None  
+
+    async def _update_current(self, text, blocks=None):  
+        await self._wait_for_start()  
+        if not self.current_ts:  
+            return {"ok": False, "error": "Streaming message was never posted."}  
+        self._last_update = time.time()  
+        response_data = await update_message_in_slack_async(self.token, self.channel, self.current_ts, text, blocks)  
+        if self.first_text_at is None and response_data.get("ok"):  
+            self.first_text_at = self._last_update  
+            logging.debug(f"Time to first visible text: {self.first_text_at - self.created_at:.3f}s")  
+        return response_data  
+
+    async def append(self, delta):  
+        self.current_text += delta  
+        if len(self.current_text) > SEGMENT_TEXT_LENGTH:  
+            # One delta can hold several segments' worth, e.g. a cached reply replayed in one piece  
+            while len(self.current_text) > SEGMENT_TEXT_LENGTH:  
+                await self._roll_over()  
+        elif time.time() - self._last_update >= SLACK_STREAMING_UPDATE_INTERVAL:  
+            await self._update_current(convert_openai_response_to_slack_mrkdwn(self.current_text) + SLACK_STREAMING_CURSOR)  
+
+    async def _roll_over(self):  
+        # Cut the way long posts are chunked, so a code block cut in two is closed and re-opened  
+        head, tail = split_first_chunk(self.current_text, SEGMENT_TEXT_LENGTH)  
+        tail = tail.lstrip("\n")  
+        await self._wait_for_start()  
+        if self.current_ts:  
+            # Keep the head's final text (not the placeholder it was posted as) for the thread history cache  
+            self.responses.append(await self._update_current(convert_openai_response_to_slack_mrkdwn(head)))  
+        else:  
+            # The placeholder never made it to Slack, so post the head on its own rather than drop it  
+            await self._post_new_message(convert_openai_response_to_slack_mrkdwn(head))  
+        self.current_text = tail  
+        logging.debug(f"Rolling streamed reply over into a new Slack message ({len(tail)} chars carried)")  
+        # Post at most one segment: a longer tail would be split over several Slack messages, and only  
+        # the first one's ts is kept, so the rest would be left behind and posted again on the next pass  
+        if tail and len(tail) <= SEGMENT_TEXT_LENGTH:  
+            await self._post_new_message(convert_openai_response_to_slack_mrkdwn(tail) + SLACK_STREAMING_CURSOR)  
+        else:  
+            await self._post_new_message(SLACK_STREAMING_PLACEHOLDER)  
+
+    async def finish(self, footer):  
+        """Write the final text and footer. Returns the list of Slack responses for the whole reply."""  
+        await self._wait_for_start()  
+        slack_message = create_slack_message(self.current_text, footer)  
+        if self.current_ts:  
+            response_data = await self._update_current(slack_message['blocks'][0]['text']['text'], slack_message['blocks'])  
+            self.responses.append(response_data)  
+        else:  
+            # The placeholder never made it to Slack, so fall back to a regular post  
+            self.responses.extend(await post_message_to_slack_async(  
+                self.token, self.channel, self.current_text, blocks=slack_message['blocks'], thread_ts=self.thread_ts  
+            ))  
+        return self.responses  
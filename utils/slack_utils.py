@@ -1,13 +1,20 @@
 import requests  
 import logging  
 import re  
+import asyncio  
+import aiohttp  
 from utils.footer_utils import generate_footer  
-import json  
+from utils.http_utils import get_http_session  
+from utils.logging_utils import log_payload  
   
 SLACK_CHAT_URL = "https://slack.com/api/chat.postMessage"  
+SLACK_CHAT_UPDATE_URL = "https://slack.com/api/chat.update"  
 SLACK_CONVERSATIONS_REPLIES_URL = "https://slack.com/api/conversations.replies"  
 SLACK_ADD_REACTION_URL = "https://slack.com/api/reactions.add"  
 SLACK_REMOVE_REACTION_URL = "https://slack.com/api/reactions.remove"  
+  
+# Keep-alive session for the synchronous Slack calls  
+_slack_requests_session = requests.Session()  
 
 
 def get_user_id(activity):  
@@ -21,62 +28,41 @@ def get_user_id(activity):
         return None  
 
   
+# Every construct the Slack renderer understands, matched in a single left-to-right scan.  
+# Code spans and existing Slack tokens (<@U123>, <url|text>) come first so nothing inside  
+# them is rewritten, which also makes rendering an already-rendered string a no-op.  
+MRKDWN_TOKEN_PATTERN = re.compile(r"""  
+    (?P<code_block>```.*?```)  
+  | (?P<inline_code>`[^`\n]*`)  
+  | (?P<slack_token><[^<>\n]+>)  
+  | (?P<header>^\#\#\#\ (?P<header_text>[^\n]*?)\n)  
+  | (?P<bold>\*\*(?P<bold_text>[^\n]+?)\*\*)  
+  | (?P<bullet>^\*\ )  
+  | (?P<link>\[(?P<link_text>[^\]\n]*)\]\((?P<link_url>[^)\s]*)\))  
+  | (?<![\w<])@(?P<mention>\w+)  
+  | (?<![\w<&/])\#(?P<channel>\w+)  
+""", re.DOTALL | re.MULTILINE | re.VERBOSE)  
+  
+def _render_mrkdwn_token(match):  
+    kind = match.lastgroup  
+    if kind == "header":  
+        return f"```{match.group('header_text')}```\n"  
+    if kind == "bold":  
+        return f"*{match.group('bold_text')}*"  
+    if kind == "bullet":  
+        return "• "  
+    if kind == "link":  
+        return f"<{match.group('link_url')}|{match.group('link_text')}>"  
+    if kind == "mention":  
+        return f"<@{match.group('mention')}>"  
+    if kind == "channel":  
+        return f"<#{match.group('channel')}>"  
+    # code_block, inline_code and slack_token pass through untouched  
+    return match.group(0)  
+  
 def convert_openai_response_to_slack_mrkdwn(text):  
-    #logging.debug(f"Original text: {text}")  
-    logging.debug(f"passing through convert_openai_response_to_slack_mrkdwn def function... (debug by #uncommenting in slack_utils.py)")  
-  
-    # Handle code blocks first to avoid interfering with inline code  
-    code_block_pattern = re.compile(r'```(.*?)```', re.DOTALL)  
-    code_blocks = code_block_pattern.findall(text)  
-    for i, block in enumerate(code_blocks):  
-        placeholder = f"{{{{code_block_{i}}}}}"  
-        text = text.replace(f"```{block}```", placeholder)  
-  
-    # Convert headers  
-    text = re.sub(r'### (.*?)\n', r'```\1```\n', text)  
-    #logging.debug(f"After converting headers: {text}")  
-  
-    # Convert bold text  
-    text = re.sub(r'\*\*(.*?)\*\*', r'*\1*', text)  
-    #logging.debug(f"After converting bold text: {text}")  
-  
-    # Convert italic text  
-    text = re.sub(r'_(.*?)_', r'_\1_', text)  
-    #logging.debug(f"After converting italic text: {text}")  
-  
-    # Convert strikethrough text  
-    text = re.sub(r'~(.*?)~', r'~\1~', text)  
-    #logging.debug(f"After converting strikethrough text: {text}")  
-  
-    # Convert inline code  
-    text = re.sub(r'`(.*?)`', r'`\1`', text)  
-    #logging.debug(f"After converting inline code: {text}")  
-  
-    # Restore code blocks  
-    for i, block in enumerate(code_blocks):  
-        placeholder = f"{{{{code_block_{i}}}}}"  
-        text = text.replace(placeholder, f"```{block}```")  
-  
-    # Convert lists  
-    text = re.sub(r'^\* (.*?)$', r'• \1', text, flags=re.MULTILINE)  
-    text = re.sub(r'^1\. (.*?)$', r'1. \1', text, flags=re.MULTILINE)  
-    #logging.debug(f"After converting lists: {text}")  
-  
-    # Convert blockquotes  
-    text = re.sub(r'^> (.*?)$', r'> \1', text, flags=re.MULTILINE)  
-    #logging.debug(f"After converting blockquotes: {text}")  
-  
-    # Convert links  
-    text = re.sub(r'\[(.*?)\]\((.*?)\)', r'<\2|\1>', text)  
-    #logging.debug(f"After converting links: {text}")  
-  
-    # Convert user mentions and channel links  
-    text = re.sub(r'@(\w+)', r'<@\1>', text)  
-    text = re.sub(r'#(\w+)', r'<#\1>', text)  
-    #logging.debug(f"After converting user mentions and channel links: {text}")  
-  
-    #logging.debug(f"Converted text: {text}")  
-    return text  
+    """Convert OpenAI markdown to Slack mrkdwn in one pass (headers, bold, bullets, links, mentions)."""  
+    return MRKDWN_TOKEN_PATTERN.sub(_render_mrkdwn_token, text)  
   
   
 def convert_jira_response_to_slack_mrkdwn(issue_details):  
@@ -113,36 +99,6 @@ def convert_jira_response_to_slack_mrkdwn(issue_details):
 
 
   
-def create_slack_message(main_message: str, footer: str, is_jira_response: bool = False) -> dict:  
-    if is_jira_response:  
-        formatted_message = convert_jira_response_to_slack_mrkdwn(main_message) + f"\n\n{footer}"  
-    else:  
-        formatted_message = convert_openai_response_to_slack_mrkdwn(main_message) + f"\n\n{footer}"  
-  
-    return {  
-        "blocks": [  
-            {  
-                "type": "section",  
-                "text": {  
-                    "type": "mrkdwn",  
-                    "text": formatted_message  
-                }  
-            },  
-            {  
-                "type": "divider"  
-            },  
-            {  
-                "type": "context",  
-                "elements": [  
-                    {  
-                        "type": "mrkdwn",  
-                        "text": f"\n{footer}\n" 
-                    }  
-                ]  
-            }  
-        ]  
-    }  
-  
 def add_reaction_to_message(token, channel, timestamp, name):  
     headers = {  
         "Content-Type": "application/json",  
@@ -155,7 +111,7 @@ def add_reaction_to_message(token, channel, timestamp, name):
     }  
   
     try:  
-        response = requests.post(SLACK_ADD_REACTION_URL, headers=headers, json=payload)  
+        response = _slack_requests_session.post(SLACK_ADD_REACTION_URL, headers=headers, json=payload)  
         response_data = response.json()  
         logging.debug(f"Response from Slack (reactions.add): {response_data}")  
         if not response_data.get("ok"):  
@@ -180,7 +136,7 @@ def remove_reaction_from_message(token, channel, timestamp, name):
     }  
   
     try:  
-        response = requests.post(SLACK_REMOVE_REACTION_URL, headers=headers, json=payload)  
+        response = _slack_requests_session.post(SLACK_REMOVE_REACTION_URL, headers=headers, json=payload)  
         response_data = response.json()  
         logging.debug(f"Response from Slack (reactions.remove): {response_data}")  
         if not response_data.get("ok"):  
@@ -193,12 +149,161 @@ def remove_reaction_from_message(token, channel, timestamp, name):
         logging.error(f"Exception occurred while removing reaction from Slack message: {e}")  
         return {"ok": False, "error": "An error occurred while trying to remove reaction from Slack message. Please try again later."}  
   
+async def _slack_api_call_async(method, url, token, payload=None, params=None):  
+    """Call a Slack Web API method over the shared aiohttp session and return the decoded JSON."""  
+    headers = {  
+        "Content-Type": "application/json",  
+        "Authorization": f"Bearer {token}"  
+    }  
+    session = get_http_session()  
+    async with session.request(method, url, headers=headers, json=payload, params=params) as response:  
+        return await response.json(content_type=None)  
+  
+async def add_reaction_to_message_async(token, channel, timestamp, name):  
+    payload = {  
+        "channel": channel,  
+        "timestamp": timestamp,  
+        "name": name  
+    }  
+  
+    try:  
+        response_data = await _slack_api_call_async("POST", SLACK_ADD_REACTION_URL, token, payload=payload)  
+        logging.debug(f"Response from Slack (reactions.add): {response_data}")  
+        if not response_data.get("ok"):  
+            error_message = response_data.get("error", "Unknown error")  
+            logging.error(f"Error adding reaction to Slack message: {response_data}")  
+            return {"ok": False, "error": error_message}  
+        else:  
+            return response_data  
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:  
+        logging.error(f"Exception occurred while adding reaction to Slack message: {e}")  
+        return {"ok": False, "error": "An error occurred while trying to add reaction to Slack message. Please try again later."}  
+  
+async def remove_reaction_from_message_async(token, channel, timestamp, name):  
+    payload = {  
+        "channel": channel,  
+        "timestamp": timestamp,  
+        "name": name  
+    }  
+  
+    try:  
+        response_data = await _slack_api_call_async("POST", SLACK_REMOVE_REACTION_URL, token, payload=payload)  
+        logging.debug(f"Response from Slack (reactions.remove): {response_data}")  
+        if not response_data.get("ok"):  
+            error_message = response_data.get("error", "Unknown error")  
+            logging.error(f"Error removing reaction from Slack message: {response_data}")  
+            return {"ok": False, "error": error_message}  
+        else:  
+            return response_data  
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:  
+        logging.error(f"Exception occurred while removing reaction from Slack message: {e}")  
+        return {"ok": False, "error": "An error occurred while trying to remove reaction from Slack message. Please try again later."}  
+  
+CODE_FENCE = "```"  
+  
+def _message_segments(message):  
+    """Group a message's lines into paragraphs and whole fenced code blocks as (text, is_code)."""  
+    segments = []  
+    current, in_code = [], False  
+    for line in message.splitlines(keepends=True):  
+        toggles = line.count(CODE_FENCE) % 2 == 1  
+        if toggles and not in_code:  
+            if current:  
+                segments.append(("".join(current), False))  
+            current, in_code = [line], True  
+        elif toggles and in_code:  
+            current.append(line)  
+            segments.append(("".join(current), True))  
+            current, in_code = [], False  
+        else:  
+            current.append(line)  
+            if not in_code and not line.strip():  
+                segments.append(("".join(current), False))  
+                current = []  
+    if current:  
+        segments.append(("".join(current), in_code))  
+    return segments  
+  
+def _pack_lines(text, max_length):  
+    """Pack lines into pieces of at most max_length, cutting overlong lines at a space when possible."""  
+    pieces, current = [], ""  
+    for line in text.splitlines(keepends=True):  
+        while len(line) > max_length:  
+            # Start the overlong line in the current piece unless that is already half full, so a  
+            # short line before it (e.g. a code block's opening fence) isn't left as a piece of its own  
+            if len(current) > max_length // 2:  
+                pieces.append(current)  
+                current = ""  
+            room = max_length - len(current)  
+            cut = line.rfind(" ", 0, room)  
+            cut = cut + 1 if cut > room // 2 else room  
+            pieces.append(current + line[:cut])  
+            current, line = "", line[cut:]  
+        if len(current) + len(line) > max_length:  
+            pieces.append(current)  
+            current = ""  
+        current += line  
+    if current:  
+        pieces.append(current)  
+    return pieces  
+  
+def _render_chunk(text, reopens_code, closes_code):  
+    if reopens_code:  
+        text = f"{CODE_FENCE}\n" + text  
+    if closes_code:  
+        text = text.rstrip("\n") + f"\n{CODE_FENCE}"  
+    return text  
+  
+def _chunk_message(message, max_length):  
+    """Chunk a message as (text, reopens_code, closes_code) tuples whose texts add back up to the message."""  
+    fence_overhead = len(CODE_FENCE) * 2 + 2  
+    chunks, current, reopens = [], "", False  
+    for segment, is_code in _message_segments(message):  
+        if len(_render_chunk(current, reopens, False)) + len(segment) <= max_length:  
+            current += segment  
+            continue  
+        if current:  
+            chunks.append((current, reopens, False))  
+            current, reopens = "", False  
+        if len(segment) <= max_length:  
+            current = segment  
+            continue  
+        pieces = _pack_lines(segment, max_length - fence_overhead if is_code else max_length)  
+        for i, piece in enumerate(pieces[:-1]):  
+            chunks.append((piece, is_code and i > 0, is_code))  
+        current, reopens = pieces[-1], is_code and len(pieces) > 1  
+    if current:  
+        chunks.append((current, reopens, False))  
+    return chunks  
+  
 def split_message_into_chunks(message: str, max_length: int) -> list:  
-    """Split a message into chunks that are within the specified max length."""  
-    return [message[i:i + max_length] for i in range(0, len(message), max_length)]  
-
-
-
+    """Split a message into chunks within max_length, breaking between paragraphs and code blocks.  
+  
+    A code block that has to be cut is closed at the end of one chunk and re-opened at  
+    the start of the next, so every chunk renders on its own.  
+    """  
+    if len(message) <= max_length:  
+        return [message]  
+  
+    chunks = [_render_chunk(*chunk).rstrip("\n") for chunk in _chunk_message(message, max_length)]  
+    return [chunk for chunk in chunks if chunk.strip()]  
+  
+def split_first_chunk(message: str, max_length: int) -> tuple:  
+    """Split off the first chunk split_message_into_chunks would make; returns (head, rest).  
+  
+    If the cut falls inside a code block, ``head`` closes it and ``rest`` re-opens it, so  
+    ``rest`` can be split the same way again once more text has been added to it.  
+    """  
+    if len(message) <= max_length:  
+        return message, ""  
+  
+    chunks = _chunk_message(message, max_length)  
+    text, reopens, closes = chunks[0]  
+    rest = "".join(chunk[0] for chunk in chunks[1:])  
+    if closes:  
+        rest = f"{CODE_FENCE}\n" + rest  
+    return _render_chunk(text, reopens, closes).rstrip("\n"), rest  
+  
 def extract_channel_id(conversation_id):  
     conversation_id_parts = conversation_id.split(":")  
     if len(conversation_id_parts) >= 3:  
@@ -223,7 +328,7 @@ def get_last_5_messages(token, channel):
     }  
   
     try:  
-        response = requests.get('https://slack.com/api/conversations.history', headers=headers, params=params)  
+        response = _slack_requests_session.get('https://slack.com/api/conversations.history', headers=headers, params=params)  
         response_data = response.json()  
         if response_data.get("ok"):  
             return response_data.get("messages", [])  
@@ -235,20 +340,15 @@ def get_last_5_messages(token, channel):
         return []  
 
 
-def post_message_to_slack(token, channel, text, blocks=None, thread_ts=None):  
-    headers = {  
-        "Content-Type": "application/json",  
-        "Authorization": f"Bearer {token}"  
-    }  
-  
+def build_slack_post_payloads(channel, text, blocks=None, thread_ts=None):  
+    """Build the chat.postMessage payloads for a message, split to fit Slack's block limit."""  
     # Slack block text limit is 3000 characters  
     MAX_BLOCK_TEXT_LENGTH = 3000  
   
     # Split the text into chunks if it exceeds the limit  
     chunks = split_message_into_chunks(text, MAX_BLOCK_TEXT_LENGTH)  
   
-    responses = []  
-  
+    payloads = []  
     for chunk in chunks:  
         payload = {  
             "channel": channel,  
@@ -266,35 +366,71 @@ def post_message_to_slack(token, channel, text, blocks=None, thread_ts=None):
                 }  
             }] + blocks[1:]  # Keep the rest of the blocks unchanged  
             payload["blocks"] = chunk_blocks  
+        payloads.append(payload)  
+    return payloads  
+  
+def _post_message_error(response_data):  
+    error_message = response_data.get("error", "Unknown error")  
+    logging.error(f"Error posting message to Slack: {response_data}")  
+  
+    # Provide a user-friendly message based on the error  
+    user_friendly_message = f"Failed to post message to Slack: {error_message}"  
+    if "invalid_blocks" in error_message:  
+        user_friendly_message += " (The message content may be too long or improperly formatted.)"  
+    elif "channel_not_found" in error_message:  
+        user_friendly_message += " (The specified Slack channel was not found.)"  
+    return {"ok": False, "error": user_friendly_message}  
+  
+def post_message_to_slack(token, channel, text, blocks=None, thread_ts=None):  
+    headers = {  
+        "Content-Type": "application/json",  
+        "Authorization": f"Bearer {token}"  
+    }  
+  
+    responses = []  
   
-        logging.debug(f"Payload to Slack: {json.dumps(payload, indent=2)}")  
+    for payload in build_slack_post_payloads(channel, text, blocks, thread_ts):  
+        log_payload("slack_post", payload, "Payload to Slack")  
   
         try:  
-            response = requests.post(SLACK_CHAT_URL, headers=headers, json=payload)  
+            response = _slack_requests_session.post(SLACK_CHAT_URL, headers=headers, json=payload)  
             response_data = response.json()  
-            logging.debug(f"Response from Slack: {response_data}")  
+            logging.debug("Response from Slack: %s", response_data)  
             if not response_data.get("ok"):  
-                error_message = response_data.get("error", "Unknown error")  
-                logging.error(f"Error posting message to Slack: {response_data}")  
+                responses.append(_post_message_error(response_data))  
+                break  # Stop sending further chunks if there's an error  
+            else:  
+                responses.append(response_data)  
+        except requests.exceptions.RequestException as e:  
+            logging.error(f"Exception occurred while posting message to Slack: {e}")  
+            responses.append({"ok": False, "error": "An error occurred while trying to post the message to Slack. Please try again later."})  
+            break  # Stop sending further chunks if there's an error  
+  
+    return responses  
+  
+async def post_message_to_slack_async(token, channel, text, blocks=None, thread_ts=None):  
+    # Chunks are posted back to back on the shared keep-alive session. Each post waits for the  
+    # previous ack because Slack orders thread replies by arrival, so overlapping them could  
+    # shuffle the chunks.  
+    responses = []  
   
-                # Provide a user-friendly message based on the error  
-                user_friendly_message = f"Failed to post message to Slack: {error_message}"  
-                if "invalid_blocks" in error_message:  
-                    user_friendly_message += " (The message content may be too long or improperly formatted.)"  
-                elif "channel_not_found" in error_message:  
-                    user_friendly_message += " (The specified Slack channel was not found.)"  
+    for payload in build_slack_post_payloads(channel, text, blocks, thread_ts):  
+        log_payload("slack_post", payload, "Payload to Slack")  
   
-                responses.append({"ok": False, "error": user_friendly_message})  
+        try:  
+            response_data = await _slack_api_call_async("POST", SLACK_CHAT_URL, token, payload=payload)  
+            logging.debug("Response from Slack: %s", response_data)  
+            if not response_data.get("ok"):  
+                responses.append(_post_message_error(response_data))  
                 break  # Stop sending further chunks if there's an error  
             else:  
                 responses.append(response_data)  
-        except requests.exceptions.RequestException as e:  
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:  
             logging.error(f"Exception occurred while posting message to Slack: {e}")  
             responses.append({"ok": False, "error": "An error occurred while trying to post the message to Slack. Please try again later."})  
             break  # Stop sending further chunks if there's an error  
   
     return responses  
-
   
 def get_conversation_replies(token, channel, thread_ts):  
     headers = {  
@@ -308,7 +444,7 @@ def get_conversation_replies(token, channel, thread_ts):
     }  
   
     try:  
-        response = requests.get(SLACK_CONVERSATIONS_REPLIES_URL, headers=headers, params=params)  
+        response = _slack_requests_session.get(SLACK_CONVERSATIONS_REPLIES_URL, headers=headers, params=params)  
         response_data = response.json()  
   
         #logging.debug(f"Response from Slack (conversations.replies): {response_data}")  
@@ -324,9 +460,56 @@ def get_conversation_replies(token, channel, thread_ts):
         logging.error(f"Exception occurred while fetching conversation replies from Slack: {e}")  
         return {"ok": False, "error": "An error occurred while trying to fetch conversation replies from Slack. Please try again later."}  
   
-def create_slack_message(main_message: str, footer: str, is_jira_response: bool = False) -> dict:  
+async def update_message_in_slack_async(token, channel, ts, text, blocks=None):  
+    payload = {  
+        "channel": channel,  
+        "ts": ts,  
+        "text": text  
+    }  
+    if blocks:  
+        payload["blocks"] = blocks  
+  
+    try:  
+        response_data = await _slack_api_call_async("POST", SLACK_CHAT_UPDATE_URL, token, payload=payload)  
+        logging.debug(f"Response from Slack (chat.update): {response_data.get('ok')}")  
+        if not response_data.get("ok"):  
+            logging.error(f"Error updating Slack message: {response_data}")  
+            return {"ok": False, "error": response_data.get("error", "Unknown error")}  
+        else:  
+            return response_data  
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:  
+        logging.error(f"Exception occurred while updating Slack message: {e}")  
+        return {"ok": False, "error": "An error occurred while trying to update the Slack message. Please try again later."}  
+  
+async def get_conversation_replies_async(token, channel, thread_ts, oldest=None):  
+    params = {  
+        "channel": channel,  
+        "ts": thread_ts  
+    }  
+    if oldest:  
+        # Only return replies newer than this ts (the parent message is always included)  
+        params["oldest"] = oldest  
+  
+    try:  
+        response_data = await _slack_api_call_async("GET", SLACK_CONVERSATIONS_REPLIES_URL, token, params=params)  
+        logging.debug(f"Response from Slack (conversations.replies) showing threading happening (debug by #uncommenting in slack_utils.py)")  
+  
+        if not response_data.get("ok"):  
+            error_message = response_data.get("error", "Unknown error")  
+            logging.error(f"Error fetching conversation replies from Slack: {response_data}")  
+            return {"ok": False, "error": error_message}  
+        else:  
+            return response_data  
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:  
+        logging.error(f"Exception occurred while fetching conversation replies from Slack: {e}")  
+        return {"ok": False, "error": "An error occurred while trying to fetch conversation replies from Slack. Please try again later."}  
+  
+def create_slack_message(main_message: str, footer: str, is_jira_response: bool = False, is_rendered: bool = False) -> dict:  
+    # is_rendered: main_message is already Slack mrkdwn, so don't convert it again  
     if is_jira_response:  
         formatted_message = convert_jira_response_to_slack_mrkdwn(main_message) + f"\n\n{footer}"  
+    elif is_rendered:  
+        formatted_message = f"{main_message}\n\n{footer}"  
     else:  
         formatted_message = convert_openai_response_to_slack_mrkdwn(main_message) + f"\n\n{footer}"  
   
@@ -354,17 +537,21 @@ def create_slack_message(main_message: str, footer: str, is_jira_response: bool
         ]  
     }  
   
+def parse_slack_message(msg, bot_user_id):  
+    """Format a single Slack message as a chat message dictionary with role and content."""  
+    role = "user" if msg.get("user") != bot_user_id else "assistant"  
+    return {"role": role, "content": msg.get("text", "")}  
+  
 def parse_chat_history(conversation_history, bot_user_id):  
     """Format chat history as a list of message dictionaries with role and content."""  
     chat_history = []  
     if conversation_history:  
         for msg in conversation_history:  
-            role = "user" if msg["user"] != bot_user_id else "assistant"  
-            chat_history.append({"role": role, "content": msg["text"]})  
+            chat_history.append(parse_slack_message(msg, bot_user_id))  
     else:  
         # If no history, set the system message as the first and only message  
         chat_history.append({"role": "system", "content": "This is the first and only message in this chat."})  
   
     # Log the formatted chat history  
-    logging.debug(f"Formatted chat history: {chat_history}")  
+    logging.debug("Formatted chat history: %s", chat_history)  
     return chat_history  
@@ -5,9 +5,11 @@ from botbuilder.core import TurnContext
 import logging  
 from utils.jira_utils import fetch_issue_details, create_jira_task  
 from utils.footer_utils import generate_footer  
-from utils.slack_utils import create_slack_message, post_message_to_slack, add_reaction_to_message, remove_reaction_from_message  
+from utils.slack_utils import create_slack_message, post_message_to_slack_async  
+from utils.slack_reaction_utils import SlackReactions  
 import os  
 from .person_search_utils import search_person  
+from .model_router_utils import set_command_route, reset_command_route  
   
 SLACK_TOKEN = os.environ.get("APPSETTING_SLACK_TOKEN")  
   
@@ -74,12 +76,15 @@ async def handle_special_commands(turn_context: TurnContext) -> bool:
             logging.error("Unable to find thread_ts from the activity.")  
             thread_ts = turn_context.activity.timestamp  # Default to current message timestamp  
         # Add hourglass reaction  
-        add_reaction_to_message(token, channel_id, thread_ts, "hourglass")  
+        reactions = SlackReactions(token, channel_id, thread_ts)  
+        reactions.start()  
+        # Lets APPSETTING_MODEL_COMMAND_OVERRIDES pick the deployment for this command's completions  
+        route_token = set_command_route(command)  
         try:  
             # Handle special commands  
             if command == "test":  
                 response_text = "special test path invoked!"  
-                post_message_to_slack(token, channel_id, response_text, thread_ts=thread_ts)  
+                await post_message_to_slack_async(token, channel_id, response_text, thread_ts=thread_ts)  
             elif command == "formats":  
                 formatting_message = (  
                     "*Formatting Values*:\n\n"  
@@ -89,7 +94,7 @@ async def handle_special_commands(turn_context: TurnContext) -> bool:
                     "* Inline code: `1 backslash before backtick`\n\n"  
                     "* Code block:\n```\nthis is a code block with newline inside\n```\n\n"  
                 )  
-                post_message_to_slack(token, channel_id, formatting_message, thread_ts=thread_ts)  
+                await post_message_to_slack_async(token, channel_id, formatting_message, thread_ts=thread_ts)  
             elif command == "help":  
                 help_message = (  
                     f"*Commands Available*:\n\n"  
@@ -99,7 +104,7 @@ async def handle_special_commands(turn_context: TurnContext) -> bool:
                     f"*$create_jira <subject>*: `Creates a new JIRA ticket with the specified subject.`\n\n"  
                     f"*$person <name>*: `Searches for the specified person and displays their information.`\n\n"  
                 )  
-                post_message_to_slack(token, channel_id, help_message, thread_ts=thread_ts)  
+                await post_message_to_slack_async(token, channel_id, help_message, thread_ts=thread_ts)  
             elif command == "jira":  
                 if len(command_parts) > 1:  
                     input_str = command_parts[1]  
@@ -111,22 +116,22 @@ async def handle_special_commands(turn_context: TurnContext) -> bool:
                             response_time = time.time() - start_time  
                             footer = generate_footer(platform, response_time)  
                             slack_message = create_slack_message(issue_details, footer, is_jira_response=True)  
-                            post_message_to_slack(token, channel_id, slack_message['blocks'][0]['text']['text'], thread_ts=thread_ts)  
+                            await post_message_to_slack_async(token, channel_id, slack_message['blocks'][0]['text']['text'], thread_ts=thread_ts)  
                         except Exception as err:  
                             error_text = f"Error fetching JIRA issue: {err}"  
-                            post_message_to_slack(token, channel_id, error_text, thread_ts=thread_ts)  
+                            await post_message_to_slack_async(token, channel_id, error_text, thread_ts=thread_ts)  
                     else:  
                         invalid_key_text = "Invalid JIRA issue key or URL."  
-                        post_message_to_slack(token, channel_id, invalid_key_text, thread_ts=thread_ts)  
+                        await post_message_to_slack_async(token, channel_id, invalid_key_text, thread_ts=thread_ts)  
                 else:  
-                    post_message_to_slack(token, channel_id, "Please provide a JIRA issue key or URL after the command.", thread_ts=thread_ts)  
+                    await post_message_to_slack_async(token, channel_id, "Please provide a JIRA issue key or URL after the command.", thread_ts=thread_ts)  
             elif command == "create_jira":  
                 subject = turn_context.activity.text.replace('$create_jira', '').strip()  
                 if not subject:  
-                    post_message_to_slack(token, channel_id, "Please provide a subject for the JIRA issue after the command.", thread_ts=thread_ts)  
+                    await post_message_to_slack_async(token, channel_id, "Please provide a subject for the JIRA issue after the command.", thread_ts=thread_ts)  
                 else:  
                     response_message = await create_jira_task(subject, turn_context)  
-                    post_message_to_slack(token, channel_id, response_message, thread_ts=thread_ts)  
+                    await post_message_to_slack_async(token, channel_id, response_message, thread_ts=thread_ts)  
             elif command == "person" and len(command_parts) > 1:  
                 person_name = command_parts[1]  
                 start_time = time.time()  # Start timing the response  
@@ -136,24 +141,25 @@ async def handle_special_commands(turn_context: TurnContext) -> bool:
                     footer = generate_footer(platform, response_time, model_name, input_tokens, output_tokens)  
                     # Create Slack message with the person search results  
                     slack_message = create_slack_message(search_results, footer)  
-                    post_message_to_slack(token, channel_id, slack_message['blocks'][0]['text']['text'], thread_ts=thread_ts)  
+                    await post_message_to_slack_async(token, channel_id, slack_message['blocks'][0]['text']['text'], thread_ts=thread_ts)  
   
                     # Send URLs in a second message  
                     urls_message = "Here are the URLs we used to deduce this information:\n" + "\n".join(urls)  
-                    post_message_to_slack(token, channel_id, urls_message, thread_ts=thread_ts)  
+                    await post_message_to_slack_async(token, channel_id, urls_message, thread_ts=thread_ts)  
                 except Exception as err:  
                     error_text = f"Error searching for person: {err}"  
-                    post_message_to_slack(token, channel_id, error_text, thread_ts=thread_ts)  
+                    await post_message_to_slack_async(token, channel_id, error_text, thread_ts=thread_ts)  
             else:  
                 unknown_command_text = f"I don't understand that command: {command}"  
-                post_message_to_slack(token, channel_id, unknown_command_text, thread_ts=thread_ts)  
+                await post_message_to_slack_async(token, channel_id, unknown_command_text, thread_ts=thread_ts)  
             # Remove hourglass and add greencheckmark reaction  
-            remove_reaction_from_message(token, channel_id, thread_ts, "hourglass")  
-            add_reaction_to_message(token, channel_id, thread_ts, "white_check_mark")  
+            reactions.finish()  
         except Exception as e:  
             logging.error(f"Exception occurred while handling command: {e}")  
-            post_message_to_slack(token, channel_id, f"An error occurred: {e}", thread_ts=thread_ts)  
+            await post_message_to_slack_async(token, channel_id, f"An error occurred: {e}", thread_ts=thread_ts)  
             # Remove hourglass reaction in case of error  
-            remove_reaction_from_message(token, channel_id, thread_ts, "hourglass")  
+            reactions.finish(success=False)  
+        finally:  
+            reset_command_route(route_token)  
         return True  
     return False  
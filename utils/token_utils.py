@@ -0,0 +1,185 @@
+# utils/token_utils.py  
+import os  
+import hashlib  
+import logging  
+import threading  
+from collections import OrderedDict  
+import tiktoken  
+
+# Initialize Tiktoken encoder (shared by every module that counts or chunks tokens)  
+encoding = tiktoken.encoding_for_model("gpt-4")  
+
+# How far back from a window's end chunk_text will look for a page or paragraph break  
+DEFAULT_SNAP_WINDOW_FRACTION = 0.1  
+MAX_SNAP_WINDOW_TOKENS = 2000  
+
+# Bounded caches for token accounting  
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get("APPSETTING_TOKEN_COUNT_CACHE_SIZE", "20000"))  
+THREAD_TOKEN_TOTALS_SIZE = int(os.environ.get("APPSETTING_THREAD_TOKEN_TOTALS_SIZE", "2000"))  
+  
+_token_bytes_cache = {}  
+_token_count_cache = OrderedDict()  # sha1 of content -> token count  
+_thread_token_totals = OrderedDict()  # thread key -> {"messages": n, "last_hash": str, "total": int}  
+_token_cache_lock = threading.Lock()  
+
+
+def _token_bytes(token):  
+    token_bytes = _token_bytes_cache.get(token)  
+    if token_bytes is None:  
+        token_bytes = encoding.decode_single_token_bytes(token)  
+        _token_bytes_cache[token] = token_bytes  
+    return token_bytes  
+
+
+def _snap_window_end(tokens, start, end, snap_window):  
+    """Move ``end`` back to just after the nearest page/paragraph (then line) break within ``snap_window`` tokens."""  
+    lowest = max(start + 1, end - snap_window)  
+    line_break = None  
+    for i in range(end - 1, lowest - 1, -1):  
+        token_bytes = _token_bytes(tokens[i])  
+        if b"\f" in token_bytes or b"\n\n" in token_bytes:  
+            return i + 1  
+        if line_break is None and b"\n" in token_bytes:  
+            line_break = i + 1  
+    return line_break or end  
+
+
+def _char_boundary(tokens, index, lowest):  
+    """Move ``index`` back until ``tokens[index]`` starts a UTF-8 character, so a cut doesn't split one in two."""  
+    while lowest < index < len(tokens) and _token_bytes(tokens[index])[0] & 0xC0 == 0x80:  
+        index -= 1  
+    return index  
+
+
+# Function to chunk text  
+def chunk_text(text, max_chunk_size, overlap=0, snap_to_boundaries=True, snap_window=None):  
+    """Split ``text`` into chunks of at most ``max_chunk_size`` tokens.  
+
+    The document is encoded once and the token array is sliced into windows, each  
+    decoded back to text. Consecutive windows share ``overlap`` tokens. When  
+    ``snap_to_boundaries`` is set, a window ends at the last page break (form feed)  
+    or paragraph break inside its final ``snap_window`` tokens, falling back to a  
+    line break, so chunks don't stop mid-paragraph. Cuts never fall inside a multibyte  
+    character that the encoding split over several tokens.  
+    """  
+    tokens = encoding.encode(text, disallowed_special=())  
+    if len(tokens) <= max_chunk_size:  
+        return [encoding.decode(tokens)]  
+
+    overlap = max(0, min(overlap, max_chunk_size - 1))  
+    if snap_window is None:  
+        snap_window = min(MAX_SNAP_WINDOW_TOKENS, max(1, int(max_chunk_size * DEFAULT_SNAP_WINDOW_FRACTION)))  
+
+    chunks = []  
+    start = 0  
+    while start < len(tokens):  
+        end = min(start + max_chunk_size, len(tokens))  
+        if snap_to_boundaries and end < len(tokens):  
+            end = _snap_window_end(tokens, start, end, snap_window)  
+        # Byte-level tokens (CJK, emoji) can end mid-character, which would decode to U+FFFD on both sides  
+        end = _char_boundary(tokens, end, start + 1)  
+        chunks.append(encoding.decode(tokens[start:end]))  
+        if end >= len(tokens):  
+            break  
+        start = max(_char_boundary(tokens, end - overlap, start + 1), start + 1)  
+
+    logging.debug(f"Chunked {len(tokens)} tokens into {len(chunks)} chunk(s) of up to {max_chunk_size} tokens")  
+    return chunks  
+  
+  
+def _content_hash(text):  
+    return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()  
+  
+  
+def count_tokens_cached(texts):  
+    """Return the token count of each string in ``texts``, encoding only the ones not seen before.  
+  
+    Counts are cached by content hash, so a long Slack thread only pays for its new  
+    messages on each turn. Cold strings are encoded together with ``encode_batch``.  
+    """  
+    hashes = [_content_hash(text) for text in texts]  
+    counts = [None] * len(texts)  
+    cold = {}  
+    with _token_cache_lock:  
+        for i, content_hash in enumerate(hashes):  
+            count = _token_count_cache.get(content_hash)  
+            if count is None:  
+                cold.setdefault(content_hash, []).append(i)  
+            else:  
+                _token_count_cache.move_to_end(content_hash)  
+                counts[i] = count  
+  
+    if cold:  
+        cold_hashes = list(cold)  
+        cold_texts = [texts[cold[content_hash][0]] for content_hash in cold_hashes]  
+        encoded = encoding.encode_batch(cold_texts, disallowed_special=())  
+        with _token_cache_lock:  
+            for content_hash, tokens in zip(cold_hashes, encoded):  
+                _token_count_cache[content_hash] = len(tokens)  
+                for i in cold[content_hash]:  
+                    counts[i] = len(tokens)  
+            while len(_token_count_cache) > TOKEN_COUNT_CACHE_SIZE:  
+                _token_count_cache.popitem(last=False)  
+    return counts  
+  
+  
+def num_tokens_from_string(string: str) -> int:  
+    """Returns the number of tokens in a text string."""  
+    return count_tokens_cached([string])[0]  
+  
+  
+def num_tokens_from_messages(messages, model="gpt-4"):  
+    """Return the number of tokens used by a list of messages."""  
+    tokens_per_message = 3  
+    tokens_per_name = 1  
+    values = []  
+    num_tokens = 0  
+    for message in messages:  
+        num_tokens += tokens_per_message  
+        for key, value in message.items():  
+            values.append(value)  
+            if key == "name":  
+                num_tokens += tokens_per_name  
+    num_tokens += sum(count_tokens_cached(values))  
+    num_tokens += 3  # every reply is primed with  
+    return num_tokens  
+  
+  
+def update_thread_token_total(thread_key, messages):  
+    """Fold a thread's message list into its running token total and return the new total.  
+  
+    ``messages`` is the full, ordered history of the thread. When it extends the list  
+    seen last time, only the new messages are counted; otherwise the total is rebuilt  
+    (cheaply, since per-message counts are cached).  
+    """  
+    with _token_cache_lock:  
+        state = _thread_token_totals.get(thread_key)  
+  
+    counted = 0  
+    total = 0  
+    if state and len(messages) >= state["messages"] > 0:  
+        last_message = messages[state["messages"] - 1]  
+        if _content_hash(last_message.get("content") or "") == state["last_hash"]:  
+            counted, total = state["messages"], state["total"]  
+  
+    new_messages = messages[counted:]  
+    if new_messages:  
+        total += num_tokens_from_messages(new_messages) - 3  # reply priming is only paid once per request  
+  
+    with _token_cache_lock:  
+        _thread_token_totals[thread_key] = {  
+            "messages": len(messages),  
+            "last_hash": _content_hash(messages[-1].get("content") or "") if messages else "",  
+            "total": total  
+        }  
+        _thread_token_totals.move_to_end(thread_key)  
+        while len(_thread_token_totals) > THREAD_TOKEN_TOTALS_SIZE:  
+            _thread_token_totals.popitem(last=False)  
+    return total  
+  
+  
+def get_thread_token_total(thread_key):  
+    """Return the last known token total for a thread, or None if it hasn't been counted."""  
+    with _token_cache_lock:  
+        state = _thread_token_totals.get(thread_key)  
+    return state["total"] if state else None  
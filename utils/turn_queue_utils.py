@@ -0,0 +1,83 @@
+# utils/turn_queue_utils.py  
+import os  
+import zlib  
+import asyncio  
+import logging  
+
+### GLOBAL VARIABLES ###  
+# When enabled, /api/messages acks as soon as the activity is queued instead of after the turn  
+FAST_ACK_ENABLED = os.environ.get("APPSETTING_FAST_ACK_ENABLED", "false").lower() == "true"  
+TURN_QUEUE_WORKERS = int(os.environ.get("APPSETTING_TURN_QUEUE_WORKERS", "8"))  
+# Pending turns allowed per worker before new activities are rejected  
+TURN_QUEUE_MAX_SIZE = int(os.environ.get("APPSETTING_TURN_QUEUE_MAX_SIZE", "100"))  
+TURN_QUEUE_DRAIN_TIMEOUT = float(os.environ.get("APPSETTING_TURN_QUEUE_DRAIN_TIMEOUT", "30"))  
+
+
+class TurnQueue:  
+    """Runs turns in the background on a fixed set of workers, one bounded queue per worker.  
+
+    Turns are routed by key (the conversation / Slack thread), so turns for the same  
+    conversation always land on the same worker and run one at a time in arrival order,  
+    while different conversations spread across workers and run in parallel.  
+    """  
+
+    def __init__(self, workers=TURN_QUEUE_WORKERS, max_size=TURN_QUEUE_MAX_SIZE):  
+        self.worker_count = max(1, workers)  
+        self.max_size = max_size  
+        self._queues = []  
+        self._workers = []  
+        self._accepting = True  
+
+    def _ensure_started(self):  
+        if not self._workers:  
+            self._queues = [asyncio.Queue(maxsize=self.max_size) for _ in range(self.worker_count)]  
+            self._workers = [  
+                asyncio.create_task(self._run_worker(i, queue), name=f"turn-worker-{i}")  
+                for i, queue in enumerate(self._queues)  
+            ]  
+
+    def _queue_for(self, key):  
+        return self._queues[zlib.crc32(str(key).encode("utf-8")) % self.worker_count]  
+
+    def submit(self, key, job):  
+        """Queue ``job`` (a zero-argument coroutine function). Returns False if the turn was rejected."""  
+        if not self._accepting:  
+            return False  
+        self._ensure_started()  
+        try:  
+            self._queue_for(key).put_nowait(job)  
+        except asyncio.QueueFull:  
+            logging.warning(f"Turn queue full for {key}, rejecting activity")  
+            return False  
+        return True  
+
+    async def _run_worker(self, index, queue):  
+        while True:  
+            job = await queue.get()  
+            try:  
+                await job()  
+            except Exception as e:  
+                logging.error(f"[turn-worker-{index}] unhandled error in queued turn: {e}")  
+            finally:  
+                queue.task_done()  
+
+    def pending(self):  
+        return sum(queue.qsize() for queue in self._queues)  
+
+    async def drain(self, timeout=TURN_QUEUE_DRAIN_TIMEOUT):  
+        """Stop accepting turns, let queued ones finish (up to ``timeout``), then stop the workers."""  
+        self._accepting = False  
+        if not self._workers:  
+            return  
+        try:  
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)  
+        except asyncio.TimeoutError:  
+            logging.warning(f"Turn queue drain timed out with {self.pending()} turn(s) still queued")  
+        for worker in self._workers:  
+            worker.cancel()  
+        await asyncio.gather(*self._workers, return_exceptions=True)  
+        self._workers = []  
+        self._queues = []  
+
+
+turn_queue = TurnQueue()  
@@ -1,11 +1,23 @@
+import os  
+import asyncio  
 import logging  
-import requests  
 import base64  
 import hashlib  
+import tempfile  
+import aiohttp  
 from botbuilder.schema import Activity, ActivityTypes  
-from utils.openai_utils import process_and_summarize_text, extract_text_from_pdf, get_openai_image_response  
+from utils.openai_utils import process_and_summarize_text, process_and_summarize_pages, get_openai_image_response  
+from utils.pdf_utils import iter_pdf_page_batches  
 from constants import *  
-from utils.azure_postgres_utils import save_or_fetch_file_hash  
+from utils.azure_postgres_utils import fetch_file_hash_response_async, save_file_hash_response_async  
+from utils.http_utils import run_blocking, get_http_session  
+  
+### GLOBAL VARIABLES ###  
+ATTACHMENT_MAX_BYTES = int(os.environ.get("APPSETTING_ATTACHMENT_MAX_BYTES", str(50 * 1024 * 1024)))  
+# Downloads stay in memory up to this size, then spill to a temporary file  
+ATTACHMENT_SPOOL_THRESHOLD = int(os.environ.get("APPSETTING_ATTACHMENT_SPOOL_THRESHOLD", str(8 * 1024 * 1024)))  
+ATTACHMENT_DOWNLOAD_TIMEOUT = float(os.environ.get("APPSETTING_ATTACHMENT_DOWNLOAD_TIMEOUT", "120"))  
+ATTACHMENT_READ_CHUNK_SIZE = 64 * 1024  
   
 def generate_file_hash(file_content):  
     """Generate a SHA-256 hash for the given file content."""  
@@ -13,14 +25,38 @@ def generate_file_hash(file_content):
     sha256.update(file_content)  
     return sha256.hexdigest()  
   
-def download_and_encode_image(url):  
+async def download_attachment(url):  
+    """Stream an attachment into a spooled temp file, hashing it as it arrives.  
+  
+    Returns ``(file_obj, sha256_hex, size)`` with ``file_obj`` rewound to the start.  
+    The caller owns ``file_obj`` and must close it. Raises ValueError when the file  
+    is larger than ATTACHMENT_MAX_BYTES.  
+    """  
+    sha256 = hashlib.sha256()  
+    size = 0  
+    file_obj = tempfile.SpooledTemporaryFile(max_size=ATTACHMENT_SPOOL_THRESHOLD)  
     try:  
-        response = requests.get(url)  
-        response.raise_for_status()  
-        return base64.b64encode(response.content).decode("utf-8")  
-    except Exception as e:  
-        logging.error(f"Error downloading image: {e}")  
-        return None  
+        timeout = aiohttp.ClientTimeout(total=ATTACHMENT_DOWNLOAD_TIMEOUT)  
+        async with get_http_session().get(url, timeout=timeout) as response:  
+            response.raise_for_status()  
+            if response.content_length and response.content_length > ATTACHMENT_MAX_BYTES:  
+                raise ValueError(f"Attachment is {response.content_length} bytes, over the {ATTACHMENT_MAX_BYTES} byte limit")  
+            async for chunk in response.content.iter_chunked(ATTACHMENT_READ_CHUNK_SIZE):  
+                size += len(chunk)  
+                if size > ATTACHMENT_MAX_BYTES:  
+                    raise ValueError(f"Attachment exceeded the {ATTACHMENT_MAX_BYTES} byte limit")  
+                sha256.update(chunk)  
+                if size > ATTACHMENT_SPOOL_THRESHOLD:  
+                    # Past the threshold the spooled file writes to disk, so keep that off the loop  
+                    await run_blocking(file_obj.write, chunk)  
+                else:  
+                    file_obj.write(chunk)  
+        file_obj.seek(0)  
+        logging.debug(f"Downloaded attachment ({size} bytes, spooled to disk: {size > ATTACHMENT_SPOOL_THRESHOLD})")  
+        return file_obj, sha256.hexdigest(), size  
+    except BaseException:  
+        file_obj.close()  
+        raise  
   
 async def send_message(turn_context, message, thread_ts=None):  
     activity = Activity(  
@@ -33,25 +69,30 @@ async def send_message(turn_context, message, thread_ts=None):
   
 async def process_attachment(turn_context, attachment, process_func, success_message, error_message, thread_ts=None):  
     try:  
-        # Download the file content  
-        response = requests.get(attachment.content_url)  
-        response.raise_for_status()  
-        file_content = response.content  
+        # Download the file once, hashing it as it streams in  
+        file_obj, file_hash, file_size = await download_attachment(attachment.content_url)  
+    except asyncio.TimeoutError:  
+        logging.error(f"Timed out downloading attachment after {ATTACHMENT_DOWNLOAD_TIMEOUT}s")  
+        await send_message(turn_context, error_message, thread_ts)  
+        return  
+    except Exception as e:  
+        logging.error(f"Error downloading attachment: {e}")  
+        await send_message(turn_context, error_message, thread_ts)  
+        return  
   
-        # Generate hash for the file content  
-        file_hash = generate_file_hash(file_content)  
-        logging.info(f"Generated hash for the uploaded document: {file_hash}")  
+    try:  
+        logging.info(f"Generated hash for the uploaded document ({file_size} bytes): {file_hash}")  
   
         # Check if we already have a response for this file hash  
-        existing_openai_response = save_or_fetch_file_hash(file_hash, None, turn_context.activity.from_property.id)  
+        existing_openai_response = await fetch_file_hash_response_async(file_hash)  
   
         if existing_openai_response:  
             logging.info(f"File with hash {file_hash} already exists. Using the existing OpenAI response.")  
             await send_message(turn_context, existing_openai_response, thread_ts)  
         else:  
-            # Process the file and get OpenAI response  
-            openai_response = process_func(attachment.content_url)  
-            save_or_fetch_file_hash(file_hash, openai_response, turn_context.activity.from_property.id)  
+            # Process the downloaded bytes and get OpenAI response  
+            openai_response = await run_blocking(process_func, file_obj)  
+            await save_file_hash_response_async(file_hash, openai_response, turn_context.activity.from_property.id)  
   
             await send_message(turn_context, success_message, thread_ts)  
             await turn_context.send_activity(Activity(type=ActivityTypes.typing))  
@@ -59,37 +100,38 @@ async def process_attachment(turn_context, attachment, process_func, success_mes
     except Exception as e:  
         logging.error(f"Error processing attachment: {e}")  
         await send_message(turn_context, error_message, thread_ts)  
+    finally:  
+        file_obj.close()  
   
-def process_image(url):  
-    base64_image = download_and_encode_image(url)  
+def process_image(file_obj):  
+    base64_image = base64.b64encode(file_obj.read()).decode("utf-8")  
     if base64_image:  
         logging.debug(f"Base64 Image Length: {len(base64_image)}")  
         image_data_url = f"data:image/jpeg;base64,{base64_image}"  
         return get_openai_image_response(image_data_url)  
     else:  
-        raise ValueError("Failed to download or encode image")  
+        raise ValueError("Failed to encode image")  
   
-def process_text(url):  
-    file_content = requests.get(url).text  
+def process_text(file_obj):  
+    file_content = file_obj.read().decode("utf-8", errors="replace")  
     if file_content:  
         attempt_sizes = [5000, 6000, 7000]  
         return process_and_summarize_text(file_content, "Text file", attempt_sizes)  
     else:  
-        raise ValueError("Failed to download or read text file")  
-  
-def process_pdf(url):  
-    response = requests.get(url)  
-    if response.status_code == 200:  
-        with open("temp.pdf", "wb") as pdf_file:  
-            pdf_file.write(response.content)  
-        pdf_text = extract_text_from_pdf("temp.pdf")  
-        if pdf_text:  
-            attempt_sizes = [5000, 6000, 7000]  
-            return process_and_summarize_text(pdf_text, "PDF file", attempt_sizes)  
-        else:  
-            raise ValueError("Failed to extract text from PDF")  
-    else:  
-        raise ValueError("Failed to download PDF")  
+        raise ValueError("Failed to read text file")  
+  
+def _non_empty_page_batches(page_batches):  
+    found_text = False  
+    for start_page, texts in page_batches:  
+        found_text = found_text or any(text.strip() for text in texts)  
+        yield start_page, texts  
+    if not found_text:  
+        raise ValueError("Failed to extract text from PDF")  
+  
+def process_pdf(file_obj):  
+    # Pages stream out of this request's spooled download, so summarizing starts before the last page is parsed  
+    attempt_sizes = [5000, 6000, 7000]  
+    return process_and_summarize_pages(_non_empty_page_batches(iter_pdf_page_batches(file_obj)), "PDF file", attempt_sizes)  
   
 async def handle_image_attachment(turn_context, attachment, thread_ts=None):  
     await process_attachment(turn_context, attachment, process_image, MSG_IMAGE_RECEIVED, MSG_IMAGE_ERROR, thread_ts)  